@@ -7,11 +7,11 @@
 #####################################################################################################################
 
 # This module implements a kind of a singleton for the application configuration
-# to be available application wide
+# to be available application wide. Several sessions can live in the same process, though, every one of them with its
+# own ConfigManager, which is the one 'getManager' returns to the code run on behalf of that session, see 'runInSession'
 
 # TODO
 # 	- Make use of pseudo-private variables
-#	- Implement the part that handles the "resources" and "ipc" folders
 
 # System modules
 import os
@@ -19,6 +19,7 @@ import time
 import json
 import logging
 import importlib
+import contextvars
 # Package modules
 from exceptions import ConfigException
 
@@ -46,49 +47,131 @@ _reportFormatters = {
 
 # Singleton
 _configManager = None
-
-def createConfigManager(configFileName, testmode=False):
-	global _configManager
+# ConfigManager of the session the running code works for, it overrides the application wide one
+_sessionManager = contextvars.ContextVar('sessionManager', default=None)
+# ConfigManagers attached to, in this process, sessions created by other processes, by session working dir
+_attachedManagers = {}
+
+def readConfigObject(configFileName):
+	""" Load the given configuration file, from the config folder """
+	try:
+		configFilePath = os.path.abspath(os.path.join(_configFolder, configFileName))
+		with open(configFilePath) as cf:
+			# Load JSON formatted config
+			return json.load(cf)
+	except Exception as e:
+		raise ConfigException(str(e))
+
+def _useTestFolders():
+	""" Test mode takes the config, run, resources and ipc folders from the test folder """
 	global _configFolder
 	#global _workflowsFolder
 	global _runFolder
 	global _resourcesFolder
 	global _ipcFolder
 	global _sessionWorkingDir
+	_configFolder = os.path.join(_testFolder, "config")
+	#_workflowsFolder = os.path.join(_testFolder, "workflows")
+	_runFolder = os.path.join(_testFolder, "run")
+	_sessionWorkingDir = _runFolder
+	_resourcesFolder = os.path.join(_testFolder, "resources")
+	_ipcFolder = os.path.join(_testFolder, "ipc")
+
+def createConfigManager(configFileName, testmode=False, sessionTag=None):
+	global _configManager
 	if _configManager == None:
 		if testmode:
-			_configFolder = os.path.join(_testFolder, "config")
-			#_workflowsFolder = os.path.join(_testFolder, "workflows")
-			_runFolder = os.path.join(_testFolder, "run")
-			_sessionWorkingDir = _runFolder
-			_resourcesFolder = os.path.join(_testFolder, "resources")
-			_ipcFolder = os.path.join(_testFolder, "ipc")
+			_useTestFolders()
 		# Read the file
-		try:
-			configFilePath = os.path.abspath(os.path.join(_configFolder, configFileName))
-			with open(configFilePath) as cf:
-				# Load JSON formatted config
-				configObject = json.load(cf)
-		except Exception as e:
-			raise ConfigException(str(e))
+		configObject = readConfigObject(configFileName)
 		# Instantiate the ConfigManager
 		if testmode:
 			_configManager = TestConfigManager(configObject)
 		else:
-			_configManager = ConfigurationManager(configObject)
+			_configManager = ConfigurationManager(configObject, sessionTag)
 	return _configManager
 
+def createSession(configFileName, sessionTag=None):
+	""" Create the ConfigManager of a new session, with its own working dir, logs and reports, without making it the
+	application wide one. Code is run on behalf of the session through 'runInSession'
+	"""
+	return createSessionFromConfigObject(readConfigObject(configFileName), sessionTag)
+
+def createSessionFromConfigObject(configObject, sessionTag=None):
+	""" Same as 'createSession', for a job configuration that has already been loaded """
+	try:
+		return ConfigurationManager(configObject, sessionTag)
+	except ConfigException:
+		raise
+	except Exception as e:
+		raise ConfigException("Invalid job configuration, " + str(e))
+
 def getManager():
+	""" ConfigManager of the session the calling code works for, the application wide one by default """
+	sessionManager = _sessionManager.get()
+	if sessionManager:
+		return sessionManager
 	global _configManager
 	if _configManager:
 		return _configManager
 	else:
 		raise ConfigException("ConfigManager has not been initialized yet!")
 
+def runInSession(manager, function, *args):
+	""" Call the given function on behalf of the session of the given ConfigManager, which 'getManager' returns to it.
+	Threads and worker processes started through the executors of the engine work for the same session
+	"""
+	token = _sessionManager.set(manager)
+	try:
+		return function(*args)
+	finally:
+		_sessionManager.reset(token)
+
+def runInWorkerSession(manager, function, *args):
+	""" Same as 'runInSession', for tasks run by worker processes on behalf of sessions of other processes. The sessions
+	the task has attached to are detached once it is done, worker processes outlive the tasks they run
+	"""
+	try:
+		return runInSession(manager, function, *args)
+	finally:
+		detachSessions()
+
+def detachSessions():
+	""" Close the ConfigManagers attached to sessions of other processes, along with their logs and reports """
+	while len(_attachedManagers) > 0:
+		(sessionWorkingDir, manager) = _attachedManagers.popitem()
+		manager.close()
+
+def _attachSession(configObject, sessionWorkingDir):
+	""" Get, in this process, the ConfigManager of a session living in another process, it is how they are unpickled """
+	if _configManager and _configManager.getWorkingDir() == sessionWorkingDir:
+		# It is the application wide session of this process
+		return _configManager
+	if sessionWorkingDir not in _attachedManagers:
+		_attachedManagers[sessionWorkingDir] = ConfigurationManager(configObject, sessionWorkingDir=sessionWorkingDir)
+	return _attachedManagers[sessionWorkingDir]
+
+def _attachTestSession(configObject, sessionWorkingDir):
+	""" Same as '_attachSession', for the test session of the process that runs the unit tests """
+	if _configManager and _configManager.getWorkingDir() == sessionWorkingDir:
+		return _configManager
+	if sessionWorkingDir not in _attachedManagers:
+		_useTestFolders()
+		_attachedManagers[sessionWorkingDir] = TestConfigManager(configObject)
+	return _attachedManagers[sessionWorkingDir]
+
+def _createLogger(name):
+	""" Loggers are private to the session that creates them, instead of being registered application wide by name, so
+	sessions living in the same process don't get each other's messages
+	"""
+	return logging.Logger(name)
+
 
 class ConfigurationManager:
-	def __init__(self, configObject):
+	def __init__(self, configObject, sessionTag=None, sessionWorkingDir=None):
+		""" A new session is created, unless the working dir of an existing one is given, which is attached to """
 		self.__configObject = configObject
+		self.__sessionStartTime = time.time()
 		dirsToCheck = []
 		if "runFolder" not in configObject:
 			self.__runFolder = _runFolder
@@ -110,19 +193,27 @@ class ConfigurationManager:
 		# If we get here, we can keep going
 		try:
 			self.__sessionId = time.strftime('%Y.%m.%d_%H.%M') + "-" + configObject['jobId']
+			# Tagged sessions, e.g. workers, can share the job config file with others started at the same time
+			if sessionTag:
+				self.__sessionId += "-" + sessionTag
 		except Exception as e:
 			raise ConfigException("Error while trying to set up session ID, " + str(e))
+		attached = sessionWorkingDir != None
+		if attached:
+			self.__sessionId = os.path.basename(sessionWorkingDir)
 		# Create session working dir
 		self.__sessionWorkingDir = os.path.abspath(os.path.join(self.__runFolder, self.__sessionId))
+		if attached:
+			self.__sessionWorkingDir = sessionWorkingDir
 		try:
-			os.mkdir(self.__sessionWorkingDir)
+			os.makedirs(self.__sessionWorkingDir, exist_ok=attached)
 		except Exception as e:
 			raise ConfigException("ERROR while trying to create a working dir for session " \
 				+ self.__sessionId + ", " + str(e))
 		# Create session log folder
 		self.__sessionLogFolder = os.path.abspath(os.path.join(self.__sessionWorkingDir, 'logs'))
 		try:
-			os.mkdir(self.__sessionLogFolder)
+			os.makedirs(self.__sessionLogFolder, exist_ok=attached)
 		except Exception as e:
 			raise ConfigException("Could not create log folder " + self.__sessionLogFolder + ", error " + str(e))
 		# Load logger configuration
@@ -133,15 +224,17 @@ class ConfigurationManager:
 		if "formatters" in configObject['logger']['loglevel']:
 			configuredLogFormatters = configObject['logger']['loglevel']['formatters']
 		self.__logHandlers = []
+		# Logs and reports are opened for appending, the session is new, but other processes attached to it write to
+		# them as well
 		logHandlersPrefix = configObject['jobId'] + '-'
 		logHandlersExtension = '.log'
 		# Get own logger
-		self.__logger = logging.getLogger(__name__)
+		self.__logger = _createLogger(__name__)
 		self.__logger.setLevel(getattr(logging, self.__logLevel))
 		for llevel, lformat in configuredLogFormatters.items():
 			logfile = os.path.join(self.__sessionLogFolder, logHandlersPrefix + llevel.lower() + logHandlersExtension)
 			lformatter = logging.Formatter(lformat)
-			lhandler = logging.FileHandler(logfile, mode='w')
+			lhandler = logging.FileHandler(logfile, mode='a')
 			lhandler.setLevel(getattr(logging, llevel))
 			lhandler.setFormatter(lformatter)
 			self.__logHandlers.append(lhandler)
@@ -151,25 +244,35 @@ class ConfigurationManager:
 		# Initialize reports
 		self.__sessionReportsFolder = os.path.abspath(os.path.join(self.__sessionWorkingDir, 'reports'))
 		try:
-			os.mkdir(self.__sessionReportsFolder)
+			os.makedirs(self.__sessionReportsFolder, exist_ok=attached)
 		except Exception as e:
 			raise ConfigException("Could not create reports folder " + self.__sessionReportsFolder + ", error " + str(e))
 		# TODO Check config file for formatting options
 		self.__reportFormatters = _reportFormatters
 		reportFileNormal = os.path.join(self.__sessionReportsFolder, configObject['jobId'] + '.report')
 		reportFileWarnings = os.path.join(self.__sessionReportsFolder, configObject['jobId'] + '-warn_err.report')
-		normalHandler = logging.FileHandler(reportFileNormal, mode="w")
-		warnerrHandler = logging.FileHandler(reportFileWarnings, mode="w")
+		normalHandler = logging.FileHandler(reportFileNormal, mode='a')
+		warnerrHandler = logging.FileHandler(reportFileWarnings, mode='a')
 		normalHandler.setLevel(logging.INFO)
 		warnerrHandler.setLevel(logging.WARN)
 		normalHandler.setFormatter(logging.Formatter(self.__reportFormatters['normal']))
 		warnerrHandler.setFormatter(logging.Formatter(self.__reportFormatters['warnerr']))
-		self.__reporter = logging.getLogger(configObject['jobId'] + '-main')
+		self.__reporter = _createLogger(configObject['jobId'] + '-main')
 		self.__reporter.addHandler(normalHandler)
 		self.__reporter.addHandler(warnerrHandler)
 		self.__reporter.setLevel(logging.INFO)
 		self.__reportHandlers = [normalHandler, warnerrHandler]
 		self.__resourcesFolder = os.path.abspath(_resourcesFolder)
+		self.__ipcFolder = os.path.abspath(_ipcFolder)
+
+	def __reduce__(self):
+		""" Sessions are sent to other processes by reference, they attach to the same working dir """
+		return (_attachSession, (self.__configObject, self.__sessionWorkingDir))
+
+	def close(self):
+		""" Close the logs and reports of the session, the ConfigManager can't be used any more """
+		for handler in self.__logHandlers + self.__reportHandlers:
+			handler.close()
 
 	def getReporter(self):
 		""" It returns the main reporter created by the ConfigManager """
@@ -177,7 +280,7 @@ class ConfigurationManager:
 
 	def createReporter(self, name):
 		""" Return a reporter customized for the given name """
-		rep = logging.getLogger(name)
+		rep = _createLogger(name)
 		for handler in self.__reportHandlers:
 			rep.addHandler(handler)
 		rep.setLevel(logging.INFO)
@@ -197,7 +300,7 @@ class ConfigurationManager:
 	def createLogger(self, name):
 		""" Return a logger customized for the given name """
 		self.__logger.debug("Creating logger with name " + name)
-		lg = logging.getLogger(name)
+		lg = _createLogger(name)
 		for handler in self.__logHandlers:
 			lg.addHandler(handler)
 		lg.setLevel(getattr(logging, self.__logLevel))
@@ -257,11 +360,32 @@ class ConfigurationManager:
 	def getResourcesFolder(self):
 		return self.__resourcesFolder
 
+	def getIpcFolder(self):
+		""" Folder shared by the processes working together on the same workflows, e.g. through the task queue """
+		return self.__ipcFolder
+
+	def getSessionDeadline(self):
+		""" Time, as given by time.time(), by which the session must be finished, 'None' if the job config file sets no
+		'sessionTimeout', in seconds
+		"""
+		if "sessionTimeout" in self.__configObject:
+			return self.__sessionStartTime + float(self.__configObject['sessionTimeout'])
+		return None
+
+	def getNodeResources(self):
+		""" Resource capacities of the node set in the job config file, e.g. {"cpu": 8, "memMB": 16000}, the ones
+		not set there are detected by the resource budget
+		"""
+		if "nodeResources" in self.__configObject:
+			return self.__configObject['nodeResources']
+		return {}
+
 
 # UNIT TEST - Config Manager for unit testing factories #############################################################
 class TestConfigManager:
 	def __init__(self, configObject):
 		self.__configObject = configObject
+		self.__sessionStartTime = time.time()
 		dirsToCheck = []
 		if "runFolder" not in configObject:
 			self.__runFolder = _runFolder
@@ -302,7 +426,7 @@ class TestConfigManager:
 		logHandlersPrefix = configObject['jobId'] + '-'
 		logHandlersExtension = '.log'
 		# Get own logger
-		self.__logger = logging.getLogger(__name__)
+		self.__logger = _createLogger(__name__)
 		self.__logger.setLevel(getattr(logging, self.__logLevel))
 		for llevel, lformat in configuredLogFormatters.items():
 			logfile = os.path.join(self.__sessionLogFolder, logHandlersPrefix + llevel.lower() + logHandlersExtension)
@@ -332,13 +456,22 @@ class TestConfigManager:
 		consoleHandler = logging.StreamHandler()
 		consoleHandler.setLevel(logging.INFO)
 		consoleHandler.setFormatter(logging.Formatter(self.__reportFormatters['warnerr']))
-		self.__reporter = logging.getLogger(configObject['jobId'] + '-main')
+		self.__reporter = _createLogger(configObject['jobId'] + '-main')
 		self.__reporter.addHandler(normalHandler)
 		self.__reporter.addHandler(warnerrHandler)
 		self.__reporter.addHandler(consoleHandler)
 		self.__reporter.setLevel(logging.INFO)
 		self.__reportHandlers = [normalHandler, warnerrHandler, consoleHandler]
 		self.__resourcesFolder = os.path.abspath(_resourcesFolder)
+		self.__ipcFolder = os.path.abspath(_ipcFolder)
+
+	def __reduce__(self):
+		""" Test sessions are sent to worker processes by reference too, they use the test folders """
+		return (_attachTestSession, (self.__configObject, self.__sessionWorkingDir))
+
+	def close(self):
+		for handler in self.__logHandlers + self.__reportHandlers:
+			handler.close()
 
 	def getReporter(self):
 		""" It returns the main reporter created by the ConfigManager """
@@ -346,7 +479,7 @@ class TestConfigManager:
 
 	def createReporter(self, name):
 		""" Return a reporter customized for the given name """
-		rep = logging.getLogger(name)
+		rep = _createLogger(name)
 		for handler in self.__reportHandlers:
 			rep.addHandler(handler)
 		rep.setLevel(logging.INFO)
@@ -366,7 +499,7 @@ class TestConfigManager:
 	def createLogger(self, name):
 		""" Return a logger customized for the given name """
 		self.__logger.debug("Creating logger with name " + name)
-		lg = logging.getLogger(name)
+		lg = _createLogger(name)
 		for handler in self.__logHandlers:
 			lg.addHandler(handler)
 		lg.setLevel(getattr(logging, self.__logLevel))
@@ -403,6 +536,26 @@ class TestConfigManager:
 	def getResourcesFolder(self):
 		return self.__resourcesFolder
 
+	def getIpcFolder(self):
+		""" Folder shared by the processes working together on the same workflows, e.g. through the task queue """
+		return self.__ipcFolder
+
+	def getSessionDeadline(self):
+		""" Time, as given by time.time(), by which the session must be finished, 'None' if the job config file sets no
+		'sessionTimeout', in seconds
+		"""
+		if "sessionTimeout" in self.__configObject:
+			return self.__sessionStartTime + float(self.__configObject['sessionTimeout'])
+		return None
+
+	def getNodeResources(self):
+		""" Resource capacities of the node set in the job config file, e.g. {"cpu": 8, "memMB": 16000}, the ones
+		not set there are detected by the resource budget
+		"""
+		if "nodeResources" in self.__configObject:
+			return self.__configObject['nodeResources']
+		return {}
+
 	def getLogger(self):
 		return self.__logger
 
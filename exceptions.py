@@ -23,3 +23,7 @@ class WorkflowRunnerException(AppException):
 class WfConfManagerException(AppException):
 	def __init__(self, value):
 		super(WfConfManagerException, self).__init__(value)
+
+class WorkflowCancelledException(WorkflowRunnerException):
+	def __init__(self, value):
+		super(WorkflowCancelledException, self).__init__(value)
@@ -9,33 +9,193 @@
 # Import modules from system
 import os
 import sys
+import socket
 import logging
 import argparse
+import threading
 # Import modules from package
 import configManager
 import exceptions
-import workflows.workflowEngine as wfEngineFactory
+import workflows.completionJournal as completionJournal
+import workflows.payloadBuffers as payloadBuffers
+import workflows.taskQueue as taskQueue
+import sessionServer
 
 def getCmdl():
 	cmdl_version = '2015.06.15'
 	parser = argparse.ArgumentParser(conflict_handler='resolve')
-	parser.add_argument("configFileName", metavar='config_file', \
-		help='Application configuration file')
+	parser.add_argument("configFileNames", metavar='config_file', nargs='+', \
+		help='Application configuration file, several of them, or manifests listing them, in batch mode')
 	parser.add_argument('-v', '--version', help='display version information', \
 		action='version', version=cmdl_version + ' %(prog)s ')
 	parser.add_argument("-t", '--test', metavar='testFactory', dest='testFactory', help='run the unit tests for the given WorkflowRunner \
 		Factory', type=str)
+	parser.add_argument("-r", '--resume', metavar='sessionDir', dest='resumeSessionDir', help='skip the operations \
+		completed by the given previous session, as recorded in its completion journal', type=str)
+	parser.add_argument("-w", '--worker', dest='worker', help='run as a worker, draining the task queue in the ipc \
+		folder until interrupted, instead of running the main workflow', action='store_true')
+	parser.add_argument("-s", '--serve', dest='serve', help='run as a daemon, running the jobs submitted through the \
+		Unix socket in the ipc folder until asked to shut down, instead of running the main workflow', \
+		action='store_true')
+	parser.add_argument("-b", '--batch', dest='batch', help='run the jobs of all the given configuration files as \
+		concurrent sessions of this process, a configuration file holding a JSON list is a manifest of configuration \
+		files', action='store_true')
 	args = parser.parse_args()
+	if len(args.configFileNames) > 1 and not args.batch:
+		parser.error("only one configuration file can be given, unless running in batch mode")
+	if args.batch:
+		# Batch mode only runs the main workflow of every session, from scratch
+		ignored = [option for (option, given) in [('--test', args.testFactory), ('--resume', args.resumeSessionDir), \
+			('--worker', args.worker), ('--serve', args.serve)] if given]
+		if len(ignored) > 0:
+			parser.error("argument -b/--batch: not allowed with " + ", ".join(ignored))
 	return args
 
+def runSession(config, resumeSessionDir=None):
+	""" Run the main workflow of the given session, followed by either its success or its error workflow, it returns
+	whether there was an error
+	"""
+	error = False
+	if resumeSessionDir:
+		nCompleted = completionJournal.resumeFrom(resumeSessionDir)
+		config.getReporter().info("Resuming session " + resumeSessionDir + ", " + str(nCompleted) \
+			+ " operations were completed by then")
+	# Instantiate the main Workflow
+	try:
+		mainWorkflow = config.getMainWorkflowInstance()
+		mainWorkflow.execute()
+	except Exception as e:
+		config.getReporter().error("An exception occurred while running session '" \
+			+ config.getSessionId() + "', ERROR message: " + str(e))
+		error = True or error
+	else:
+		if mainWorkflow.isResultSuccess():
+			config.getReporter().info("Successful session: '" + config.getSessionId() + "'")
+		else:
+			config.getReporter().error("Error running session '" + config.getSessionId() + "', ERROR: " \
+				+ mainWorkflow.getResultMessage())
+			error = True or error
+	finally:
+		if not error:
+			# Execute success workflow
+			try:
+				swf = config.getSuccessWorkflowInstance()
+				swf.execute()
+			except exceptions.ConfigException as c:
+				config.getReporter().warning("There is no success workflow defined for session '" \
+					+ config.getSessionId() + "'")
+			except Exception as e:
+				config.getReporter().error("An exception occurred while running the success workflow " \
+					+ "for session '" + config.getSessionId() + "', ERROR message: " + str(e))
+				error = True or error
+			else:
+				error = not swf.isResultSuccess() or error
+		else:
+			# Execute error workflow
+			try:
+				ewf = config.getErrorWorkflowInstance()
+				ewf.execute()
+			except exceptions.ConfigException as c:
+				config.getReporter().warning("There is no error workflow defined for session '" \
+					+ config.getSessionId() + "'")
+			except Exception as e:
+				config.getReporter().error("An exception occurred while running the error workflow " \
+					+ "for session '" + config.getSessionId() + "', ERROR message: " + str(e))
+				error = True or error
+			else:
+				error = not ewf.isResultSuccess() or error
+		payloadBuffers.releaseSession(config.getWorkingDir())
+	return error
+
+def flagSessionError(config):
+	""" Flag the working dir of the session as ERROR, so another process knows there was a problem """
+	errorFlagFile = os.path.join(config.getWorkingDir(), "workflow_result_flag.error")
+	with open(errorFlagFile, "w") as eflag:
+		eflag.write("This workflow DID NOT COMPLETE its execution, please, see logs for more details")
+
+def runDetachedSession(config, resumeSessionDir=None):
+	""" Run, from start to end, a session created with 'configManager.createSession', as 'main' does with the
+	application wide one, and close it. It returns whether there was an error
+	"""
+	config.getReporter().info("Session " + config.getSessionId() + " Started")
+	error = True
+	try:
+		error = runSession(config, resumeSessionDir)
+	except Exception as e:
+		config.getReporter().error("ERROR!!! " + str(e))
+	finally:
+		config.getReporter().info("END of session " + config.getSessionId())
+		if error:
+			try:
+				flagSessionError(config)
+			except OSError as e:
+				config.getReporter().error("Could not flag session " + config.getSessionId() + " as failed, " + str(e))
+		config.close()
+	return error
+
+def getBatchConfigFileNames(configFileNames, manifests=()):
+	""" Expand the manifests among the given configuration files, they hold a JSON list of configuration files.
+	'manifests' are the ones being expanded, a manifest listing any of them, directly or not, is a configuration error
+	"""
+	batch = []
+	for configFileName in configFileNames:
+		configObject = configManager.readConfigObject(configFileName)
+		if isinstance(configObject, list):
+			manifestName = os.path.normpath(configFileName)
+			if manifestName in manifests:
+				raise exceptions.ConfigException("Cycle of manifests, " + " -> ".join(manifests + (manifestName,)))
+			batch.extend(getBatchConfigFileNames(configObject, manifests + (manifestName,)))
+		else:
+			batch.append(configFileName)
+	return batch
+
+def _runBatchSession(session, errors):
+	errors[session.getSessionId()] = runDetachedSession(session)
+
+def runBatch(configFileNames):
+	""" Run the jobs of the given configuration files concurrently, every one of them in a session of its own, it
+	returns whether any of them failed
+	"""
+	sessions = []
+	for configFileName in getBatchConfigFileNames(configFileNames):
+		sessionTag = "b" + str(os.getpid()) + "-" + str(len(sessions) + 1)
+		sessions.append((configFileName, configManager.createSession(configFileName, sessionTag)))
+	errors = {}
+	threads = []
+	for (configFileName, session) in sessions:
+		thread = threading.Thread(target=configManager.runInSession, args=(session, _runBatchSession, session, errors))
+		thread.start()
+		threads.append(thread)
+	for thread in threads:
+		thread.join()
+	for (configFileName, session) in sessions:
+		result = "FAILED"
+		if not errors.get(session.getSessionId(), True):
+			result = "Successful"
+		print(configFileName + ": " + result + " session '" + session.getSessionId() + "'")
+	logging.shutdown()
+	return True in errors.values() or len(errors) < len(sessions)
+
 def main():
 	# Get the command line arguments
 	args = getCmdl()
+	if args.batch:
+		try:
+			error = runBatch(args.configFileNames)
+		except exceptions.ConfigException as e:
+			print(str(e))
+			error = True
+		sys.exit(1 if error else 0)
 	# Read the configuration
 	testmode = False
 	if args.testFactory:
 		testmode = True
-	config = configManager.createConfigManager(args.configFileName, testmode)
+	sessionTag = None
+	if args.worker:
+		sessionTag = "worker-" + socket.gethostname() + "-" + str(os.getpid())
+	elif args.serve:
+		sessionTag = "daemon-" + str(os.getpid())
+	config = configManager.createConfigManager(args.configFileNames[0], testmode, sessionTag)
 	# Mark the start of the session
 	config.getReporter().info("Session " + config.getSessionId() + " Started")
 
@@ -58,51 +218,15 @@ def main():
 			config.getLogger().debug(msg)
 			config.getReporter().info(msg)
 			wfactory.unitTest()
-		else:
-			# Instantiate the main Workflow
+		elif args.worker:
 			try:
-				mainWorkflow = config.getMainWorkflowInstance()
-				mainWorkflow.execute()
-			except Exception as e:
-				config.getReporter().error("An exception occurred while running session '" \
-					+ config.getSessionId() + "', ERROR message: " + str(e))
-				error = True or error
-			else:
-				if mainWorkflow.isResultSuccess():
-					config.getReporter().info("Successful session: '" + config.getSessionId() + "'")
-				else:
-					config.getReporter().error("Error running session '" + config.getSessionId() + "', ERROR: " \
-						+ mainWorkflow.getResultMessage())
-					error = True or error
-			finally:
-				if not error:
-					# Execute success workflow
-					try:
-						swf = config.getSuccessWorkflowInstance()
-						swf.execute()
-					except ConfigException as c:
-						config.getReporter().warning("There is no success workflow defined for session '" \
-							+ config.getSessionId() + "'")
-					except Exception as e:
-						config.getReporter().error("An exception occurred while running the success workflow " \
-							+ "for session '" + config.getSessionId() + "', ERROR message: " + str(e))
-						error = True or error
-					else:
-						error = not swf.isResultSuccess() or error
-				else:
-					# Execute error workflow
-					try:
-						ewf = config.getErrorWorkflowInstance()
-						ewf.execute()
-					except ConfigException as c:
-						config.getReporter().warning("There is no error workflow defined for session '" \
-							+ config.getSessionId() + "'")
-					except Exception as e:
-						config.getReporter().error("An exception occurred while running the error workflow " \
-							+ "for session '" + config.getSessionId() + "', ERROR message: " + str(e))
-						error = True or error
-					else:
-						error = not ewf.isResultSuccess() or error
+				taskQueue.runWorker()
+			except KeyboardInterrupt:
+				config.getReporter().info("Worker interrupted")
+		elif args.serve:
+			sessionServer.serve(runDetachedSession)
+		else:
+			error = runSession(config, args.resumeSessionDir)
 	except Exception as e:
 		config.getReporter().error("ERROR!!! " + str(e))
 		print(str(e))
@@ -111,11 +235,8 @@ def main():
 		config.getReporter().info("END of session " + config.getSessionId())
 		logging.shutdown()
 		if error:
-			# TODO Flag the folder as ERROR, so another process knows there was a problem
-			errorFlagFile = os.path.join(configManager.getManager().getWorkingDir(), "workflow_result_flag.error")
 			try:
-				with open(errorFlagFile, "w") as eflag:
-					eflag.write("This workflow DID NOT COMPLETE its execution, please, see logs for more details")
+				flagSessionError(config)
 			finally:
 				sys.exit(1)
 
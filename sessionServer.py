@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+#####################################################################################################################
+#										Session Server for the Daemon Mode											#
+#####################################################################################################################
+
+# This module implements the daemon mode of the application, 'main_app.py --serve'. The daemon listens on a Unix socket
+# in the ipc folder and runs the jobs submitted to it as sessions of its own, concurrently, with the factories and the
+# executor pools already warm. The protocol is one JSON object per line, both ways:
+#	- {"command": "submit", "config": {<job config>}} or {"command": "submit", "configFileName": "<file>"}, with an
+#		optional "resume": "<session dir>", it answers {"sessionId": "<id>"} right away
+#	- {"command": "status", "sessionId": "<id>"}, it answers the status of that session
+#	- {"command": "watch", "sessionId": "<id>"}, it answers the status of that session every time it changes, until it
+#		has finished
+#	- {"command": "list"}, it answers {"sessions": [<status>, ...]}
+#	- {"command": "shutdown"}, the daemon stops accepting submissions and it exits once its sessions have finished
+# Errors are answered as {"error": "<message>"}
+
+import os
+import json
+import time
+import socket
+import threading
+import socketserver
+import configManager
+from exceptions import ConfigException
+
+_socketFileName = 'wfe.sock'
+# Seconds between checks of the sessions still running while the daemon shuts down
+_shutdownPollInterval = 0.5
+
+def getSocketPath():
+	return os.path.join(configManager.getManager().getIpcFolder(), _socketFileName)
+
+
+class SessionRegistry:
+	""" Status of the sessions submitted to the daemon, the handlers of the connections wait on it for changes """
+	def __init__(self):
+		self.__sessions = {}
+		self.__changed = threading.Condition()
+		self.__sequence = 0
+
+	def nextSessionTag(self):
+		""" Sessions are tagged, so the same job can be submitted several times in a row """
+		with self.__changed:
+			self.__sequence += 1
+			return "d" + str(os.getpid()) + "-" + str(self.__sequence)
+
+	def update(self, session, state):
+		with self.__changed:
+			status = self.__sessions.setdefault(session.getSessionId(), {'sessionId': session.getSessionId(), \
+				'workingDir': session.getWorkingDir(), 'submittedAt': time.time()})
+			status['state'] = state
+			if state in ['succeeded', 'failed']:
+				status['finishedAt'] = time.time()
+			self.__changed.notify_all()
+
+	def getStatus(self, sessionId):
+		with self.__changed:
+			if sessionId not in self.__sessions:
+				return None
+			return dict(self.__sessions[sessionId])
+
+	def listSessions(self):
+		with self.__changed:
+			return [dict(status) for status in self.__sessions.values()]
+
+	def waitForChange(self, sessionId, lastStatus, timeout=None):
+		""" Block until the status of the given session differs from the given one, it returns the new status """
+		with self.__changed:
+			self.__changed.wait_for(lambda: self.__sessions[sessionId] != lastStatus, timeout)
+			return dict(self.__sessions[sessionId])
+
+	def countRunning(self):
+		with self.__changed:
+			return len([s for s in self.__sessions.values() if s['state'] not in ['succeeded', 'failed']])
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+	""" Connection of a client, it serves its requests, one per line, until it disconnects """
+	def handle(self):
+		for line in self.rfile:
+			if not line.strip():
+				continue
+			try:
+				request = json.loads(line.decode('utf8'))
+				command = request['command']
+				if command == 'submit':
+					self._reply({'sessionId': self.server.submit(request)})
+				elif command == 'status':
+					self._reply(self._getStatus(request))
+				elif command == 'watch':
+					self._watch(request)
+				elif command == 'list':
+					self._reply({'sessions': self.server.getRegistry().listSessions()})
+				elif command == 'shutdown':
+					self._reply({'shutdown': True})
+					self.server.requestShutdown()
+				else:
+					self._reply({'error': "Unknown command '" + str(command) + "'"})
+			except BrokenPipeError:
+				return
+			except Exception as e:
+				self._reply({'error': str(e)})
+
+	def _reply(self, response):
+		self.wfile.write((json.dumps(response) + "\n").encode('utf8'))
+		self.wfile.flush()
+
+	def _getStatus(self, request):
+		status = self.server.getRegistry().getStatus(request['sessionId'])
+		if status == None:
+			raise ConfigException("Unknown session '" + str(request['sessionId']) + "'")
+		return status
+
+	def _watch(self, request):
+		status = self._getStatus(request)
+		self._reply(status)
+		while status['state'] not in ['succeeded', 'failed']:
+			status = self.server.getRegistry().waitForChange(status['sessionId'], status)
+			self._reply(status)
+
+
+class SessionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	""" Daemon accepting job submissions on a Unix socket, every submitted job runs as a session on a thread of its own
+	"""
+	daemon_threads = True
+
+	def __init__(self, socketPath, runSession):
+		self.__runSession = runSession
+		self.__registry = SessionRegistry()
+		self.__shuttingDown = False
+		self.__reporter = configManager.getManager().getReporter()
+		socketserver.UnixStreamServer.__init__(self, socketPath, _RequestHandler)
+
+	def getRegistry(self):
+		return self.__registry
+
+	def submit(self, request):
+		""" Create a session for the submitted job and start running it, it returns the ID of the session """
+		if self.__shuttingDown:
+			raise ConfigException("The daemon is shutting down, it does not accept submissions")
+		sessionTag = self.__registry.nextSessionTag()
+		if 'config' in request:
+			session = configManager.createSessionFromConfigObject(request['config'], sessionTag)
+		else:
+			session = configManager.createSession(request['configFileName'], sessionTag)
+		self.__registry.update(session, 'running')
+		self.__reporter.info("Session " + session.getSessionId() + " submitted")
+		thread = threading.Thread(target=configManager.runInSession, \
+			args=(session, self._runSubmittedSession, session, request.get('resume')))
+		thread.start()
+		return session.getSessionId()
+
+	def _runSubmittedSession(self, session, resumeSessionDir):
+		error = True
+		try:
+			error = self.__runSession(session, resumeSessionDir)
+		finally:
+			state = 'failed' if error else 'succeeded'
+			self.__registry.update(session, state)
+			self.__reporter.info("Session " + session.getSessionId() + " " + state)
+
+	def requestShutdown(self):
+		""" Stop accepting submissions, the daemon exits once the running sessions have finished """
+		if self.__shuttingDown:
+			return
+		self.__shuttingDown = True
+		self.__reporter.info("Shutdown requested, " + str(self.__registry.countRunning()) + " sessions still running")
+		threading.Thread(target=self._shutdownWhenIdle).start()
+
+	def _shutdownWhenIdle(self):
+		while self.__registry.countRunning() > 0:
+			time.sleep(_shutdownPollInterval)
+		self.shutdown()
+
+
+def serve(runSession):
+	""" Run the daemon until it is asked to shut down, or interrupted. Jobs are run by the given function, that gets
+	the ConfigManager of their session and the session dir to resume, if any, runs the session to its end and returns
+	whether there was an error
+	"""
+	socketPath = getSocketPath()
+	os.makedirs(os.path.dirname(socketPath), exist_ok=True)
+	if os.path.exists(socketPath):
+		# A socket left behind by a daemon that did not exit cleanly can be reused, a live one can't
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			probe.connect(socketPath)
+		except OSError:
+			os.remove(socketPath)
+		else:
+			raise ConfigException("There is a daemon already listening on " + socketPath)
+		finally:
+			probe.close()
+	server = SessionServer(socketPath, runSession)
+	configManager.getManager().getReporter().info("Daemon listening on " + socketPath)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		configManager.getManager().getReporter().info("Daemon interrupted")
+	finally:
+		server.server_close()
+		os.remove(socketPath)
+
+def request(socketPath, message):
+	""" Client side, send a request to the daemon and yield its answers, one per line, until it stops answering """
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+		client.connect(socketPath)
+		client.sendall((json.dumps(message) + "\n").encode('utf8'))
+		client.shutdown(socket.SHUT_WR)
+		with client.makefile('rb') as responses:
+			for line in responses:
+				yield json.loads(line.decode('utf8'))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+#####################################################################################################################
+#						ASYNC SCENARIO Runner - Scripted behaviour, as coroutines, for testing the engine			#
+#####################################################################################################################
+""" This factory produces the coroutine version of the runners of the 'scenarioRunner' factory, they take the same
+config file keys. Engines in 'asyncio' mode run them on their event loop, anywhere else they get an event loop of their
+own when executed
+"""
+
+# Running as part of the Workflow Engine ############################################################################
+if not __name__ == "__main__":
+	import workflows.scenarioRunner as scenarioRunner
+	from workflows.scenarioRunner import ScenarioRunner
+	from workflows.workflowRunner import AsyncWorkflowRunner
+	from workflows.Synchronization import *
+# END of running as part of the Workflow Engine #####################################################################
+
+# Modules from the system ###########################################################################################
+import asyncio
+
+# END of Modules from the system ####################################################################################
+
+# Abstract Factory Interface ########################################################################################
+_runnerIdCounter = 0
+def createWorkflowRunner(configFileName):
+	""" It creates an instance of the Workflow runner implemented in this module, and it returns it back to the
+	calling client
+	"""
+	global _runnerIdCounter
+	runner = AsyncScenarioRunner(configFileName, _runnerIdCounter)
+	_runnerIdCounter += 1
+	return runner
+# Make the factory thread safe
+synchronized('createWorkflowRunner')
+# END of Abstract Factory Interface #################################################################################
+
+
+# Abstract Factory Product ##########################################################################################
+class AsyncScenarioRunner(ScenarioRunner, AsyncWorkflowRunner):
+	""" Runner doing what its config file scripts, without blocking the event loop it is run from
+	"""
+	def __init__(self, configFileName, runnerId = 0):
+		super(AsyncScenarioRunner, self).__init__(configFileName, runnerId)
+
+	async def _execute(self):
+		""" This coroutine is where your workflow does its job """
+		config = self._getConfig()
+		try:
+			missingPayloads = self._begin()
+			for (outputName, nItems) in config.getProduce().items():
+				for item in range(int(nItems)):
+					await self.getOutput(outputName).putAsync(item)
+			for requiredItem in config.getConsume():
+				nItems = len([item async for item in self.getProvision(requiredItem)])
+				self.getLogger().debug("Taken " + str(nItems) + " items from '" + requiredItem + "'")
+			if config.getStraggleOnce() > 0 and self._isFirstTime(scenarioRunner._straggledOnce):
+				await asyncio.sleep(config.getStraggleOnce())
+			try:
+				await asyncio.wait_for(self.getCancellationToken().waitAsync(), config.getSleep())
+			except asyncio.TimeoutError:
+				pass
+			self._finish(self.isCancelled(), missingPayloads)
+		except Exception as e:
+			self._fail(e)
+		finally:
+			self.getReporter().info("END   --- workflow ID '" + config.getWorkflowId() + "'")
+
+# END of Abstract Factory Product ###################################################################################
+
+
+# Unit tests ########################################################################################################
+def unitTest():
+	""" Unit Test method to run tests on this module when running stand alone """
+	print("unitTest() unit test method called for '" + __name__ + "'")
+	pass
+# END of Unit tests #################################################################################################
+
+# Unit testing environment detection and definition #################################################################
+if __name__ == "__main__":
+	import sys
+	sys.stderr.writelines("This module is not designed to be run alone, please, test it using the Workflow Engine")
+#####################################################################################################################
+
+# END OF SCRIPT #####################################################################################################
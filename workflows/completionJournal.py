@@ -0,0 +1,75 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Operation Completion Journal											#
+#####################################################################################################################
+
+# This module keeps a journal, in the working dir of the session, of every operation that has finished successfully,
+# identified by the workflow config file it belongs to, its path and the hash of its configuration. The path of an
+# operation is its name, prefixed by the names of the operations running the nested workflows it belongs to, e.g.
+# 'build/compile', so a workflow nested by several operations has an entry for each of them.
+# A session can resume a previous one, operations recorded as successful in the journal of that session, with the
+# same configuration hash, are not run again. Operations whose provision keys carried payloads are run again anyway, the
+# payloads only lived in the memory of the session that produced them. Every entry is a JSON object on a line of its
+# own, appended as soon as the operation finishes, so the journal of a session that has crashed is still usable
+
+import os
+import json
+import threading
+import configManager
+from exceptions import ConfigException
+
+_journalFileName = 'completion.journal'
+# Journal entries of the operations completed in the session being resumed, by resuming session, workflow and operation
+_resumed = {}
+_lock = threading.Lock()
+
+def _getJournalFilePath(sessionDir):
+	return os.path.join(sessionDir, _journalFileName)
+
+def resumeFrom(sessionDir):
+	""" Load the journal of a previous session, so the operations it records as completed are not run again """
+	journalFilePath = _getJournalFilePath(os.path.abspath(sessionDir))
+	try:
+		with open(journalFilePath) as jf:
+			lines = jf.readlines()
+	except OSError as e:
+		raise ConfigException("Could not read the completion journal " + journalFilePath + " to resume from, " + str(e))
+	sessionId = configManager.getManager().getSessionId()
+	with _lock:
+		resumed = _resumed.setdefault(sessionId, {})
+		for line in lines:
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				# The last entry may have been cut short if the session crashed while writing it
+				continue
+			resumed[(entry['workflow'], entry['operation'])] = entry
+		return len(resumed)
+
+def isCompleted(workflowConfigFileName, opPath, configHash):
+	""" Tell whether the session being resumed completed the given operation, with the same configuration, and without
+	attaching payloads to its provision keys, its consumers would not get them otherwise
+	"""
+	sessionId = configManager.getManager().getSessionId()
+	with _lock:
+		entry = _resumed.get(sessionId, {}).get((workflowConfigFileName, opPath))
+	return entry != None and entry['configHash'] == configHash and not entry.get('payloads', True)
+
+def recordCompletion(workflowConfigFileName, opPath, configHash, provides, payloads):
+	""" Append the given operation, that has just finished successfully, to the journal of this session, 'payloads'
+	tells whether it attached payloads to any of its provision keys
+	"""
+	entry = {
+		'workflow': workflowConfigFileName,
+		'operation': opPath,
+		'configHash': configHash,
+		'provides': provides,
+		'payloads': payloads
+	}
+	journalFilePath = _getJournalFilePath(configManager.getManager().getWorkingDir())
+	with _lock:
+		with open(journalFilePath, "a") as jf:
+			jf.write(json.dumps(entry) + "\n")
+			jf.flush()
+			os.fsync(jf.fileno())
@@ -0,0 +1,67 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Operation Duration History												#
+#####################################################################################################################
+
+# This module keeps track of how long operations take to run, across sessions, so the engine can estimate their
+# duration. The history is kept in the resources folder, and every new measurement is smoothed into the previous
+# estimation
+
+import os
+import json
+import threading
+import configManager
+
+_historyFileName = 'operationDurations.json'
+# Weight of a new measurement in the estimated duration
+_smoothingFactor = 0.3
+# Estimated durations, in seconds, by operation key. It is loaded the first time it is needed
+_durations = None
+_changed = False
+_lock = threading.Lock()
+
+def _getHistoryFilePath():
+	return os.path.join(configManager.getManager().getResourcesFolder(), _historyFileName)
+
+def _loadHistory():
+	""" Load the history from disk if it has not been loaded yet, the caller must hold the lock """
+	global _durations
+	if _durations == None:
+		try:
+			with open(_getHistoryFilePath()) as hf:
+				_durations = json.load(hf)
+		except (OSError, ValueError):
+			_durations = {}
+
+def getEstimatedDuration(operationKey, default=None):
+	""" Estimated duration in seconds for the given operation, or the default value if it has never been measured """
+	with _lock:
+		_loadHistory()
+		if operationKey in _durations:
+			return _durations[operationKey]
+	return default
+
+def recordDuration(operationKey, duration):
+	""" Smooth a new measurement, in seconds, into the estimated duration of the given operation """
+	global _changed
+	with _lock:
+		_loadHistory()
+		if operationKey in _durations:
+			_durations[operationKey] = (1 - _smoothingFactor) * _durations[operationKey] + _smoothingFactor * duration
+		else:
+			_durations[operationKey] = duration
+		_changed = True
+
+def save():
+	""" Write the history back to disk if there are new measurements """
+	global _changed
+	with _lock:
+		if not _changed:
+			return
+		historyFilePath = _getHistoryFilePath()
+		tmpFilePath = historyFilePath + ".tmp" + str(os.getpid())
+		with open(tmpFilePath, "w") as hf:
+			json.dump(_durations, hf, indent=1, sort_keys=True)
+		os.replace(tmpFilePath, historyFilePath)
+		_changed = False
@@ -0,0 +1,109 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Operation Executors														#
+#####################################################################################################################
+
+# This module implements the strategies a WorkflowEngine can use for running its operations. Every executor offers
+# the same 'submit' interface, so the engine does not care whether an operation runs on its own thread, on a worker
+# taken from the thread pool shared by every engine in the application, on a worker process or on a worker started on
+# its own that drains the task queue in the ipc folder. Whatever the executor, the submitted task works for the same
+# session as the code submitting it
+
+import threading
+import contextvars
+import multiprocessing
+import concurrent.futures
+import configManager
+import workflows.taskQueue as taskQueue
+
+# Maximum number of workers in the shared thread pool, 'None' means the default chosen by concurrent.futures
+_threadPoolMaxWorkers = None
+# Shared thread pool, it is created the first time it is needed
+_threadPool = None
+_threadPoolLock = threading.Lock()
+# Maximum number of worker processes in the shared process pool, 'None' means one per CPU
+_processPoolMaxWorkers = None
+# Shared process pool, it is created the first time it is needed
+_processPool = None
+_processPoolLock = threading.Lock()
+
+def getSharedThreadPool():
+	""" Return the thread pool shared by all the engines in the application, creating it if needed """
+	global _threadPool
+	with _threadPoolLock:
+		if _threadPool == None:
+			_threadPool = concurrent.futures.ThreadPoolExecutor(max_workers=_threadPoolMaxWorkers, \
+				thread_name_prefix='wfePool')
+	return _threadPool
+
+def getSharedProcessPool():
+	""" Return the process pool shared by all the engines in the application, creating it if needed.
+	Worker processes are spawned, forking a process that runs several threads could copy locks held by any of them, so
+	they start afresh. The ConfigManager of the session is sent along with every task, and the factories are imported by
+	the worker when the task is unpickled
+	"""
+	global _processPool
+	with _processPoolLock:
+		if _processPool == None:
+			_processPool = concurrent.futures.ProcessPoolExecutor(max_workers=_processPoolMaxWorkers, \
+				mp_context=multiprocessing.get_context('spawn'))
+	return _processPool
+
+
+class ThreadExecutor:
+	""" Every submitted task gets its own thread, the future it returns gets the value returned by the task """
+	def submit(self, function, *args):
+		future = concurrent.futures.Future()
+		future.set_running_or_notify_cancel()
+		def run():
+			try:
+				future.set_result(function(*args))
+			except BaseException as e:
+				future.set_exception(e)
+		thread = threading.Thread(target=contextvars.copy_context().run, args=(run,))
+		thread.start()
+		return future
+
+
+class PoolExecutor:
+	""" Submitted tasks are run by the workers of the shared thread pool """
+	def submit(self, function, *args):
+		return getSharedThreadPool().submit(contextvars.copy_context().run, function, *args)
+
+
+class ProcessExecutor:
+	""" Submitted tasks are run by the worker processes of the shared process pool, so both the task and its
+	arguments must be picklable
+	"""
+	def submit(self, function, *args):
+		return getSharedProcessPool().submit(configManager.runInWorkerSession, configManager.getManager(), function, \
+			*args)
+
+
+class QueueExecutor:
+	""" Submitted tasks are put in the task queue of the ipc folder, for the workers draining it, so both the task and
+	its arguments must be picklable
+	"""
+	def submit(self, function, *args):
+		return taskQueue.submit(configManager.runInWorkerSession, configManager.getManager(), function, *args)
+
+
+# Executors available to the workflow engine, by name
+_executors = {
+	'thread': ThreadExecutor,
+	'pool': PoolExecutor,
+	'process': ProcessExecutor,
+	'queue': QueueExecutor
+}
+
+def getExecutorNames():
+	return list(_executors.keys())
+
+def isProcessExecutor(name):
+	""" Tell whether operations run by the given executor live in a different process """
+	return _executors[name] in [ProcessExecutor, QueueExecutor]
+
+def createExecutor(name):
+	""" Return an instance of the executor registered with the given name """
+	return _executors[name]()
@@ -0,0 +1,221 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Map Operations Runner													#
+#####################################################################################################################
+
+# This module implements the runner a WorkflowEngine uses for map operations. A map operation runs the same factory and
+# config file over every item of an input list, or over every file matching a glob in the resources folder, which is
+# expanded when the operation is about to run. Every item gets its own runner instance, available through its
+# 'getInput' method, a bounded number of them run at the same time, and an optional reduce step runs once all of them
+# have succeeded, with the whole input list as its input
+
+import os
+import glob
+import threading
+import concurrent.futures
+import configManager
+from exceptions import WorkflowRunnerException
+from workflows.workflowRunner import WorkflowRunner
+from workflows.workflowRunner import submitToWorkerProcess
+from workflows.workflowRunner import replayRemoteResult
+import workflows.executors as executors
+import workflows.resourceBudget as resourceBudget
+
+_runnerIdCounter = 0
+_runnerIdCounterLock = threading.Lock()
+
+def _nextRunnerId():
+	global _runnerIdCounter
+	with _runnerIdCounterLock:
+		runnerId = _runnerIdCounter
+		_runnerIdCounter += 1
+	return runnerId
+
+
+class MapRunner(WorkflowRunner):
+	""" Composite runner for a map operation, as described in its compiled plan """
+	def __init__(self, op, operationPlan, executorName):
+		super(MapRunner, self).__init__()
+		self.__runnerId = _nextRunnerId()
+		self.__runnerIdName = __name__ + "-" + str(self.__runnerId)
+		self.__logger = configManager.getManager().createLogger(self.__runnerIdName)
+		self.__reporter = configManager.getManager().createReporter(self.__runnerIdName + "_report")
+		self.__op = op
+		self.__operationPlan = operationPlan
+		self.__executorName = executorName
+		# Runners of the instances being executed, and of the reduce step, they are built as they are run
+		self.__instanceRunners = []
+		self.__reduceRunner = None
+		self.__lock = threading.Lock()
+
+	def provides(self):
+		return self.__operationPlan['provides']
+
+	def requires(self):
+		return self.__operationPlan['requires']
+
+	def getLogger(self):
+		return self.__logger
+
+	def getReporter(self):
+		return self.__reporter
+
+	def getId(self):
+		return self.__runnerId
+
+	def getIdName(self):
+		return self.__runnerIdName
+
+	def isComposite(self):
+		return True
+
+	def getProvidedPayload(self, provisionKey):
+		""" Payloads of a map operation are the ones attached by its reduce step """
+		payload = super(MapRunner, self).getProvidedPayload(provisionKey)
+		if payload is None and self.__reduceRunner:
+			payload = self.__reduceRunner.getProvidedPayload(provisionKey)
+		return payload
+
+	def cancel(self):
+		""" Cancelling a map operation cancels all of its instances too """
+		super(MapRunner, self).cancel()
+		with self.__lock:
+			runners = self.__instanceRunners[:]
+		for runner in runners:
+			if not runner.getResult()['done']:
+				runner.cancel()
+
+	def _getInputs(self):
+		""" Input items of the operation, globs are expanded relative to the resources folder """
+		inputs = self.__operationPlan['map']['inputs']
+		if isinstance(inputs, str):
+			pattern = os.path.join(configManager.getManager().getResourcesFolder(), inputs)
+			return sorted(glob.glob(pattern))
+		return inputs
+
+	def _createInstance(self, factoryName, configFileName, inputItem):
+		factory = configManager.getManager().getWorkflowFactoryInstance(factoryName)
+		runner = factory.createWorkflowRunner(configFileName)
+		runner.setInput(inputItem)
+		for (requiredItem, payload) in self.getReceivedProvisions().items():
+			runner.receiveProvision(requiredItem, payload)
+		with self.__lock:
+			self.__instanceRunners.append(runner)
+		if self.isCancelled():
+			runner.cancel()
+		return runner
+
+	def _submitInstance(self, runner, factoryName, configFileName):
+		""" Hand an instance to the executor of the operation, if it runs them in other processes, or to the shared
+		thread pool otherwise. Its resources, already taken from the node budget, are given back once it finishes
+		"""
+		if executors.isProcessExecutor(self.__executorName):
+			future = submitToWorkerProcess(executors.createExecutor(self.__executorName), runner, factoryName, \
+				configFileName)
+		elif runner.isComposite():
+			# Composite instances wait for their own operations, which need workers from the shared pool as well, so
+			# they get a thread of their own
+			future = executors.createExecutor('thread').submit(runner.execute)
+		else:
+			future = executors.createExecutor('pool').submit(runner.execute)
+		future.add_done_callback(lambda f: resourceBudget.release(self.__operationPlan['map']['resources']))
+		return future
+
+	def _collectInstance(self, runner, future):
+		try:
+			if executors.isProcessExecutor(self.__executorName):
+				replayRemoteResult(runner, future.result())
+			else:
+				future.result()
+		except Exception as e:
+			runner.setError("Unhandled exception while running '" + runner.getIdName() + "', ERROR message: " + str(e))
+
+	def _stopInstances(self, running):
+		""" Cancel the given running instances and wait for them to finish """
+		for runner in running.values():
+			runner.cancel()
+		concurrent.futures.wait(list(running.keys()))
+		for (future, runner) in running.items():
+			self._collectInstance(runner, future)
+
+	def _startInstance(self, factoryName, configFileName, inputItem):
+		""" Build and submit an instance whose resources have already been taken from the node budget, they go back to
+		it if the instance can't be started. It returns its runner and its future
+		"""
+		try:
+			runner = self._createInstance(factoryName, configFileName, inputItem)
+			self.__logger.debug("Running instance " + runner.getIdName() + " of map operation '" + self.__op \
+				+ "' over input " + str(inputItem))
+			return (runner, self._submitInstance(runner, factoryName, configFileName))
+		except Exception:
+			resourceBudget.release(self.__operationPlan['map']['resources'])
+			raise
+
+	def _runInstances(self, inputs):
+		""" Run one instance per input item, at most 'width' of them at the same time. The first failure cancels the
+		rest of them, and it is raised once all of them have finished
+		"""
+		factoryName = self.__operationPlan['factory']
+		configFileName = self.__operationPlan['configFileName']
+		width = self.__operationPlan['map']['width']
+		running = {}
+		nextInput = 0
+		failure = None
+		while running or (nextInput < len(inputs) and failure == None and not self.isCancelled()):
+			while nextInput < len(inputs) and len(running) < width and failure == None and not self.isCancelled():
+				if not resourceBudget.acquire(self.__operationPlan['map']['resources'], self.getCancellationToken()):
+					break
+				try:
+					(runner, future) = self._startInstance(factoryName, configFileName, inputs[nextInput])
+				except Exception:
+					# Instances already running don't outlive the map operation
+					self._stopInstances(running)
+					raise
+				running[future] = runner
+				nextInput += 1
+			(done, notDone) = concurrent.futures.wait(list(running.keys()), \
+				return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				runner = running.pop(future)
+				self._collectInstance(runner, future)
+				if not runner.isResultSuccess() and failure == None:
+					failure = "Instance " + runner.getIdName() + " of map operation '" + self.__op + "' FAILED: " \
+						+ runner.getResultMessage()
+					self.__logger.error(failure)
+					for other in running.values():
+						other.cancel()
+		if failure:
+			raise WorkflowRunnerException(failure)
+		if self.isCancelled():
+			raise WorkflowRunnerException("Map operation '" + self.__op + "' has been cancelled")
+
+	def _runReduce(self, inputs):
+		reduceDefinition = self.__operationPlan['map']['reduce']
+		if not resourceBudget.acquire(self.__operationPlan['map']['resources'], self.getCancellationToken()):
+			raise WorkflowRunnerException("Map operation '" + self.__op + "' has been cancelled")
+		try:
+			runner = self._createInstance(reduceDefinition['factory'], reduceDefinition['configFileName'], inputs)
+			self.__reduceRunner = runner
+			self.__logger.debug("Running reduce step " + runner.getIdName() + " of map operation '" + self.__op + "'")
+			future = self._submitInstance(runner, reduceDefinition['factory'], reduceDefinition['configFileName'])
+		except Exception:
+			resourceBudget.release(self.__operationPlan['map']['resources'])
+			raise
+		self._collectInstance(runner, future)
+		if not runner.isResultSuccess():
+			raise WorkflowRunnerException("Reduce step " + runner.getIdName() + " of map operation '" + self.__op \
+				+ "' FAILED: " + runner.getResultMessage())
+
+	def _execute(self):
+		try:
+			inputs = self._getInputs()
+			self.__reporter.info("Map operation '" + self.__op + "' runs over " + str(len(inputs)) + " inputs, " \
+				+ str(self.__operationPlan['map']['width']) + " at a time")
+			self._runInstances(inputs)
+			if self.__operationPlan['map']['reduce']:
+				self._runReduce(inputs)
+			self.setSuccess("Map operation '" + self.__op + "' finished over " + str(len(inputs)) + " inputs")
+		except Exception as e:
+			self.__reporter.error(str(e))
+			self.setError(str(e))
@@ -0,0 +1,84 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Provision Payload Buffers												#
+#####################################################################################################################
+
+# This module moves the payloads runners attach to their provision keys across processes. Runners living in the same
+# process share payloads by reference, but worker processes can't, so bytes-like payloads are written once to a file in
+# the working dir of the session and every process reading them maps that file in memory, read only, instead of getting
+# a copy of them through the process pool. Any other payload travels pickled, as the arguments and results of worker
+# processes do. Payload files belong to the session that wrote them, they are removed when it finishes
+
+import os
+import mmap
+import uuid
+import shutil
+import threading
+import configManager
+
+_payloadsFolderName = 'payloads'
+# Memory maps of the payload files this process has read, by file path, until the session they belong to is released
+_mappings = {}
+_lock = threading.Lock()
+
+class MappedPayload():
+	""" Reference to a bytes-like payload kept in a file, it is what crosses process boundaries instead of the data """
+	def __init__(self, filePath, size):
+		self.__filePath = filePath
+		self.__size = size
+
+	def getFilePath(self):
+		return self.__filePath
+
+	def getSize(self):
+		return self.__size
+
+	def getBuffer(self):
+		""" Read only view of the payload, mapped in memory the first time this process asks for it """
+		if self.__size == 0:
+			return memoryview(b'')
+		with _lock:
+			if self.__filePath not in _mappings:
+				with open(self.__filePath, "rb") as pf:
+					_mappings[self.__filePath] = mmap.mmap(pf.fileno(), 0, access=mmap.ACCESS_READ)
+			return memoryview(_mappings[self.__filePath])
+
+def _isBytesLike(payload):
+	return isinstance(payload, (bytes, bytearray, memoryview, mmap.mmap))
+
+def export(payload):
+	""" Get a payload ready to be sent to another process, bytes-like payloads are written to a file and replaced by a
+	reference to it, anything else is returned as it is
+	"""
+	if not _isBytesLike(payload):
+		return payload
+	payloadsFolder = os.path.join(configManager.getManager().getWorkingDir(), _payloadsFolderName)
+	os.makedirs(payloadsFolder, exist_ok=True)
+	filePath = os.path.join(payloadsFolder, uuid.uuid4().hex)
+	with open(filePath, "wb") as pf:
+		pf.write(payload)
+	return MappedPayload(filePath, os.path.getsize(filePath))
+
+def resolve(payload):
+	""" The data behind a payload, as runners get it, references to payload files are mapped in memory """
+	if isinstance(payload, MappedPayload):
+		return payload.getBuffer()
+	return payload
+
+def unmap(sessionWorkingDir):
+	""" Close the memory maps of the payload files of the given session this process has read """
+	payloadsFolder = os.path.join(sessionWorkingDir, _payloadsFolderName)
+	with _lock:
+		for filePath in [filePath for filePath in _mappings if os.path.dirname(filePath) == payloadsFolder]:
+			mapping = _mappings.pop(filePath)
+			try:
+				mapping.close()
+			except BufferError:
+				# Some runner still holds a view of it, it is unmapped once the last view is gone
+				pass
+
+def releaseSession(sessionWorkingDir):
+	""" The given session has finished, its payload files are unmapped and removed """
+	unmap(sessionWorkingDir)
+	shutil.rmtree(os.path.join(sessionWorkingDir, _payloadsFolderName), ignore_errors=True)
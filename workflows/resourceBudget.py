@@ -0,0 +1,103 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Node Resource Budget													#
+#####################################################################################################################
+
+# This module keeps the budget of resources, CPUs and memory by default, of the node the application runs on. It is
+# shared by every WorkflowEngine in the application, nested ones included, so operations declaring the resources they
+# consume are only admitted while the node can afford them. Capacities come from the 'nodeResources' section of the
+# job config file, and CPUs and memory are detected when not set there. Resources the node has no capacity for are not
+# limited
+
+import os
+import threading
+import configManager
+
+# Remaining amount of every resource, it is initialized the first time it is needed
+_capacity = None
+_available = None
+_condition = threading.Condition()
+# Callables notified whenever resources are given back to the budget
+_listeners = []
+
+def _detectCapacity():
+	capacity = {'cpu': os.cpu_count() or 1}
+	try:
+		capacity['memMB'] = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+	except (ValueError, OSError, AttributeError):
+		pass
+	capacity.update(configManager.getManager().getNodeResources())
+	return capacity
+
+def _initBudget():
+	""" Set the budget up if it has not been done yet, the caller must hold the condition """
+	global _capacity, _available
+	if _capacity == None:
+		_capacity = _detectCapacity()
+		_available = dict(_capacity)
+
+def _getAmounts(resources):
+	""" Amounts to take from the budget for the given resources, requests beyond the capacity of the node are capped
+	to it, otherwise they could never be admitted
+	"""
+	return dict([(name, min(amount, _capacity[name])) for (name, amount) in resources.items() if name in _capacity])
+
+def getCapacity():
+	with _condition:
+		_initBudget()
+		return dict(_capacity)
+
+def getAvailable():
+	with _condition:
+		_initBudget()
+		return dict(_available)
+
+def tryAcquire(resources):
+	""" Take the given resources from the budget if all of them are available, it tells whether they were taken """
+	with _condition:
+		_initBudget()
+		amounts = _getAmounts(resources)
+		for (name, amount) in amounts.items():
+			if _available[name] < amount:
+				return False
+		for (name, amount) in amounts.items():
+			_available[name] -= amount
+		return True
+
+def acquire(resources, cancellationToken=None):
+	""" Block until the given resources can be taken from the budget. It returns whether they were taken, which only
+	fails when the given cancellation token is cancelled while waiting
+	"""
+	if cancellationToken:
+		cancellationToken.addCallback(_wakeUp)
+	with _condition:
+		while not tryAcquire(resources):
+			if cancellationToken and cancellationToken.isCancelled():
+				return False
+			_condition.wait()
+	return True
+
+def release(resources):
+	""" Give back to the budget resources taken with 'acquire' or 'tryAcquire' """
+	with _condition:
+		for (name, amount) in _getAmounts(resources).items():
+			_available[name] += amount
+		_condition.notify_all()
+		listeners = _listeners[:]
+	for listener in listeners:
+		listener()
+
+def _wakeUp():
+	with _condition:
+		_condition.notify_all()
+
+def addListener(listener):
+	""" Register a callable to be called, from whichever thread gives them back, every time resources are released """
+	with _condition:
+		_listeners.append(listener)
+
+def removeListener(listener):
+	with _condition:
+		if listener in _listeners:
+			_listeners.remove(listener)
@@ -0,0 +1,113 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Operation Result Cache													#
+#####################################################################################################################
+
+# This module keeps, in the resources folder, the results of the operations that opt in to result caching, so they
+# don't need to be run again for the same inputs. Entries are addressed by the fingerprint of the operation, a hash of
+# its factory, its configuration and what its requirements were delivered with: the payloads of its upstream operations,
+# or their fingerprints when they cache their results too. Operations with any other upstream operation are not cached,
+# the engine can't tell whether those deliver the same thing every time. Every entry keeps the result object of the runner and a copy of the output files the operation declares, relative to the
+# working dir of the session. The least recently used entries are evicted when the cache grows beyond its maximum size
+
+import os
+import glob
+import json
+import time
+import shutil
+import threading
+import configManager
+
+_cacheFolderName = 'resultCache'
+_entryFileName = 'entry.json'
+_outputsFolderName = 'outputs'
+# Maximum size of the cache, in bytes
+_maxCacheSize = 1024 * 1024 * 1024
+_lock = threading.Lock()
+
+def _getCacheFolder():
+	return os.path.join(configManager.getManager().getResourcesFolder(), _cacheFolderName)
+
+def _getEntryFolder(fingerprint):
+	return os.path.join(_getCacheFolder(), fingerprint)
+
+def lookup(fingerprint):
+	""" Return the entry cached for the given fingerprint, or 'None' if there is no such entry """
+	entryFilePath = os.path.join(_getEntryFolder(fingerprint), _entryFileName)
+	try:
+		with open(entryFilePath) as ef:
+			entry = json.load(ef)
+		# The modification time of the entry file tells when it was used last
+		os.utime(entryFilePath)
+	except (OSError, ValueError):
+		return None
+	return entry
+
+def restoreOutputs(fingerprint, entry, targetFolder):
+	""" Copy the output files of a cached entry back to the given folder, at their original relative paths """
+	outputsFolder = os.path.join(_getEntryFolder(fingerprint), _outputsFolderName)
+	for relativePath in entry['outputs']:
+		targetPath = os.path.join(targetFolder, relativePath)
+		os.makedirs(os.path.dirname(targetPath), exist_ok=True)
+		shutil.copy2(os.path.join(outputsFolder, relativePath), targetPath)
+
+def store(fingerprint, result, outputPatterns, sourceFolder):
+	""" Cache the result of an operation, along with the output files, relative to the given folder, matching the
+	given glob patterns. The entry is built aside and moved into place at once, so readers never see it half written
+	"""
+	entryFolder = _getEntryFolder(fingerprint)
+	if os.path.isdir(entryFolder):
+		return
+	tmpFolder = entryFolder + ".tmp" + str(os.getpid()) + "-" + str(threading.get_ident())
+	try:
+		os.makedirs(tmpFolder)
+		outputs = []
+		size = 0
+		for pattern in outputPatterns:
+			for outputPath in sorted(glob.glob(os.path.join(sourceFolder, pattern))):
+				if not os.path.isfile(outputPath):
+					continue
+				relativePath = os.path.relpath(outputPath, sourceFolder)
+				copyPath = os.path.join(tmpFolder, _outputsFolderName, relativePath)
+				os.makedirs(os.path.dirname(copyPath), exist_ok=True)
+				shutil.copy2(outputPath, copyPath)
+				outputs.append(relativePath)
+				size += os.path.getsize(copyPath)
+		entry = {
+			'result': {'msg': result['msg'], 'success': result['success']},
+			'outputs': outputs,
+			'size': size,
+			'storedAt': time.time()
+		}
+		with open(os.path.join(tmpFolder, _entryFileName), "w") as ef:
+			json.dump(entry, ef)
+		os.rename(tmpFolder, entryFolder)
+	except OSError:
+		if os.path.isdir(entryFolder):
+			# Someone else cached the same result in the meantime
+			return
+		raise
+	finally:
+		shutil.rmtree(tmpFolder, ignore_errors=True)
+	_evict()
+
+def _evict():
+	""" Remove the least recently used entries until the cache fits in its maximum size """
+	with _lock:
+		entries = []
+		totalSize = 0
+		for fingerprint in os.listdir(_getCacheFolder()):
+			entryFilePath = os.path.join(_getEntryFolder(fingerprint), _entryFileName)
+			try:
+				with open(entryFilePath) as ef:
+					size = json.load(ef)['size']
+				entries.append((os.path.getmtime(entryFilePath), fingerprint, size))
+			except (OSError, ValueError, KeyError):
+				continue
+			totalSize += size
+		for (lastUsed, fingerprint, size) in sorted(entries):
+			if totalSize <= _maxCacheSize:
+				break
+			shutil.rmtree(_getEntryFolder(fingerprint), ignore_errors=True)
+			totalSize -= size
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+#####################################################################################################################
+#								SCENARIO Runner - Scripted behaviour for testing the engine							#
+#####################################################################################################################
+""" This factory produces runners that behave as their config file tells them, they are the operations of the scripted
+scenarios the unit tests of the Workflow Engine run. Config file keys, all of them optional:
+	- 'sleep', seconds the runner takes, it stops as soon as it is cancelled
+	- 'straggleOnce', seconds only the first runner built from the config file in this process takes on top of its
+	'sleep', ignoring its cancellation
+	- 'error', "True" if the runner must finish with error
+	- 'failToStart', "True" if the runner can't even be built
+	- 'failToStartAfter', number of runners that are built from the config file in this process before the following
+	ones can't be
+	- 'failOnce', "True" if only the first runner built from the config file in this process must finish with error
+	- 'payload', text attached, encoded, to every provision key of the runner when it succeeds
+	- 'expectPayloads', "True" if the runner must finish with error when any of its requirements comes without payload
+	- 'produce', number of items to put on each of the given outputs, e.g. {"records": 100}
+	- 'consume', requirements whose channel items must be taken until their producer finishes
+	- 'waitFor', requirements nobody is going to deliver, the runner blocks waiting for them until it is cancelled
+The 'asyncScenarioRunner' factory produces the coroutine version of these runners, from the same config file keys
+"""
+
+# Running as part of the Workflow Engine ############################################################################
+if not __name__ == "__main__":
+	import configManager
+	from exceptions import WorkflowRunnerException
+	from workflows.workflowRunner import WorkflowRunner
+	from workflows.workflowRunner import WfConfManager
+	from workflows.Synchronization import *
+# END of running as part of the Workflow Engine #####################################################################
+
+# Modules from the system ###########################################################################################
+import time
+import threading
+
+# END of Modules from the system ####################################################################################
+
+# Abstract Factory Interface ########################################################################################
+_runnerIdCounter = 0
+# Config files of the 'failOnce' runners that have already failed, and of the 'straggleOnce' ones that have straggled
+_failedOnce = set()
+_straggledOnce = set()
+# Runners built so far, and execution bodies run so far, by config file
+_built = {}
+_executions = {}
+_lock = threading.Lock()
+def createWorkflowRunner(configFileName):
+	""" It creates an instance of the Workflow runner implemented in this module, and it returns it back to the
+	calling client
+	"""
+	global _runnerIdCounter
+	runner = ScenarioRunner(configFileName, _runnerIdCounter)
+	_runnerIdCounter += 1
+	return runner
+# Make the factory thread safe
+synchronized('createWorkflowRunner')
+
+def countBuilt(configFileName):
+	""" Number of runners built, in this process, from the given config file, so scenarios can tell whether the runner
+	of an operation was built at all
+	"""
+	with _lock:
+		return _built.get(configFileName, 0)
+
+def countExecutions(configFileName):
+	""" Number of times, in this process, the execution body of the runners built from the given config file has run,
+	so scenarios can tell whether an operation was run or its result restored
+	"""
+	with _lock:
+		return _executions.get(configFileName, 0)
+# END of Abstract Factory Interface #################################################################################
+
+
+# Support the Abstract Factory Product ##############################################################################
+class ConfManager(WfConfManager):
+	def __init__(self, configFileName, director):
+		WfConfManager.__init__(self, configFileName, director)
+
+	def getSleep(self):
+		if "sleep" in self._config:
+			return float(self._config["sleep"])
+		return 0.0
+
+	def isError(self):
+		return self._config.get("error") == "True"
+
+	def isFailingToStart(self):
+		return self._config.get("failToStart") == "True"
+
+	def getFailToStartAfter(self):
+		if "failToStartAfter" in self._config:
+			return int(self._config["failToStartAfter"])
+		return None
+
+	def getStraggleOnce(self):
+		if "straggleOnce" in self._config:
+			return float(self._config["straggleOnce"])
+		return 0.0
+
+	def isFailingOnce(self):
+		return self._config.get("failOnce") == "True"
+
+	def getPayload(self):
+		return self._config.get("payload")
+
+	def isExpectingPayloads(self):
+		return self._config.get("expectPayloads") == "True"
+
+	def getProduce(self):
+		return self._config.get("produce", {})
+
+	def getConsume(self):
+		return self._config.get("consume", [])
+
+	def getWaitFor(self):
+		return self._config.get("waitFor", [])
+
+# END of Support the Abstract Factory Product #######################################################################
+
+
+# Abstract Factory Product ##########################################################################################
+class ScenarioRunner(WorkflowRunner):
+	""" Runner doing what its config file scripts
+	"""
+	def __init__(self, configFileName, runnerId = 0):
+		super(ScenarioRunner, self).__init__()
+		self.__runnerId = runnerId
+		self.__runnerIdName = type(self).__module__ + "-" + str(runnerId)
+		self.__logger = configManager.getManager().createLogger(self.__runnerIdName)
+		self.__reporter = configManager.getManager().createReporter(self.__runnerIdName + "_report")
+		self.__logger.debug("Trying to load config file " + configFileName)
+		self.__configFileName = configFileName
+		self.__config = ConfManager(configFileName, self)
+		self.__logger.debug("Workflow configuration file, " + self.__config.getConfigFilePath())
+		with _lock:
+			nBuilt = _built.get(self.__configFileName, 0)
+			_built[self.__configFileName] = nBuilt + 1
+		if self.__config.isFailingToStart() or (self.__config.getFailToStartAfter() != None \
+			and nBuilt >= self.__config.getFailToStartAfter()):
+			msg = "Runner " + self.__runnerIdName + " fails to start, as requested by the config file"
+			self.__reporter.error(msg)
+			raise WorkflowRunnerException(msg)
+		for requiredItem in self.__config.getWaitFor():
+			# Nobody else knows about this requirement, the runner waits on itself for it
+			self.observe(self, requiredItem)
+		self.__logger.debug("Runner created")
+
+	def provides(self):
+		return self.__config.getProvides()
+
+	def requires(self):
+		return self.__config.getRequires()
+
+	def getLogger(self):
+		return self.__logger
+
+	def getReporter(self):
+		return self.__reporter
+
+	def getId(self):
+		return self.__runnerId
+
+	def getIdName(self):
+		return self.__runnerIdName
+
+	def _isFirstTime(self, configFilePaths):
+		""" Tell whether this is the first runner built from its config file to get here, for the given config files """
+		with _lock:
+			if self.__config.getConfigFilePath() in configFilePaths:
+				return False
+			configFilePaths.add(self.__config.getConfigFilePath())
+			return True
+
+	def _getConfig(self):
+		return self.__config
+
+	def _begin(self):
+		""" Count the execution, it returns the requirements that came without payload """
+		self.__reporter.info("BEGIN --- workflow ID '" + self.__config.getWorkflowId() + "'")
+		with _lock:
+			_executions[self.__configFileName] = _executions.get(self.__configFileName, 0) + 1
+		return [requiredItem for requiredItem in self.requires() if self.getProvision(requiredItem) is None]
+
+	def _finish(self, cancelled, missingPayloads):
+		""" Set the result the config file asks for, once the runner has slept """
+		if cancelled:
+			self.setError("Cancelled while sleeping")
+		elif self.__config.isExpectingPayloads() and len(missingPayloads) > 0:
+			self.setError("ERROR - no payload for requirements " + str(missingPayloads))
+		elif self.__config.isError() or (self.__config.isFailingOnce() and self._isFirstTime(_failedOnce)):
+			self.setError("ERROR - produced as requested by the config file")
+		else:
+			self.setSuccess("SUCCESS - as requested by the config file")
+			if self.__config.getPayload() != None:
+				for provisionKey in self.provides():
+					self.provide(provisionKey, self.__config.getPayload().encode('utf8'))
+
+	def _fail(self, e):
+		msg = "An error occurred while executing workflow ID '" + self.__config.getWorkflowId() \
+			+ "', ERROR message:\n" + str(e)
+		self.__reporter.error(msg)
+		self.setError(msg)
+
+	def _execute(self):
+		""" This method is where your workflow does its job """
+		try:
+			missingPayloads = self._begin()
+			for (outputName, nItems) in self.__config.getProduce().items():
+				for item in range(int(nItems)):
+					self.getOutput(outputName).put(item)
+			for requiredItem in self.__config.getConsume():
+				nItems = len([item for item in self.getProvision(requiredItem)])
+				self.__logger.debug("Taken " + str(nItems) + " items from '" + requiredItem + "'")
+			if self.__config.getStraggleOnce() > 0 and self._isFirstTime(_straggledOnce):
+				time.sleep(self.__config.getStraggleOnce())
+			self._finish(self.getCancellationToken().wait(self.__config.getSleep()), missingPayloads)
+		except Exception as e:
+			self._fail(e)
+		finally:
+			self.__reporter.info("END   --- workflow ID '" + self.__config.getWorkflowId() + "'")
+
+# END of Abstract Factory Product ###################################################################################
+
+
+# Unit tests ########################################################################################################
+def unitTest():
+	""" Unit Test method to run tests on this module when running stand alone """
+	print("unitTest() unit test method called for '" + __name__ + "'")
+	pass
+# END of Unit tests #################################################################################################
+
+# Unit testing environment detection and definition #################################################################
+if __name__ == "__main__":
+	import sys
+	sys.stderr.writelines("This module is not designed to be run alone, please, test it using the Workflow Engine")
+#####################################################################################################################
+
+# END OF SCRIPT #####################################################################################################
@@ -0,0 +1,299 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Streaming Output Channels												#
+#####################################################################################################################
+
+# This module implements the channels operations declare as 'outputs' in their config files, so their consumers can
+# read the items they produce while they are still running, instead of waiting for them to finish. Every channel keeps a
+# bounded queue for each of its readers, the consumers of the output in the workflow. When the queue of a reader is
+# full, the producer either blocks until that reader catches up, 'block' overflow, or the items beyond the capacity of
+# the channel are spilled to a file in the working dir of the session, 'spill' overflow, and read back from it in order.
+# Items can be any picklable object. Coroutine based producers and readers don't block their event loop, when they have
+# to wait they await a future the channel resolves, from whatever thread changes it
+
+import os
+import re
+import uuid
+import pickle
+import asyncio
+import threading
+import collections
+import configManager
+from exceptions import WorkflowRunnerException
+
+_channelsFolderName = 'channels'
+# What producers do when the queue of a reader is full, wait for it, or spill the items to a file
+_overflowPolicies = ['block', 'spill']
+# Items every reader queue keeps in memory, for outputs that don't set their 'capacity'
+_defaultCapacity = 1024
+
+def _wakeAsyncWaiter(future):
+	if not future.done():
+		future.set_result(None)
+
+
+class _ReaderQueue():
+	""" Items a reader of a channel has not taken yet, in memory up to the capacity of the channel, and in a spill file
+	beyond it. Once an item has been spilled, the following ones are spilled too until the file is drained, so items are
+	always taken in the order they were put. It is not thread safe, the channel owning it does the locking
+	"""
+	def __init__(self, spillFilePath):
+		self.__items = collections.deque()
+		self.__spillFilePath = spillFilePath
+		self.__spillFile = None
+		self.__spilled = 0
+		self.__readOffset = 0
+		self.__detached = False
+
+	def __len__(self):
+		return len(self.__items) + self.__spilled
+
+	def isDetached(self):
+		return self.__detached
+
+	def push(self, item, capacity):
+		""" Queue an item, in memory if there is room for it, in the spill file otherwise """
+		if self.__spilled == 0 and len(self.__items) < capacity:
+			self.__items.append(item)
+			return
+		if self.__spillFile == None:
+			os.makedirs(os.path.dirname(self.__spillFilePath), exist_ok=True)
+			self.__spillFile = open(self.__spillFilePath, "w+b")
+			self.__readOffset = 0
+		self.__spillFile.seek(0, os.SEEK_END)
+		pickle.dump(item, self.__spillFile)
+		self.__spilled += 1
+
+	def pop(self):
+		if len(self.__items) > 0:
+			return self.__items.popleft()
+		self.__spillFile.seek(self.__readOffset)
+		item = pickle.load(self.__spillFile)
+		self.__readOffset = self.__spillFile.tell()
+		self.__spilled -= 1
+		if self.__spilled == 0:
+			self._removeSpillFile()
+		return item
+
+	def detach(self):
+		""" The reader won't take any more items, the ones queued for it are dropped """
+		self.__detached = True
+		self.__items.clear()
+		self.__spilled = 0
+		self._removeSpillFile()
+
+	def _removeSpillFile(self):
+		if self.__spillFile != None:
+			self.__spillFile.close()
+			self.__spillFile = None
+			try:
+				os.remove(self.__spillFilePath)
+			except OSError:
+				pass
+
+
+class Channel():
+	""" Output of an operation, every item put on it reaches each of its readers, in order """
+	def __init__(self, name, readers, capacity=_defaultCapacity, overflow='block'):
+		self.__name = name
+		self.__capacity = capacity
+		self.__overflow = overflow
+		self.__condition = threading.Condition()
+		self.__closed = False
+		self.__error = None
+		# Producers waiting for room, and readers waiting for items, right now
+		self.__blockedProducers = 0
+		self.__waitingReaders = set()
+		# Futures coroutines waiting for the channel to change are awaiting, with their event loops
+		self.__asyncWaiters = []
+		channelId = re.sub(r'[^A-Za-z0-9_.-]', '_', name) + "-" + uuid.uuid4().hex
+		channelsFolder = os.path.join(configManager.getManager().getWorkingDir(), _channelsFolderName)
+		self.__queues = {}
+		for reader in readers:
+			self.__queues[reader] = _ReaderQueue(os.path.join(channelsFolder, channelId + "-" \
+				+ re.sub(r'[^A-Za-z0-9_.-]', '_', reader) + ".spill"))
+
+	def getName(self):
+		return self.__name
+
+	def getReaders(self):
+		return list(self.__queues.keys())
+
+	def isProducerBlocked(self):
+		""" Tell whether the producer is waiting for room in the queue of some reader. Waiters that have been woken up
+		but have not taken the lock back yet are not blocked
+		"""
+		with self.__condition:
+			return self.__blockedProducers > 0 and self.__error == None and not self._hasRoom()
+
+	def isReaderWaiting(self, reader):
+		""" Tell whether the given reader is waiting for items """
+		with self.__condition:
+			return reader in self.__waitingReaders and self.__error == None and not self.__closed \
+				and len(self.__queues[reader]) == 0
+
+	def getPendingReaders(self):
+		""" Readers whose queue is full, those the producer is waiting for when it is blocked """
+		with self.__condition:
+			return [reader for (reader, queue) in self.__queues.items() \
+				if not queue.isDetached() and len(queue) >= self.__capacity]
+
+	def _hasRoom(self):
+		for queue in self.__queues.values():
+			if not queue.isDetached() and len(queue) >= self.__capacity:
+				return False
+		return True
+
+	def _notifyAll(self):
+		""" Wake up every thread and coroutine waiting for the channel to change, the condition must be held """
+		self.__condition.notify_all()
+		for (loop, future) in self.__asyncWaiters:
+			try:
+				loop.call_soon_threadsafe(_wakeAsyncWaiter, future)
+			except RuntimeError:
+				# Its event loop has already finished
+				pass
+		self.__asyncWaiters = []
+
+	async def _waitAsync(self):
+		""" Wait, from a coroutine, for the channel to change. The condition must be held by the caller, who has just
+		found it can't go on, it is released while waiting and acquired again before returning
+		"""
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+		self.__asyncWaiters.append((loop, future))
+		self.__condition.release()
+		try:
+			await future
+		finally:
+			self.__condition.acquire()
+			self.__asyncWaiters = [waiter for waiter in self.__asyncWaiters if waiter[1] is not future]
+
+	def _push(self, item):
+		""" Send an item to every reader, the condition must be held and there must be room for it """
+		if self.__error != None:
+			raise WorkflowRunnerException("Channel '" + self.__name + "' has failed, " + self.__error)
+		if self.__closed:
+			raise WorkflowRunnerException("Channel '" + self.__name + "' has already been closed")
+		for queue in self.__queues.values():
+			if not queue.isDetached():
+				queue.push(item, self.__capacity)
+		self._notifyAll()
+
+	def _mustWaitForRoom(self):
+		return self.__overflow == 'block' and self.__error == None and not self._hasRoom()
+
+	def put(self, item):
+		""" Send an item to every reader, with 'block' overflow it waits while the queue of any of them is full """
+		with self.__condition:
+			if self._mustWaitForRoom():
+				self.__blockedProducers += 1
+				try:
+					self.__condition.wait_for(lambda: not self._mustWaitForRoom())
+				finally:
+					self.__blockedProducers -= 1
+			self._push(item)
+
+	async def putAsync(self, item):
+		""" For coroutine based producers, waiting for room doesn't block their event loop """
+		with self.__condition:
+			if self._mustWaitForRoom():
+				self.__blockedProducers += 1
+				try:
+					while self._mustWaitForRoom():
+						await self._waitAsync()
+				finally:
+					self.__blockedProducers -= 1
+			self._push(item)
+
+	def close(self):
+		""" The producer has finished, readers get the items left in their queues and then the end of the channel """
+		with self.__condition:
+			self.__closed = True
+			self._notifyAll()
+
+	def fail(self, msg):
+		""" The producer, or the workflow, has failed, readers and the producer are woken up with an error """
+		with self.__condition:
+			if self.__error == None:
+				self.__error = msg
+			self._notifyAll()
+
+	def detach(self, reader):
+		""" The given reader has finished, or it won't run, the producer no longer waits for it """
+		with self.__condition:
+			if reader in self.__queues:
+				self.__queues[reader].detach()
+				self._notifyAll()
+
+	def getReader(self, reader):
+		if reader not in self.__queues:
+			raise WorkflowRunnerException("Operation '" + reader + "' is not a reader of channel '" + self.__name \
+				+ "', channels only reach the consumers in the workflow of their producer")
+		return ChannelReader(self, reader)
+
+	def _mustWaitForItems(self, reader):
+		return self.__error == None and len(self.__queues[reader]) == 0 and not self.__closed
+
+	def _pop(self, reader):
+		""" Next item for the given reader, the condition must be held and the reader must not have to wait """
+		if self.__error != None:
+			raise WorkflowRunnerException("Channel '" + self.__name + "' has failed, " + self.__error)
+		if len(self.__queues[reader]) == 0:
+			return (False, None)
+		item = self.__queues[reader].pop()
+		self._notifyAll()
+		return (True, item)
+
+	def take(self, reader):
+		""" Next item for the given reader, it waits until there is one. It returns whether there was one, and the item,
+		readers find no item once the channel has been closed and their queue is empty
+		"""
+		with self.__condition:
+			if self._mustWaitForItems(reader):
+				self.__waitingReaders.add(reader)
+				try:
+					self.__condition.wait_for(lambda: not self._mustWaitForItems(reader))
+				finally:
+					self.__waitingReaders.discard(reader)
+			return self._pop(reader)
+
+	async def takeAsync(self, reader):
+		""" For coroutine based readers, waiting for items doesn't block their event loop """
+		with self.__condition:
+			if self._mustWaitForItems(reader):
+				self.__waitingReaders.add(reader)
+				try:
+					while self._mustWaitForItems(reader):
+						await self._waitAsync()
+				finally:
+					self.__waitingReaders.discard(reader)
+			return self._pop(reader)
+
+
+class ChannelReader():
+	""" What consumers get as the provision of a channel, they iterate over it to take the items of the channel, as they
+	are produced, until the producer finishes
+	"""
+	def __init__(self, channel, reader):
+		self.__channel = channel
+		self.__reader = reader
+
+	def getName(self):
+		return self.__channel.getName()
+
+	def __iter__(self):
+		while True:
+			(found, item) = self.__channel.take(self.__reader)
+			if not found:
+				return
+			yield item
+
+	async def __aiter__(self):
+		""" For coroutine based consumers, waiting for items doesn't block their event loop """
+		while True:
+			(found, item) = await self.__channel.takeAsync(self.__reader)
+			if not found:
+				return
+			yield item
@@ -0,0 +1,239 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Durable Task Queue														#
+#####################################################################################################################
+
+# This module implements a task queue kept in the ipc folder, so operations can be run by worker processes started on
+# their own, 'main_app.py --worker', on this host or on any other host sharing the filesystem. Tasks are pickled
+# files that move between the 'pending', 'claimed' and 'done' folders of the queue by renaming them, which is atomic:
+#	- A worker claims a task by creating its lock file, exclusively, and then moving it to 'claimed'. It keeps the
+#		lock file fresh while it runs the task, and it leaves the outcome in 'done' once it finishes
+#	- The process that submitted the task polls 'done' for it. Tasks whose lock file has gone stale, because their
+#		worker died, are moved back to 'pending' so another worker picks them up
+
+import os
+import uuid
+import time
+import pickle
+import socket
+import threading
+import multiprocessing
+import concurrent.futures
+import configManager
+from exceptions import WorkflowRunnerException
+
+_queueFolderName = 'taskQueue'
+_pendingFolderName = 'pending'
+_claimedFolderName = 'claimed'
+_doneFolderName = 'done'
+_taskExtension = '.task'
+_lockExtension = '.lock'
+_outcomeExtension = '.outcome'
+# Seconds between checks of the queue, both by workers and by submitters
+_pollInterval = 0.2
+# Seconds between refreshes of the lock files of the tasks a worker is running
+_heartbeatInterval = 5.0
+# Seconds after which a claimed task whose lock file has not been refreshed is given back to the queue
+_claimTimeout = 30.0
+
+# Futures of the tasks submitted by this process and not finished yet, along with the ipc folder of the session that
+# submitted them, by task ID
+_submitted = {}
+_submittedLock = threading.Lock()
+_collector = None
+
+def _getQueueFolder(name, ipcFolder=None):
+	""" Folder of the queue in the given ipc folder, the one of the current session by default """
+	if ipcFolder == None:
+		ipcFolder = configManager.getManager().getIpcFolder()
+	folder = os.path.join(ipcFolder, _queueFolderName, name)
+	os.makedirs(folder, exist_ok=True)
+	return folder
+
+def _getPath(folderName, taskId, extension, ipcFolder=None):
+	return os.path.join(_getQueueFolder(folderName, ipcFolder), taskId + extension)
+
+def _writeAtomically(filePath, content):
+	""" Pickle the given content to a file that shows up at once, readers never see it half written """
+	tmpFilePath = filePath + ".tmp" + str(os.getpid()) + "-" + str(threading.get_ident())
+	with open(tmpFilePath, "wb") as f:
+		pickle.dump(content, f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.rename(tmpFilePath, filePath)
+
+def _readFile(filePath):
+	with open(filePath, "rb") as f:
+		return pickle.load(f)
+
+# Submitting side ###################################################################################################
+def submit(function, *args):
+	""" Queue a call of the given function, which must be picklable as well as its arguments, it returns a future
+	that gets the value returned by the call once a worker has run it
+	"""
+	taskId = "%.6f" % time.time() + "-" + uuid.uuid4().hex
+	future = concurrent.futures.Future()
+	future.set_running_or_notify_cancel()
+	with _submittedLock:
+		_submitted[taskId] = (future, configManager.getManager().getIpcFolder())
+	_writeAtomically(_getPath(_pendingFolderName, taskId, _taskExtension), {'function': function, 'args': args})
+	_startCollector()
+	return future
+
+def _startCollector():
+	global _collector
+	with _submittedLock:
+		if _collector == None:
+			_collector = threading.Thread(target=_collectOutcomes, name='wfeTaskQueue', daemon=True)
+			_collector.start()
+
+def _collectOutcomes():
+	""" Body of the thread that completes the futures of the submitted tasks as their outcomes show up """
+	while True:
+		time.sleep(_pollInterval)
+		with _submittedLock:
+			submitted = list(_submitted.items())
+		for ipcFolder in set([ipcFolder for (taskId, (future, ipcFolder)) in submitted]):
+			requeueStaleTasks(ipcFolder)
+		for (taskId, (future, ipcFolder)) in submitted:
+			outcomeFilePath = _getPath(_doneFolderName, taskId, _outcomeExtension, ipcFolder)
+			try:
+				outcome = _readFile(outcomeFilePath)
+			except FileNotFoundError:
+				continue
+			except Exception as e:
+				outcome = {'error': "The outcome of task " + taskId + " could not be read, " + str(e)}
+			try:
+				os.remove(outcomeFilePath)
+			except OSError:
+				pass
+			with _submittedLock:
+				del _submitted[taskId]
+			if 'error' in outcome:
+				future.set_exception(WorkflowRunnerException(outcome['error']))
+			else:
+				future.set_result(outcome['value'])
+
+def requeueStaleTasks(ipcFolder=None):
+	""" Give back to the queue the claimed tasks whose worker has stopped refreshing their lock files """
+	claimedFolder = _getQueueFolder(_claimedFolderName, ipcFolder)
+	for fileName in os.listdir(claimedFolder):
+		if not fileName.endswith(_lockExtension):
+			continue
+		taskId = fileName[:-len(_lockExtension)]
+		lockFilePath = os.path.join(claimedFolder, fileName)
+		try:
+			if time.time() - os.path.getmtime(lockFilePath) < _claimTimeout:
+				continue
+			os.rename(_getPath(_claimedFolderName, taskId, _taskExtension, ipcFolder), \
+				_getPath(_pendingFolderName, taskId, _taskExtension, ipcFolder))
+		except FileNotFoundError:
+			# Either the task has just finished, or its worker died before moving it out of 'pending'
+			pass
+		try:
+			os.remove(lockFilePath)
+		except OSError:
+			pass
+
+# Worker side #######################################################################################################
+def claim(workerId):
+	""" Take the oldest pending task, it returns its ID and its content, or 'None' if there are no pending tasks. Tasks
+	that can't be read, e.g. because their session or their factory modules can't be loaded here, are completed with the
+	error right away, so they don't take down every worker that claims them
+	"""
+	pendingFolder = _getQueueFolder(_pendingFolderName)
+	for fileName in sorted(os.listdir(pendingFolder)):
+		if not fileName.endswith(_taskExtension):
+			continue
+		taskId = fileName[:-len(_taskExtension)]
+		lockFilePath = _getPath(_claimedFolderName, taskId, _lockExtension)
+		try:
+			lockFd = os.open(lockFilePath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except FileExistsError:
+			# Another worker is claiming it
+			continue
+		with os.fdopen(lockFd, "w") as lf:
+			lf.write(workerId)
+		try:
+			os.rename(os.path.join(pendingFolder, fileName), _getPath(_claimedFolderName, taskId, _taskExtension))
+		except FileNotFoundError:
+			os.remove(lockFilePath)
+			continue
+		try:
+			return (taskId, _readFile(_getPath(_claimedFolderName, taskId, _taskExtension)))
+		except Exception as e:
+			complete(taskId, {'error': "Task " + taskId + " could not be read by worker " + workerId + ", " + str(e)})
+			configManager.detachSessions()
+	return None
+
+def heartbeat(taskId):
+	try:
+		os.utime(_getPath(_claimedFolderName, taskId, _lockExtension))
+	except OSError:
+		pass
+
+def complete(taskId, outcome):
+	""" Leave the outcome of a claimed task, either {'value': ...} or {'error': msg}, for its submitter """
+	_writeAtomically(_getPath(_doneFolderName, taskId, _outcomeExtension), outcome)
+	for extension in [_taskExtension, _lockExtension]:
+		try:
+			os.remove(_getPath(_claimedFolderName, taskId, extension))
+		except OSError:
+			pass
+
+def _runTask(task):
+	return task['function'](*task['args'])
+
+def runWorker(slots=None):
+	""" Drain the queue until the process is interrupted, running up to 'slots' tasks at the same time, one per CPU
+	by default, in worker processes of its own
+	"""
+	workerId = socket.gethostname() + "-" + str(os.getpid())
+	logger = configManager.getManager().createLogger(__name__ + "-" + workerId)
+	reporter = configManager.getManager().createReporter(__name__ + "-" + workerId + "_report")
+	slots = slots or os.cpu_count() or 1
+	reporter.info("Worker " + workerId + " draining the task queue at " + _getQueueFolder('') + " with " + str(slots) \
+		+ " slots")
+	pool = concurrent.futures.ProcessPoolExecutor(max_workers=slots, mp_context=multiprocessing.get_context('spawn'))
+	running = {}
+	lastHeartbeat = time.time()
+	try:
+		while True:
+			while len(running) < slots:
+				claimed = claim(workerId)
+				if claimed == None:
+					break
+				(taskId, task) = claimed
+				logger.debug("Worker " + workerId + " claimed task " + taskId)
+				try:
+					running[pool.submit(_runTask, task)] = taskId
+				except Exception as e:
+					outcome = {'error': "Task " + taskId + " could not be started at worker " + workerId + ", " + str(e)}
+					reporter.error(outcome['error'])
+					complete(taskId, outcome)
+				finally:
+					# Sessions attached to while reading the task are only referenced by it, they are attached to again
+					# by the worker process that runs it
+					configManager.detachSessions()
+			(done, notDone) = concurrent.futures.wait(list(running.keys()), timeout=_pollInterval, \
+				return_when=concurrent.futures.FIRST_COMPLETED)
+			if not running:
+				time.sleep(_pollInterval)
+			for future in done:
+				taskId = running.pop(future)
+				try:
+					outcome = {'value': future.result()}
+				except Exception as e:
+					outcome = {'error': "Task " + taskId + " failed at worker " + workerId + ", " + str(e)}
+					reporter.error(outcome['error'])
+				complete(taskId, outcome)
+				logger.debug("Worker " + workerId + " completed task " + taskId)
+			if time.time() - lastHeartbeat >= _heartbeatInterval:
+				for taskId in running.values():
+					heartbeat(taskId)
+				lastHeartbeat = time.time()
+	finally:
+		# Tasks left running are given back to the queue once their lock files go stale
+		pool.shutdown(wait=False, cancel_futures=True)
+		reporter.info("Worker " + workerId + " stopped, " + str(len(running)) + " tasks were still running")
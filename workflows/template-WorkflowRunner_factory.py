@@ -93,6 +93,12 @@ class MyWorkflowRunner(WorkflowRunner):
 		self.__reporter.info("BEGIN --- workflow ID '" + self.__config.getWorkflowId() + "'")
 		try:
 			# TODO Place here the execution body of your runner
+			# Long running bodies should check self.isCancelled(), or wait on self.getCancellationToken(), and
+			# finish as soon as possible when the workflow is being cancelled
+			# Provision keys that are ready before the body finishes can be released with self.provide(key), so
+			# their consumers don't have to wait for the rest of the body
+			# Items of the 'outputs' declared in the config file are sent with self.getOutput(name).put(item), and
+			# consumers iterate over self.getProvision(name) to take them while this runner is still running
 			pass
 		except Exception as e:
 			msg = "An error occurred while executing workflow ID '" + self.__config.getWorkflowId() + "', ERROR message:\n" + str(e)
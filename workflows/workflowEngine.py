@@ -24,9 +24,347 @@ def _init():
 
 
 # Unit tests ########################################################################################################
+# Scripted scenarios, their workflow config files are in the 'scenarios' folder of the test config folder and their
+# operations are run by the 'scenarioRunner' factory. Run them with 'main_app.py scenarios.conf -t workflowEngine'
+def _startScenarioWorkflow(workflowConfigFileName):
+	""" Start running the given workflow on a thread, it returns its runner, the thread and the time it started """
+	runner = createWorkflowRunner(workflowConfigFileName)
+	startTime = time.time()
+	thread = threading.Thread(target=runner.execute)
+	thread.start()
+	return (runner, thread, startTime)
+
+def _waitForScenarioWorkflow(runner, thread, startTime, timeout=None):
+	""" Wait for a started workflow to finish, it returns the seconds it took. Workflows still running after the given
+	timeout are cancelled
+	"""
+	thread.join(timeout)
+	if thread.is_alive():
+		runner.cancel()
+		thread.join()
+	return time.time() - startTime
+
+def _runScenarioWorkflow(workflowConfigFileName, timeout=None):
+	""" Run the given workflow, it returns its runner and the seconds it took. Workflows still running after the given
+	timeout are cancelled
+	"""
+	(runner, thread, startTime) = _startScenarioWorkflow(workflowConfigFileName)
+	return (runner, _waitForScenarioWorkflow(runner, thread, startTime, timeout))
+
+def _scenarioCoroutineRunners():
+	""" Coroutine runners are run on the event loop of engines in 'asyncio' mode, and on an event loop of their own by
+	engines in 'threads' mode
+	"""
+	factory = configManager.getManager().getWorkflowFactoryInstance("scenarioRunner")
+	for workflowConfigFileName in ["scenarios/coroutines.workflow", "scenarios/coroutinesAsyncio.workflow"]:
+		nExecutions = factory.countExecutions("scenarios/coroutineSleep.conf")
+		(runner, elapsed) = _runScenarioWorkflow(workflowConfigFileName, 30)
+		if not runner.isResultSuccess():
+			return "workflow '" + workflowConfigFileName + "' failed, " + runner.getResultMessage()
+		if factory.countExecutions("scenarios/coroutineSleep.conf") - nExecutions != 3:
+			return "workflow '" + workflowConfigFileName + "' didn't run every sleeping coroutine runner"
+		if elapsed > 1.5:
+			return "workflow '" + workflowConfigFileName + "' took " + str(round(elapsed, 1)) + " seconds, its " \
+				+ "coroutine runners didn't run at the same time"
+	return None
+
+def _scenarioUnbuiltDependent():
+	""" Runners are built once the requirements of their operation have been met, those of the dependents of a failed
+	operation are never built
+	"""
+	factory = configManager.getManager().getWorkflowFactoryInstance("scenarioRunner")
+	for workflowConfigFileName in ["scenarios/unbuiltDependent.workflow", "scenarios/unbuiltDependentAsyncio.workflow"]:
+		nBuilt = factory.countBuilt("scenarios/failingDependent.conf")
+		(runner, elapsed) = _runScenarioWorkflow(workflowConfigFileName, 30)
+		if runner.isResultSuccess():
+			return "workflow '" + workflowConfigFileName + "' should have failed"
+		if factory.countBuilt("scenarios/failingDependent.conf") != nBuilt:
+			return "workflow '" + workflowConfigFileName + "' built the runner of the dependent of the failed operation"
+	return None
+
+def _writeScenarioConfigFile(configFilePath, config):
+	with open(configFilePath, "w") as cf:
+		json.dump(config, cf)
+
+def _scenarioEditedPlan():
+	""" Compiled plans are reused, from memory and from the cache folder, until one of the config files they were
+	compiled from changes
+	"""
+	folder = os.path.join(configManager.getManager().getWorkingDir(), "editedPlan")
+	workflowConfigFileName = os.path.join(folder, "edited.workflow")
+	opConfigFileName = os.path.join(folder, "edited.conf")
+	try:
+		os.makedirs(folder, exist_ok=True)
+		_writeScenarioConfigFile(opConfigFileName, {"workflowId": "Scenario-edited", "provides": ["first"], \
+			"requires": []})
+		_writeScenarioConfigFile(workflowConfigFileName, {"workflowId": "Scenario-edited_plan", \
+			"operations": {"edited": {"factory": "scenarioRunner", "configFileName": opConfigFileName}}, \
+			"workflow": ["edited"], "provides": [], "requires": []})
+		director = createWorkflowRunner(workflowConfigFileName)
+		plan = workflowPlan.getWorkflowPlan(workflowConfigFileName, director)
+		if not os.path.exists(workflowPlan._getCacheFilePath(workflowConfigFileName)):
+			return "the plan has not been cached in the cache folder"
+		if workflowPlan.getWorkflowPlan(workflowConfigFileName, director) is not plan:
+			return "the plan has been compiled again, though none of its config files changed"
+		with workflowPlan._lock:
+			del workflowPlan._plans[workflowPlan._getConfigFilePath(workflowConfigFileName)]
+		if workflowPlan.getWorkflowPlan(workflowConfigFileName, director) != plan:
+			return "the plan read from the cache folder is not the one that was compiled"
+		_writeScenarioConfigFile(opConfigFileName, {"workflowId": "Scenario-edited", "provides": ["second"], \
+			"requires": []})
+		if workflowPlan.getWorkflowPlan(workflowConfigFileName, director)['operations']['edited']['provides'] \
+			!= ["second"]:
+			return "the plan has not been compiled again after the config file of one of its operations changed"
+		(runner, elapsed) = _runScenarioWorkflow(workflowConfigFileName, 30)
+		if not runner.isResultSuccess():
+			return "the workflow failed after its plan was compiled again, " + runner.getResultMessage()
+	finally:
+		shutil.rmtree(folder, ignore_errors=True)
+	return None
+
+def _scenarioFailedStart():
+	""" Resources taken for an operation whose runner can't be built go back to the node budget """
+	(runner, elapsed) = _runScenarioWorkflow("scenarios/failedStart.workflow")
+	if runner.isResultSuccess():
+		return "the workflow should have failed"
+	if resourceBudget.getAvailable() != resourceBudget.getCapacity():
+		return "resources have not been released, " + str(resourceBudget.getAvailable()) + " are available out of " \
+			+ str(resourceBudget.getCapacity())
+	return None
+
+def _scenarioFailedMapInstance():
+	""" An instance of a map operation that can't be built gives its resources back, and stops its running siblings """
+	(runner, elapsed) = _runScenarioWorkflow("scenarios/failedMapInstance.workflow", 30)
+	if runner.isResultSuccess():
+		return "the workflow should have failed"
+	if elapsed > 4:
+		return "the workflow took " + str(round(elapsed, 1)) + " seconds, the running instance was not cancelled"
+	if resourceBudget.getAvailable() != resourceBudget.getCapacity():
+		return "resources have not been released, " + str(resourceBudget.getAvailable()) + " are available out of " \
+			+ str(resourceBudget.getCapacity())
+	return None
+
+def _scenarioProviderModes():
+	""" Consumers of a key with several providers start once the first provider to finish, the first provider in the
+	workflow, or all of them, have delivered it, as their provider mode tells
+	"""
+	factory = configManager.getManager().getWorkflowFactoryInstance("scenarioRunner")
+	consumers = ["firstToFinishConsumer", "workflowOrderConsumer", "allConsumer"]
+	# Runs of each consumer expected half way between the deliveries of the quick and the slow providers, and then
+	# half way between those of the slow and the slower ones
+	expectations = [(0.75, [1, 0, 0]), (2.25, [1, 1, 0])]
+	for workflowConfigFileName in ["scenarios/providerModes.workflow", "scenarios/providerModesAsyncio.workflow"]:
+		nExecutions = [factory.countExecutions("scenarios/" + consumer + ".conf") for consumer in consumers]
+		(runner, thread, startTime) = _startScenarioWorkflow(workflowConfigFileName)
+		for (checkTime, expected) in expectations:
+			time.sleep(max(0, startTime + checkTime - time.time()))
+			executed = [factory.countExecutions("scenarios/" + consumer + ".conf") - nExecuted \
+				for (consumer, nExecuted) in zip(consumers, nExecutions)]
+			if executed != expected:
+				_waitForScenarioWorkflow(runner, thread, startTime, 0)
+				return "workflow '" + workflowConfigFileName + "' had run " + str(executed) + " times its consumers " \
+					+ str(consumers) + " after " + str(checkTime) + " seconds, instead of " + str(expected)
+		_waitForScenarioWorkflow(runner, thread, startTime, 30)
+		if not runner.isResultSuccess():
+			return "workflow '" + workflowConfigFileName + "' failed, " + runner.getResultMessage()
+	return None
+
+def _scenarioWatchdog():
+	""" The watchdog of the engine fails workflows fast when an operation runs past its timeout, or when no operation
+	can make progress
+	"""
+	for (workflowConfigFileName, reason) in [("scenarios/timedOut.workflow", "timed out"), \
+		("scenarios/timedOutAsyncio.workflow", "timed out"), ("scenarios/deadlocked.workflow", "Deadlock"), \
+		("scenarios/deadlockedAsyncio.workflow", "Deadlock")]:
+		(runner, elapsed) = _runScenarioWorkflow(workflowConfigFileName, 30)
+		if runner.isResultSuccess():
+			return "workflow '" + workflowConfigFileName + "' should have failed"
+		if reason not in runner.getResultMessage():
+			return "workflow '" + workflowConfigFileName + "' failed for another reason, " + runner.getResultMessage()
+		if elapsed > 5:
+			return "workflow '" + workflowConfigFileName + "' took " + str(round(elapsed, 1)) + " seconds to fail"
+	return None
+
+def _scenarioRetries():
+	""" Failed operations are run again, after an exponential backoff, while they have retries left, the operations
+	upstream of them are not
+	"""
+	factory = configManager.getManager().getWorkflowFactoryInstance("scenarioRunner")
+	for (workflowConfigFileName, flakyConfigFileName) in [("scenarios/retried.workflow", "scenarios/flaky.conf"), \
+		("scenarios/retriedAsyncio.workflow", "scenarios/flakyAsyncio.conf")]:
+		nUpstream = factory.countExecutions("scenarios/retryUpstream.conf")
+		nFlaky = factory.countExecutions(flakyConfigFileName)
+		(runner, elapsed) = _runScenarioWorkflow(workflowConfigFileName, 30)
+		if not runner.isResultSuccess():
+			return "workflow '" + workflowConfigFileName + "' failed, " + runner.getResultMessage()
+		if factory.countExecutions(flakyConfigFileName) - nFlaky != 2 \
+			or factory.countExecutions("scenarios/retryUpstream.conf") - nUpstream != 1:
+			return "workflow '" + workflowConfigFileName + "' should have run its failed operation twice, and the " \
+				+ "operation upstream of it once"
+		if elapsed < 0.5:
+			return "workflow '" + workflowConfigFileName + "' didn't wait for the backoff before the retry"
+	nFailing = factory.countExecutions("scenarios/failing.conf")
+	(runner, elapsed) = _runScenarioWorkflow("scenarios/exhaustedRetries.workflow", 30)
+	if runner.isResultSuccess():
+		return "the workflow whose operation keeps failing should have failed"
+	if factory.countExecutions("scenarios/failing.conf") - nFailing != 3:
+		return "the operation that keeps failing should have been run three times"
+	if elapsed < 0.6:
+		return "the retries of the operation that keeps failing didn't back off exponentially"
+	return None
+
+def _scenarioFlattenedWorkflow():
+	""" The operations of a flattened nested workflow are run by the engine of its parent, consumers of the keys they
+	provide don't wait for the rest of the nested workflow
+	"""
+	factory = configManager.getManager().getWorkflowFactoryInstance("scenarioRunner")
+	for workflowConfigFileName in ["scenarios/flattened.workflow", "scenarios/flattenedAsyncio.workflow"]:
+		plan = workflowPlan.getWorkflowPlan(workflowConfigFileName, createWorkflowRunner(workflowConfigFileName))
+		if plan['sequence'] != ["nested/quick", "nested/slow", "nested", "consumer"]:
+			return "workflow '" + workflowConfigFileName + "' has not been flattened, its sequence is " \
+				+ str(plan['sequence'])
+		nExecutions = factory.countExecutions("scenarios/flattenedConsumer.conf")
+		(runner, thread, startTime) = _startScenarioWorkflow(workflowConfigFileName)
+		time.sleep(0.75)
+		executed = factory.countExecutions("scenarios/flattenedConsumer.conf") - nExecutions
+		_waitForScenarioWorkflow(runner, thread, startTime, 30)
+		if not runner.isResultSuccess():
+			return "workflow '" + workflowConfigFileName + "' failed, " + runner.getResultMessage()
+		if executed != 1:
+			return "the consumer of workflow '" + workflowConfigFileName + "' waited for the whole nested workflow"
+	return None
+
+def _scenarioWideCompositeMap():
+	""" Instances of a map over a nested workflow don't hold the shared thread pool their own operations need, however
+	many of them run at the same time
+	"""
+	(runner, elapsed) = _runScenarioWorkflow("scenarios/wideCompositeMap.workflow", 30)
+	if not runner.isResultSuccess():
+		return "the workflow failed, or it was cancelled after " + str(round(elapsed, 1)) + " seconds, " \
+			+ runner.getResultMessage()
+	return None
+
+def _scenarioHedgedFailure():
+	""" A provider whose consumer takes the first provider to finish can fail while another one is still working, the
+	workflow only fails once every provider has failed
+	"""
+	for workflowConfigFileName in ["scenarios/hedgedFailure.workflow", "scenarios/hedgedFailureAsyncio.workflow"]:
+		(runner, elapsed) = _runScenarioWorkflow(workflowConfigFileName, 30)
+		if not runner.isResultSuccess():
+			return "workflow '" + workflowConfigFileName + "' failed, " + runner.getResultMessage()
+	(runner, elapsed) = _runScenarioWorkflow("scenarios/failedHedges.workflow", 30)
+	if runner.isResultSuccess():
+		return "the workflow whose hedged providers all fail should have failed"
+	return None
+
+def _scenarioResumedPayloads():
+	""" Operations attaching payloads to their provision keys are run again when resuming, so their consumers get them """
+	journalFilePath = os.path.join(configManager.getManager().getWorkingDir(), completionJournal._journalFileName)
+	if os.path.exists(journalFilePath):
+		os.remove(journalFilePath)
+	(runner, elapsed) = _runScenarioWorkflow("scenarios/resumedPayloads.workflow")
+	if runner.isResultSuccess():
+		return "the first run of the workflow should have failed"
+	completionJournal.resumeFrom(configManager.getManager().getWorkingDir())
+	(runner, elapsed) = _runScenarioWorkflow("scenarios/resumedPayloads.workflow")
+	if not runner.isResultSuccess():
+		return "the resumed run of the workflow failed, " + runner.getResultMessage()
+	return None
+
+def _scenarioCachedDownstream():
+	""" Cached operations are run again when their upstream operations don't tell what they delivered, and restored when
+	every upstream operation caches its result too
+	"""
+	shutil.rmtree(resultCache._getCacheFolder(), ignore_errors=True)
+	factory = configManager.getManager().getWorkflowFactoryInstance("scenarioRunner")
+	for (workflowConfigFileName, expectedExecutions) in [("scenarios/uncachedUpstream.workflow", 2), \
+		("scenarios/cachedUpstream.workflow", 1)]:
+		executions = factory.countExecutions("scenarios/cachedDownstream.conf")
+		for run in range(2):
+			(runner, elapsed) = _runScenarioWorkflow(workflowConfigFileName, 30)
+			if not runner.isResultSuccess():
+				return "workflow '" + workflowConfigFileName + "' failed, " + runner.getResultMessage()
+		executions = factory.countExecutions("scenarios/cachedDownstream.conf") - executions
+		if executions != expectedExecutions:
+			return "the cached operation of workflow '" + workflowConfigFileName + "' was run " + str(executions) \
+				+ " times in two runs, instead of " + str(expectedExecutions)
+	return None
+
+def _scenarioBlockedProducer():
+	""" A producer blocked on its full channel doesn't keep its reader from starting, even with room for one operation """
+	for workflowConfigFileName in ["scenarios/blockedProducer.workflow", "scenarios/blockedProducerAsyncio.workflow"]:
+		(runner, elapsed) = _runScenarioWorkflow(workflowConfigFileName, 30)
+		if not runner.isResultSuccess():
+			return "workflow '" + workflowConfigFileName + "' failed after " + str(round(elapsed, 1)) + " seconds, " \
+				+ runner.getResultMessage()
+		if resourceBudget.getAvailable() != resourceBudget.getCapacity():
+			return "resources have not been released by workflow '" + workflowConfigFileName + "'"
+	return None
+
+def _scenarioRetriedReader():
+	""" Readers of channels can't be retried, a second run of them would find the channel drained """
+	(runner, elapsed) = _runScenarioWorkflow("scenarios/retriedReader.workflow", 30)
+	if runner.isResultSuccess():
+		return "the workflow should have been rejected"
+	if "can't be retried" not in runner.getResultMessage():
+		return "the workflow failed for another reason, " + runner.getResultMessage()
+	return None
+
+def _scenarioAbandonedLoser():
+	""" A straggler that ignores its cancellation is not waited for once its speculative duplicate has won the race, its
+	resources go back to the node budget when it returns
+	"""
+	for (workflowConfigFileName, stragglerConfigFileName) in [
+		("scenarios/abandonedLoser.workflow", "scenarios/straggler.conf"),
+		("scenarios/abandonedLoserAsyncio.workflow", "scenarios/stragglerAsyncio.conf")]:
+		# The straggler usually takes its 'sleep'
+		durationHistory.recordDuration("scenarioRunner:" + stragglerConfigFileName, 0.2)
+		(runner, elapsed) = _runScenarioWorkflow(workflowConfigFileName, 30)
+		if not runner.isResultSuccess():
+			return "workflow '" + workflowConfigFileName + "' failed, " + runner.getResultMessage()
+		if elapsed > 5:
+			return "workflow '" + workflowConfigFileName + "' took " + str(round(elapsed, 1)) + " seconds, the loser " \
+				+ "of the race has been waited for"
+		giveUpAt = time.time() + 15
+		while resourceBudget.getAvailable() != resourceBudget.getCapacity() and time.time() < giveUpAt:
+			time.sleep(0.1)
+		if resourceBudget.getAvailable() != resourceBudget.getCapacity():
+			return "the loser of the race in workflow '" + workflowConfigFileName + "' has not released its resources"
+	return None
+
+_scenarios = [
+	_scenarioCoroutineRunners,
+	_scenarioUnbuiltDependent,
+	_scenarioEditedPlan,
+	_scenarioFailedStart,
+	_scenarioFailedMapInstance,
+	_scenarioWideCompositeMap,
+	_scenarioProviderModes,
+	_scenarioWatchdog,
+	_scenarioRetries,
+	_scenarioFlattenedWorkflow,
+	_scenarioHedgedFailure,
+	_scenarioResumedPayloads,
+	_scenarioCachedDownstream,
+	_scenarioBlockedProducer,
+	_scenarioRetriedReader,
+	_scenarioAbandonedLoser
+]
+
 def unitTest():
 	""" Unit Test method to run tests on this module when running stand alone """
-	pass
+	reporter = configManager.getManager().getReporter()
+	failures = []
+	for scenario in _scenarios:
+		reporter.info("Scenario '" + scenario.__name__ + "': " + scenario.__doc__.strip())
+		failure = scenario()
+		if failure:
+			reporter.error("Scenario '" + scenario.__name__ + "' FAILED, " + failure)
+			failures.append(scenario.__name__)
+		else:
+			reporter.info("Scenario '" + scenario.__name__ + "' passed")
+	if len(failures) > 0:
+		raise WorkflowRunnerException("Failed scenarios: " + ", ".join(failures))
 # END of Unit tests #################################################################################################
 
 # Entry point #######################################################################################################
@@ -39,9 +377,22 @@ else:
 	# We are running as part of the application
 	import configManager
 	from exceptions import WorkflowRunnerException
+	from exceptions import WorkflowCancelledException
 	from workflows.workflowRunner import WorkflowRunner
 	from workflows.workflowRunner import WfConfManager
+	from workflows.workflowRunner import submitToWorkerProcess
+	from workflows.workflowRunner import replayRemoteResult
+	from workflows.observer import Observer
 	from workflows.Synchronization import *
+	import workflows.executors as executors
+	import workflows.durationHistory as durationHistory
+	import workflows.workflowPlan as workflowPlan
+	import workflows.resourceBudget as resourceBudget
+	import workflows.completionJournal as completionJournal
+	import workflows.resultCache as resultCache
+	import workflows.payloadBuffers as payloadBuffers
+	import workflows.streamChannels as streamChannels
+	from workflows.mapRunner import MapRunner
 	_init()
 # END of Entry point ################################################################################################
 
@@ -50,9 +401,15 @@ else:
 
 # Modules from the system ###########################################################################################
 import os
-import time
 import json
+import time
 import threading
+import shutil
+import hashlib
+import pickle
+import queue
+import heapq
+import asyncio
 # END of Modules from the system ####################################################################################
 
 
@@ -60,6 +417,14 @@ import threading
 _runnerIdCounter = 0
 # TODO Remove the following module attribute
 _initializedEngine = False
+# Seconds between the checks of the watchdog for timeouts, the session deadline and deadlocks
+_watchdogInterval = 0.5
+# Seconds to wait for cancelled operations to finish before abandoning them
+_cancellationGracePeriod = 10.0
+# Idempotent operations running this many times longer than they usually take, and at least the given number of
+# seconds longer, are stragglers, a speculative duplicate of them is started
+_stragglerFactor = 3.0
+_stragglerMinDelay = 1.0
 
 def createWorkflowRunner(configFileName):
 	""" It creates an instance of the Workflow runner implemented in this module, and it returns it back to the
@@ -77,7 +442,15 @@ synchronized('createWorkflowRunner')
 class WfeConfManager(WfConfManager):
 	""" This class handles the Workflow configuration for a WorkflowEngine """
 	def __init__(self, configFileName, director):
-		WfConfManager.__init__(self, configFileName, director)
+		compiledConfig = workflowPlan.getCompiledWorkflowConfig(configFileName)
+		if compiledConfig:
+			# The workflow is part of an already compiled plan, there is no need to read its config file again
+			self._director = director
+			self._configFilePath = os.path.abspath(os.path.join(configManager.getManager().getConfigFolder(), \
+				configFileName))
+			self._config = compiledConfig
+		else:
+			WfConfManager.__init__(self, configFileName, director)
 
 	def getOperations(self):
 		if "operations" in self._config:
@@ -105,6 +478,43 @@ class WfeConfManager(WfConfManager):
 			self._director.getReporter().error(msg)
 			raise WorkflowRunnerException(msg)
 
+	def getMaxConcurrency(self):
+		""" Maximum number of operations running at the same time, 0 means no limit """
+		if "maxConcurrency" in self._config:
+			try:
+				maxConcurrency = int(self._config["maxConcurrency"])
+				if maxConcurrency >= 0:
+					return maxConcurrency
+			except (ValueError, TypeError):
+				pass
+			msg = "Invalid maxConcurrency '" + str(self._config["maxConcurrency"]) + "' at config file " \
+				+ self._configFilePath
+			self._director.getReporter().error(msg)
+			raise WorkflowRunnerException(msg)
+		return 0
+
+	def getExecutorName(self):
+		""" Executor used for running the operations of the workflow, the shared thread pool by default """
+		executorName = "pool"
+		if "executor" in self._config:
+			executorName = self._config["executor"]
+		if executorName not in executors.getExecutorNames():
+			msg = "Unknown executor '" + str(executorName) + "' at config file " + self._configFilePath
+			self._director.getReporter().error(msg)
+			raise WorkflowRunnerException(msg)
+		return executorName
+
+	def getEngineMode(self):
+		""" How the engine drives the operations, 'threads' (default) or a single 'asyncio' event loop """
+		engineMode = "threads"
+		if "engineMode" in self._config:
+			engineMode = self._config["engineMode"]
+		if engineMode not in ["threads", "asyncio"]:
+			msg = "Unknown engine mode '" + str(engineMode) + "' at config file " + self._configFilePath
+			self._director.getReporter().error(msg)
+			raise WorkflowRunnerException(msg)
+		return engineMode
+
 	def getWorkflowSequence(self):
 		if "workflow" in self._config:
 			return self._config["workflow"]
@@ -112,6 +522,102 @@ class WfeConfManager(WfConfManager):
 			msg = "Missing workflow sequence in config file " + self._configFilePath
 			self._director.getReporter().error(msg)
 			raise WorkflowRunnerException(msg)
+
+class _PrioritySlots():
+	""" Concurrency limit for an engine running on an event loop, operations waiting for a slot are admitted by
+	priority, highest first. Slots are handed over on the next iteration of the loop, so all the operations that become
+	ready at the same time compete for them
+	"""
+	def __init__(self, nSlots):
+		self.__free = nSlots
+		self.__waiting = []
+		self.__counter = 0
+		self.__dispatchScheduled = False
+
+	async def acquire(self, priority):
+		future = asyncio.get_running_loop().create_future()
+		# The counter keeps the order of arrival among operations with the same priority
+		heapq.heappush(self.__waiting, (-priority, self.__counter, future))
+		self.__counter += 1
+		self._scheduleDispatch()
+		try:
+			await future
+		except asyncio.CancelledError:
+			if future.done() and not future.cancelled():
+				# The slot was handed over to us right before the cancellation
+				self.release()
+			raise
+
+	def tryAcquire(self):
+		""" Take a slot right away, if there is a free one no operation is waiting for """
+		if self.__free > 0 and len(self.__waiting) == 0:
+			self.__free -= 1
+			return True
+		return False
+
+	def release(self):
+		# Deferred, so the operations woken up by whoever is releasing the slot get to compete for it
+		asyncio.get_running_loop().call_soon(self._released)
+
+	def _released(self):
+		self.__free += 1
+		self._scheduleDispatch()
+
+	def _scheduleDispatch(self):
+		if not self.__dispatchScheduled:
+			self.__dispatchScheduled = True
+			asyncio.get_running_loop().call_soon(self._dispatch)
+
+	def _dispatch(self):
+		self.__dispatchScheduled = False
+		while self.__free > 0 and len(self.__waiting) > 0:
+			(priority, counter, future) = heapq.heappop(self.__waiting)
+			if not future.done():
+				future.set_result(None)
+				self.__free -= 1
+
+class _ProvisionMonitor(Observer):
+	""" It relays the provision notifications of the runner of an operation to the engine running it """
+	def __init__(self, op, provisionCallback):
+		Observer.__init__(self)
+		self.__op = op
+		self.__provisionCallback = provisionCallback
+
+	def update(self, runner, arg=None):
+		self.__provisionCallback(self.__op, arg, runner)
+
+class _FlattenedWorkflowJoin(WorkflowRunner):
+	""" Runner for the operation a flattened nested workflow leaves behind in the plan of its parent, its requirements
+	are met once every inlined operation of the nested workflow has finished, and then it delivers its provision keys
+	"""
+	def __init__(self, op, operationPlan, engine):
+		super(_FlattenedWorkflowJoin, self).__init__()
+		self.__op = op
+		self.__operationPlan = operationPlan
+		self.__engine = engine
+
+	def provides(self):
+		return self.__operationPlan['provides']
+
+	def requires(self):
+		return self.__operationPlan['requires']
+
+	def getLogger(self):
+		return self.__engine.getLogger()
+
+	def getReporter(self):
+		return self.__engine.getReporter()
+
+	def getId(self):
+		return self.__engine.getId()
+
+	def getIdName(self):
+		return self.__engine.getIdName() + "/" + self.__op
+
+	def _execute(self):
+		self.setSuccess("The " + str(len(self.__operationPlan['flattened'])) + " operations of flattened workflow '" \
+			+ self.__op + "' have finished")
+
 # END of Support the Abstract Factory Product #######################################################################
 
 
@@ -127,8 +633,31 @@ class WorkflowEngine(WorkflowRunner):
 		self.__logger = configManager.getManager().createLogger(self.__runnerIdName)
 		self.__reporter = configManager.getManager().createReporter(self.__runnerIdName + "_report")
 		self.__logger.debug("Trying to load config file " + configFileName)
+		self.__configFileName = configFileName
 		self.__config = WfeConfManager(configFileName, self)
 		self.__logger.debug("Workflow configuration file, " + self.__config.getConfigFilePath())
+		# Runners of the operations being executed by this engine, they are built as operations are run
+		self.__operationRunners = []
+		self.__runnersByOperation = {}
+		self.__plan = {}
+		self.__dependents = {}
+		# Fingerprints of the operations that have been started, and the one of this engine as an operation of its
+		# parent workflow, if any
+		self.__fingerprints = {}
+		self.__fingerprintSeed = ''
+		# Path of this engine as an operation of its parent workflows, e.g. 'build/compile', empty for the main workflow
+		self.__operationPath = ''
+		# Payloads attached to the provision keys delivered so far, by provision key and operation
+		self.__payloads = {}
+		# Channels of the outputs of the operations that have been started, by operation and output name, and the
+		# operations that won't read them because they are not going to run
+		self.__channels = {}
+		self.__skipped = set()
+		# Speculative duplicates of straggler operations, by operation, while they race against the original runner
+		self.__speculativeRunners = {}
+		# Resources taken from the node budget, along with the ones of their producers, for the readers of channels that
+		# have not started yet, by operation
+		self.__reservations = {}
 
 	def provides(self):
 		return self.__config.getProvides()
@@ -148,102 +677,1103 @@ class WorkflowEngine(WorkflowRunner):
 	def getIdName(self):
 		return self.__runnerIdName
 
-	def _execute(self):
-		self.__reporter.info("BEGIN --- workflow ID '" + self.__config.getWorkflowId() + "'")
-		# Load runners for the operations
+	def isComposite(self):
+		return True
+
+	def getProvidedPayload(self, provisionKey):
+		""" Payloads provided by a workflow are the ones attached by its operations """
+		payload = super(WorkflowEngine, self).getProvidedPayload(provisionKey)
+		if payload is None:
+			for payload in self.__payloads.get(provisionKey, {}).values():
+				break
+		return payload
+
+	def setFingerprintSeed(self, fingerprint):
+		""" The fingerprints of the operations of a nested workflow depend on its own fingerprint in its parent """
+		self.__fingerprintSeed = fingerprint
+
+	def setOperationPath(self, operationPath):
+		""" Operations of a nested workflow are identified by the path of the operation running it in its parents, so
+		the same workflow nested by several operations doesn't mix them up in the completion journal
+		"""
+		self.__operationPath = operationPath
+
+	def _getOperationPath(self, op):
+		if self.__operationPath:
+			return self.__operationPath + "/" + op
+		return op
+
+	def cancel(self):
+		""" Cancelling an engine cancels all of its operations too """
+		super(WorkflowEngine, self).cancel()
+		self._cancelOperations()
+
+	def _cancelOperations(self):
+		for runner in self.__operationRunners[:]:
+			if not runner.getResult()['done']:
+				runner.cancel()
+		# Producers and consumers blocked on channels are woken up
+		for channels in list(self.__channels.values()):
+			for channel in channels.values():
+				channel.fail("workflow '" + self.__config.getWorkflowId() + "' is being cancelled")
+
+	def _getExecutorNameForOperation(self, op):
+		""" Executor used for running the given operation, the workflow executor if the operation has no one set """
+		if self.__plan[op]['executor'] != None:
+			return self.__plan[op]['executor']
+		return self.__config.getExecutorName()
+
+	def _createRunner(self, op, provisionCallback, speculative=False):
+		""" Build the runner for an operation that is about to be run, its provision notifications are relayed to the
+		engine through the given callback. Speculative duplicates of an operation don't replace its runner
+		"""
 		try:
-			operations = {}
-			for op in self.__config.getOperations():
-				try:
-					self.__logger.debug("Processing Factory for operation '" + op + "'")
-					operations[op] = {}
-					operations[op]['factory'] = \
-						configManager.getManager().getWorkflowFactoryInstance(self.__config.getFactoryNameForOperation(op))
-					self.__logger.debug("Instantiating runner with config file " + self.__config.getConfigFileForOperation(op))
-					operations[op]['runner'] = operations[op]['factory'].createWorkflowRunner(self.__config.getConfigFileForOperation(op))
-				except Exception as e:
-					msg = "An error occurred while trying to instantiate factories and runners for workflow " \
-						+ self.__config.getWorkflowId() + "\nERROR: " + str(e)
-					self.__reporter.error(msg)
-					raise WorkflowRunnerException(msg)
-			# Load workflow operation sequence
-			wfSequence = self.__config.getWorkflowSequence()
-			self.__logger.debug("WORKFLOW SEQUENCE loaded: " + str(wfSequence))
-			# Static composition check
-			# Subscribe every operation to its providers
-			provisions = {}
-			for op in wfSequence:
-				self.__logger.debug("Processing workflow sequence operation '" + op + "'")
-				if len(operations[op]['runner'].requires()) > 0:
-					self.__logger.debug("Operation '" + op + "' requires: " + str(operations[op]['runner'].requires()))
-					# Sign the runner up for those previous operations in the workflow providing what it needs
-					for requiredItem in operations[op]['runner'].requires():
-						if requiredItem in provisions:
-							# Even if we are using a list for providers of a particular item, I always use the first one
-							# on the list, this can be changed later in the future to be more elaborated, but keep in
-							# mind that this workflow engine was designed upon the assumption of one single provider
-							# per required item
-							self.__logger.debug("Making runner " + operations[op]['runner'].getIdName() \
-								+ " observe for requirement '" + requiredItem + "' on provider '" \
-								+ provisions[requiredItem][0].getIdName() + "'")						
-							operations[op]['runner'].observe(provisions[requiredItem][0], requiredItem)
-						else:
-							msg = "Workflow Processing ERROR - operation " + op + " run by '" \
-								+ operations[op]['runner'].getIdName() + "' requires '" + requiredItem \
-								+ "' but it is not provided by any of the antecesors of the workflow"
+			if self.__plan[op]['flattened'] != None:
+				self.__logger.debug("Instantiating join runner for flattened operation '" + op + "'")
+				runner = _FlattenedWorkflowJoin(op, self.__plan[op], self)
+			elif self.__plan[op]['map']:
+				self.__logger.debug("Instantiating map runner for operation '" + op + "'")
+				runner = MapRunner(op, self.__plan[op], self._getExecutorNameForOperation(op))
+			else:
+				self.__logger.debug("Processing Factory for operation '" + op + "'")
+				factory = configManager.getManager().getWorkflowFactoryInstance(self.__plan[op]['factory'])
+				self.__logger.debug("Instantiating runner with config file " + self.__plan[op]['configFileName'])
+				runner = factory.createWorkflowRunner(self.__plan[op]['configFileName'])
+		except Exception as e:
+			msg = "An error occurred while trying to instantiate factories and runners for workflow " \
+				+ self.__config.getWorkflowId() + "\nERROR: " + str(e)
+			self.__reporter.error(msg)
+			raise WorkflowRunnerException(msg)
+		if isinstance(runner, WorkflowEngine):
+			runner.setFingerprintSeed(self.__fingerprints.get(op))
+			runner.setOperationPath(self._getOperationPath(op))
+		self._handOverProvisions(op, runner)
+		runner.addObserver(_ProvisionMonitor(op, provisionCallback))
+		self._openOutputs(op, runner)
+		self.__operationRunners.append(runner)
+		if speculative:
+			self.__speculativeRunners[op] = runner
+		else:
+			self.__runnersByOperation[op] = runner
+		if self.isCancelled():
+			runner.cancel()
+		return runner
+
+	def _markDelivered(self, op, provisionKey, delivered, runner=None):
+		""" Record the provision keys notified by an operation, either the given one or all of them, in the dictionary
+		of the operations that have delivered every key. Payloads are taken from the given runner, the one of the
+		operation by default
+		"""
+		provisionKeys = self.__plan[op]['provides']
+		if provisionKey:
+			provisionKeys = [provisionKey]
+		if runner == None:
+			runner = self.__runnersByOperation.get(op)
+		for key in provisionKeys:
+			if key not in delivered:
+				delivered[key] = set()
+			delivered[key].add(op)
+			if runner and runner.getProvidedPayload(key) is not None:
+				if key not in self.__payloads:
+					self.__payloads[key] = {}
+				self.__payloads[key][op] = runner.getProvidedPayload(key)
+
+	def _openOutputs(self, op, runner):
+		""" Open the channels of the outputs of an operation that is about to be run, they are delivered right away, so
+		its consumers start reading them while it runs
+		"""
+		if len(self.__plan[op]['outputs']) == 0:
+			return
+		if executors.isProcessExecutor(self._getExecutorNameForOperation(op)):
+			msg = "Operation '" + op + "' has outputs, it can't be run in a worker process"
+			self.__reporter.error(msg)
+			raise WorkflowRunnerException(msg)
+		self.__channels[op] = {}
+		for (outputName, outputDefinition) in self.__plan[op]['outputs'].items():
+			readers = [dependent for dependent in self.__dependents[op] if dependent not in self.__skipped \
+				and op in self.__plan[dependent]['providedBy'].get(outputName, [])]
+			channel = streamChannels.Channel(outputName, readers, outputDefinition['capacity'], \
+				outputDefinition['overflow'])
+			self.__channels[op][outputName] = channel
+			runner.attachOutput(outputName, channel)
+			runner.provide(outputName, channel)
+
+	def _closeChannels(self, op, runner):
+		""" An operation has finished, its channels are closed, or failed if it failed, and the producers it was
+		reading from no longer wait for it
+		"""
+		for channel in self.__channels.get(op, {}).values():
+			if runner.isResultSuccess():
+				channel.close()
+			else:
+				channel.fail("its producer, operation '" + op + "', failed: " + runner.getResultMessage())
+		self._detachReader(op)
+
+	def _detachReader(self, op):
+		""" The given operation won't read any more items, or it is not going to run """
+		for channels in list(self.__channels.values()):
+			for channel in channels.values():
+				channel.detach(op)
+		self._releaseReservation(op)
+
+	def _usesChannels(self, op):
+		""" Tell whether an operation produces items for channels or reads them """
+		if len(self.__plan[op]['outputs']) > 0:
+			return True
+		for requiredItem in self.__plan[op]['requires']:
+			for provider in self.__plan[op]['providedBy'][requiredItem]:
+				if requiredItem in self.__plan[provider]['outputs']:
+					return True
+		return False
+
+	def _readsStartedChannel(self, op):
+		""" Tell whether an operation reads a channel whose producer has already been started """
+		for requiredItem in self.__plan[op]['requires']:
+			for provider in self.__plan[op]['providedBy'][requiredItem]:
+				if requiredItem in self.__channels.get(provider, {}):
+					return True
+		return False
+
+	def _isBlockedOnChannels(self, op):
+		""" Tell whether a running operation is waiting for room in one of its outputs, or for items from a channel """
+		for (producer, channels) in list(self.__channels.items()):
+			for channel in channels.values():
+				if producer == op and channel.isProducerBlocked():
+					return True
+				if producer != op and channel.isReaderWaiting(op):
+					return True
+		return False
+
+	def _acquireResources(self, op):
+		""" Take the resources of an operation from the node budget, it tells whether they were taken. Producers of
+		channels take the resources of their readers along with their own, and readers use those, so a producer that is
+		blocked on a full channel never keeps its readers from starting
+		"""
+		if op in self.__reservations:
+			del self.__reservations[op]
+			return True
+		readers = []
+		for outputName in self.__plan[op]['outputs']:
+			for dependent in self.__dependents[op]:
+				if dependent not in self.__skipped and dependent not in self.__runnersByOperation \
+					and dependent not in self.__reservations and dependent not in readers \
+					and op in self.__plan[dependent]['providedBy'].get(outputName, []):
+					readers.append(dependent)
+		if not resourceBudget.tryAcquire(self.__plan[op]['resources']):
+			return False
+		for (i, reader) in enumerate(readers):
+			if not resourceBudget.tryAcquire(self.__plan[reader]['resources']):
+				resourceBudget.release(self.__plan[op]['resources'])
+				for taken in readers[:i]:
+					resourceBudget.release(self.__plan[taken]['resources'])
+				return False
+		for reader in readers:
+			self.__reservations[reader] = self.__plan[reader]['resources']
+		return True
+
+	def _releaseReservation(self, op):
+		if op in self.__reservations:
+			resourceBudget.release(self.__reservations.pop(op))
+
+	def _releaseReservations(self):
+		""" Readers of channels that have not started by the time the workflow finishes give their resources back """
+		for op in list(self.__reservations.keys()):
+			self._releaseReservation(op)
+
+	def _handOverProvisions(self, op, runner):
+		""" Give the runner of an operation the payloads attached to its requirements, for every requirement it is the
+		payload of the first of its providers, in workflow order, that attached one. Payloads for operations run in
+		worker processes are exported first, so they are written to a file once, whatever the number of consumers
+		"""
+		toProcess = executors.isProcessExecutor(self._getExecutorNameForOperation(op))
+		for requiredItem in self.__plan[op]['requires']:
+			for provider in self.__plan[op]['providedBy'][requiredItem]:
+				if provider in self.__payloads.get(requiredItem, {}):
+					if isinstance(self.__payloads[requiredItem][provider], streamChannels.Channel):
+						if toProcess:
+							msg = "Operation '" + op + "' reads channel '" + requiredItem + "', it can't be run in a " \
+								+ "worker process"
 							self.__reporter.error(msg)
 							raise WorkflowRunnerException(msg)
-				self.__logger.debug("Runner " + operations[op]['runner'].getIdName() + " provides: " \
-					+ str(operations[op]['runner'].provides()))
-				for provisionKey in operations[op]['runner'].provides():
-					self.__logger.debug("Registering that operation '" + op + "' provides " + provisionKey)
-					if provisionKey not in provisions:
-						# I should not need a list but something tells me that it's better this way
-						provisions[provisionKey] = []
-					# Add the reference of the runner
-					provisions[provisionKey].append(operations[op]['runner'])
-			# Run workflows in parallel
-			# TODO - Change this to poll threads in case a deadlock occurs, so we can kill other threads
-			runners = []
-			for op in wfSequence:
-				self.__logger.debug("Launching thread for operation '" + op + "' being run by runner " \
-					+ operations[op]['runner'].getIdName())
-				thread = threading.Thread(target=operations[op]['runner'].execute)
-				thread.start()
-				runners.append((operations[op]['runner'], thread))
-			self.__logger.debug("Waiting for operations to finish")
-			cancelWorkflow = False
-			while len(runners) > 0:
-				runnersKept = []
-				errMsg = ""
-				if cancelWorkflow:
-					# Up to this point I haven't found a way to stop the running threads, so I will just raise an
-					# exception that will cause this workflow to finish reporting the error
-					msg = "A step in the workflow has failed, " + str(len(runners)) + " runners were still working " \
-						+ "by the time the failure was detected, some of them may have finished their task, an" \
-						+ " exception is being raised to report the error"
-					self.__logger.error(msg)
-					raise WorkflowRunnerException(msg)
-				else:
-					for (runner, runnerThread) in runners:
-						# TODO - Use non-blocking wait for the threads, in case any of them fails, and recover result object
-						# runnerThread.join()
-						if runnerThread.is_alive():
-							self.__logger.debug("Runner '" + runner.getIdName() + "' is still running, we keep it for later")
-							runnersKept.append((runner, runnerThread))
-						else:
-							self.__logger.debug("Checking runner '" + runner.getIdName() + "' result")
-							if runner.isResultSuccess():
-								self.__logger.debug("Runner '" + runner.getIdName() + "' was successful: " + runner.getResultMessage())
+						runner.receiveProvision(requiredItem, self.__payloads[requiredItem][provider].getReader(op))
+						break
+					if toProcess:
+						self.__payloads[requiredItem][provider] = \
+							payloadBuffers.export(self.__payloads[requiredItem][provider])
+					runner.receiveProvision(requiredItem, self.__payloads[requiredItem][provider])
+					break
+
+	def _areRequirementsMet(self, op, delivered):
+		for requiredItem in self.__plan[op]['requires']:
+			if not workflowPlan.isRequirementMet(self.__plan[op], requiredItem, delivered.get(requiredItem, set())):
+				return False
+		return True
+
+	def _isRedundant(self, op, delivered):
+		""" An operation is redundant when every key it provides has already been delivered by another provider, and
+		all of its consumers take the first provider to finish
+		"""
+		if len(self.__plan[op]['provides']) == 0:
+			return False
+		for provisionKey in self.__plan[op]['provides']:
+			if len(delivered.get(provisionKey, set()) - set([op])) == 0:
+				return False
+			consumers = [dependent for dependent in self.__dependents[op] \
+				if op in self.__plan[dependent]['providedBy'].get(provisionKey, [])]
+			if len(consumers) == 0:
+				return False
+			for consumer in consumers:
+				if self.__plan[consumer]['providerMode'] != 'firstToFinish':
+					return False
+		return True
+
+	def _cancelRedundantOperations(self, delivered, redundant):
+		""" Cancel the running operations that have lost the race to deliver their provision keys """
+		for (op, runner) in list(self.__runnersByOperation.items()):
+			if op not in redundant and not runner.getResult()['done'] and self._isRedundant(op, delivered):
+				self.__logger.debug("Cancelling operation '" + op + "', other providers have already delivered its keys")
+				redundant.add(op)
+				runner.cancel()
+				if op in self.__speculativeRunners:
+					self.__speculativeRunners[op].cancel()
+
+	def _isRedundantFailure(self, op, runner, redundant):
+		""" Failures of operations cancelled for being redundant don't make the workflow fail """
+		if op in redundant and not runner.isResultSuccess():
+			self.__logger.debug("Redundant operation '" + op + "' stopped: " + runner.getResultMessage())
+			return True
+		return False
+
+	def _isHedgedFailure(self, op, runner, failed):
+		""" A failed provider whose consumers take the first provider to finish doesn't make the workflow fail, as long
+		as, for every key it provides, some other provider of each consumer has not failed yet. The given set keeps the
+		providers that have failed so far
+		"""
+		if runner.isResultSuccess() or len(self.__plan[op]['provides']) == 0:
+			return False
+		failed.add(op)
+		for provisionKey in self.__plan[op]['provides']:
+			consumers = [dependent for dependent in self.__dependents[op] \
+				if op in self.__plan[dependent]['providedBy'].get(provisionKey, [])]
+			if len(consumers) == 0:
+				return False
+			for consumer in consumers:
+				if self.__plan[consumer]['providerMode'] != 'firstToFinish':
+					return False
+				if all([provider in failed for provider in self.__plan[consumer]['providedBy'][provisionKey]]):
+					return False
+		self.__logger.warning("Operation '" + op + "' FAILED, other providers of its keys are still working: " \
+			+ runner.getResultMessage())
+		return True
+
+	def _runOperation(self, op, runner, eventQueue):
+		""" Thread body for an operation, it reports the runner back to the engine once it is done, either way """
+		try:
+			runner.execute()
+		except Exception as e:
+			runner.setError("Unhandled exception while running '" + runner.getIdName() + "', ERROR message: " + str(e))
+		finally:
+			resourceBudget.release(self.__plan[op]['resources'])
+			eventQueue.put(('finished', op, runner))
+
+	def _completeRemoteOperation(self, op, runner, future, eventQueue):
+		""" Callback for operations run in a worker process """
+		try:
+			replayRemoteResult(runner, future.result())
+		except Exception as e:
+			runner.setError("Unhandled exception while running '" + runner.getIdName() + "' in a worker process, " \
+				+ "ERROR message: " + str(e))
+		finally:
+			resourceBudget.release(self.__plan[op]['resources'])
+			eventQueue.put(('finished', op, runner))
+
+	def _submitOperation(self, op, runner, eventQueue):
+		""" Hand the operation, whose requirements have been met, to its executor """
+		executorName = self._getExecutorNameForOperation(op)
+		if runner.isComposite() or self._usesChannels(op):
+			# Composite operations wait for their own operations, and producers and readers of channels wait for each
+			# other, that's why they get a thread of their own instead of a worker from a shared pool
+			executors.createExecutor('thread').submit(self._runOperation, op, runner, eventQueue)
+		elif executors.isProcessExecutor(executorName):
+			self.__logger.debug("Operation '" + op + "' will run in a worker process")
+			future = submitToWorkerProcess(executors.createExecutor(executorName), runner, self.__plan[op]['factory'], \
+				self.__plan[op]['configFileName'])
+			future.add_done_callback(lambda f: self._completeRemoteOperation(op, runner, f, eventQueue))
+		else:
+			executors.createExecutor(executorName).submit(self._runOperation, op, runner, eventQueue)
+
+	def _checkOperationResult(self, runner, nRunning):
+		""" Raise an exception if the given runner, that has just finished, failed """
+		self.__logger.debug("Checking runner '" + runner.getIdName() + "' result")
+		if runner.isResultSuccess():
+			self.__logger.debug("Runner '" + runner.getIdName() + "' was successful: " + runner.getResultMessage())
+		else:
+			msg = "Runner '" + runner.getIdName() + "' FAILED: " + runner.getResultMessage()
+			self.__logger.error(msg)
+			self.setError(msg)
+			# The engine cancels the rest of the operations and it waits for them before reporting the error
+			msg = "A step in the workflow has failed, " + str(nRunning) + " runners were still working " \
+				+ "by the time the failure was detected, they are being cancelled and an exception is being raised" \
+				+ " to report the error"
+			self.__logger.error(msg)
+			raise WorkflowRunnerException(msg)
+
+	def _getOperationKey(self, op):
+		""" Key that identifies the work done by an operation across workflows and sessions """
+		return self.__plan[op]['factory'] + ":" + self.__plan[op]['configFileName']
+
+	def _getOperationWeight(self, op):
+		""" Duration of the operation, as configured, or as measured in previous sessions, or 1 second by default """
+		weight = self.__plan[op]['estimatedDuration']
+		if weight == None:
+			weight = durationHistory.getEstimatedDuration(self._getOperationKey(op), 1.0)
+		return weight
+
+	def _recordOperationDuration(self, op, runner, duration):
+		# Joins of flattened workflows would pass for very fast runs of the whole nested workflow
+		if runner.isResultSuccess() and self.__plan[op]['flattened'] == None:
+			durationHistory.recordDuration(self._getOperationKey(op), duration)
+
+	def _skipCompletedOperations(self, wfSequence, delivered):
+		""" Operations completed by the session being resumed are not run again, their provision keys are delivered
+		right away and they are recorded in the journal of this session as well. It returns the operations left to run
+		"""
+		toRun = []
+		for op in wfSequence:
+			# Items of channels are consumed as they are produced, their producers are always run again
+			if len(self.__plan[op]['outputs']) == 0 and completionJournal.isCompleted(self.__configFileName, \
+				self._getOperationPath(op), self.__plan[op]['configHash']):
+				self.__reporter.info("Operation '" + op + "' was completed by the resumed session, it is skipped")
+				self._computeFingerprint(op, delivered)
+				self._markDelivered(op, None, delivered)
+				self._recordCompletion(op)
+				self.__skipped.add(op)
+			else:
+				toRun.append(op)
+		return toRun
+
+	def _recordCompletion(self, op):
+		payloads = any([op in self.__payloads.get(provisionKey, {}) for provisionKey in self.__plan[op]['provides']])
+		try:
+			completionJournal.recordCompletion(self.__configFileName, self._getOperationPath(op), \
+				self.__plan[op]['configHash'], self.__plan[op]['provides'], payloads)
+		except OSError as e:
+			self.__logger.warning("Could not record operation '" + op + "' in the completion journal, " + str(e))
+
+	def _getProvisionDigest(self, requiredItem, provider):
+		""" Digest of what a provider has delivered for a requirement, the hash of its payload if it attached one, or
+		its fingerprint if it caches its result, as its result only depends on it then. 'None' if what it delivered is
+		unknown, because the provider may deliver something else next time with the same configuration
+		"""
+		payload = self.__payloads.get(requiredItem, {}).get(provider)
+		if payload is not None:
+			if isinstance(payload, payloadBuffers.MappedPayload):
+				payload = payload.getBuffer()
+			if isinstance(payload, (bytes, bytearray, memoryview)):
+				return hashlib.sha1(payload).hexdigest()
+			try:
+				return hashlib.sha1(pickle.dumps(payload)).hexdigest()
+			except Exception:
+				return None
+		if self.__plan[provider]['cache'] != None:
+			return self.__fingerprints.get(provider)
+		return None
+
+	def _computeFingerprint(self, op, delivered):
+		""" The fingerprint of an operation, whose requirements have been met, is a hash of its factory, its
+		configuration and the digests of what its requirements were delivered with. Operations whose requirements come
+		from providers that don't tell what they delivered get no fingerprint, their result can't be cached
+		"""
+		self.__fingerprints[op] = None
+		if self.__fingerprintSeed == None:
+			return
+		parts = [self.__fingerprintSeed, self.__plan[op]['factory'], self.__plan[op]['configHash']]
+		for requiredItem in sorted(self.__plan[op]['requires']):
+			for provider in self.__plan[op]['providedBy'][requiredItem]:
+				if provider in delivered.get(requiredItem, set()):
+					digest = self._getProvisionDigest(requiredItem, provider)
+					if digest == None:
+						return
+					parts.append(requiredItem + "=" + digest)
+		self.__fingerprints[op] = hashlib.sha1("\n".join(parts).encode('utf8')).hexdigest()
+
+	def _restoreCachedResult(self, op, runner):
+		""" Operations that opt in to result caching are not run if there is a cached result for their fingerprint,
+		their output files are restored and the cached result is replayed on their runner. It tells whether the result
+		was restored
+		"""
+		if self.__plan[op]['cache'] == None:
+			return False
+		if self.__fingerprints[op] == None:
+			self.__logger.debug("Operation '" + op + "' is run, what its requirements were delivered with is unknown")
+			return False
+		entry = resultCache.lookup(self.__fingerprints[op])
+		if entry == None:
+			return False
+		try:
+			resultCache.restoreOutputs(self.__fingerprints[op], entry, configManager.getManager().getWorkingDir())
+		except OSError as e:
+			self.__logger.warning("Could not restore the cached output files of operation '" + op + "', " + str(e))
+			return False
+		self.__reporter.info("Operation '" + op + "' is not run, its result has been restored from the result cache")
+		replayRemoteResult(runner, {'result': entry['result'], 'provisions': []})
+		return True
+
+	def _storeCachedResult(self, op, runner):
+		if self.__plan[op]['cache'] == None or self.__fingerprints[op] == None:
+			return
+		for provisionKey in self.__plan[op]['provides']:
+			if runner.getProvidedPayload(provisionKey) is not None:
+				# Payloads live in memory, a cached result would deliver its provision keys without them
+				self.__logger.debug("The result of operation '" + op + "' is not cached, it attached payloads")
+				return
+		try:
+			resultCache.store(self.__fingerprints[op], runner.getResult(), self.__plan[op]['cache']['outputs'], \
+				configManager.getManager().getWorkingDir())
+		except OSError as e:
+			self.__logger.warning("Could not cache the result of operation '" + op + "', " + str(e))
+
+	def _computePriorities(self, wfSequence):
+		""" The priority of an operation is the length of the longest path from it to the end of the workflow, so
+		operations in long chains of dependencies are started first when there are not enough slots for all of them
+		"""
+		# Providers always come before their dependents in the workflow sequence
+		priorities = {}
+		for op in reversed(wfSequence):
+			longestTail = 0
+			for dependent in self.__dependents[op]:
+				longestTail = max(longestTail, priorities[dependent])
+			priorities[op] = self._getOperationWeight(op) + longestTail
+		self.__logger.debug("Operation priorities (critical path length): " + str(priorities))
+		return priorities
+
+	def _shouldRetry(self, op, runner, attempt):
+		""" Tell whether an operation that has just finished is to be run again, after 'attempt' retries """
+		return not runner.isResultSuccess() and not self.isCancelled() and attempt < self.__plan[op]['retries']
+
+	def _getRetryDelay(self, op, runner, attempt):
+		""" Exponential backoff, the first retry waits 'backoff' seconds, and every following one twice as long as the
+		previous one
+		"""
+		delay = self.__plan[op]['backoff'] * (2 ** (attempt - 1))
+		msg = "Operation '" + op + "', runner " + runner.getIdName() + ", FAILED: " + runner.getResultMessage() \
+			+ ", retry " + str(attempt) + " of " + str(self.__plan[op]['retries']) + " in " + str(delay) + " seconds"
+		self.__logger.warning(msg)
+		self.__reporter.warning(msg)
+		return delay
+
+	def _checkDeadlines(self, runningOps, startedAt):
+		""" Raise if the session deadline has passed, or if a running operation has exceeded its timeout, in which case
+		it is cancelled
+		"""
+		now = time.time()
+		sessionDeadline = configManager.getManager().getSessionDeadline()
+		if sessionDeadline != None and now > sessionDeadline:
+			msg = "The session deadline has passed while running workflow '" + self.__config.getWorkflowId() + "'"
+			self.__logger.error(msg)
+			raise WorkflowRunnerException(msg)
+		for (op, runner) in runningOps.items():
+			timeout = self.__plan[op]['timeout']
+			if timeout != None and now - startedAt[op] > timeout:
+				msg = "Operation '" + op + "', runner " + runner.getIdName() + ", timed out after " + str(timeout) \
+					+ " seconds"
+				self.__logger.error(msg)
+				runner.cancel()
+				runner.setError(msg)
+				raise WorkflowRunnerException(msg)
+
+	def _getSpeculationDelay(self, op):
+		""" Seconds after which a running operation is taken for a straggler, 'None' if it is not idempotent or there is
+		no history of its durations to compare with
+		"""
+		if not self.__plan[op]['idempotent']:
+			return None
+		usualDuration = durationHistory.getEstimatedDuration(self._getOperationKey(op))
+		if usualDuration == None:
+			return None
+		return max(usualDuration * _stragglerFactor, usualDuration + _stragglerMinDelay)
+
+	def _findStragglers(self, runningOps, startedAt, racing):
+		""" Running operations that have become stragglers and have not been duplicated yet, with their elapsed time """
+		now = time.time()
+		stragglers = []
+		for op in runningOps:
+			delay = self._getSpeculationDelay(op)
+			if op not in racing and delay != None and now - startedAt[op] > delay:
+				stragglers.append((op, now - startedAt[op]))
+		return stragglers
+
+	def _startDuplicate(self, op, provisionCallback, elapsed):
+		""" Build a speculative duplicate of a straggler operation, if the node resource budget can afford it, 'None'
+		otherwise
+		"""
+		if not resourceBudget.tryAcquire(self.__plan[op]['resources']):
+			return None
+		msg = "Operation '" + op + "' has been running for " + "%.1f" % elapsed + " seconds, far longer than usual, " \
+			+ "a speculative duplicate of it is started"
+		self.__logger.warning(msg)
+		self.__reporter.warning(msg)
+		try:
+			return self._createRunner(op, provisionCallback, True)
+		except Exception:
+			resourceBudget.release(self.__plan[op]['resources'])
+			raise
+
+	def _settleRace(self, op, runner, racing, runningOps, startedAt, detached):
+		""" The runner of an operation with a speculative duplicate has finished. The first runner to succeed wins the
+		race and the other one is cancelled, a failed runner only loses it if the other one is still running. Losers are
+		not waited for, they are added to the given detached runners and finish on their own. It returns the runner whose
+		result stands for the operation, or 'None' if there is none yet
+		"""
+		if op not in racing:
+			return runner
+		race = racing[op]
+		race['running'].remove(runner)
+		if not runner.isResultSuccess() and len(race['running']) > 0:
+			self.__logger.warning("Runner " + runner.getIdName() + " of operation '" + op + "' FAILED, the other one is " \
+				+ "still running: " + runner.getResultMessage())
+			runningOps[op] = race['running'][0]
+			return None
+		del racing[op]
+		for loser in race['running']:
+			self.__logger.debug("Cancelling runner " + loser.getIdName() + ", it lost the race for operation '" + op \
+				+ "', it finishes detached")
+			loser.cancel()
+			detached.add(loser)
+		if runner is race['duplicate']:
+			self.__reporter.info("The speculative duplicate of operation '" + op + "' finished first")
+			startedAt[op] = race['duplicateStartedAt']
+		self.__runnersByOperation[op] = runner
+		self.__speculativeRunners.pop(op, None)
+		return runner
+
+	def _describeChannelWaits(self, op):
+		waits = []
+		for (producer, channels) in list(self.__channels.items()):
+			for channel in channels.values():
+				if producer == op and channel.isProducerBlocked():
+					waits.append("its output '" + channel.getName() + "' is full for readers " \
+						+ str(sorted(channel.getPendingReaders())))
+				elif producer != op and channel.isReaderWaiting(op):
+					waits.append("it waits for items of '" + channel.getName() + "' from '" + producer + "'")
+		return ", ".join(waits)
+
+	def _checkDeadlock(self, waitingOps, runningOps, delivered):
+		""" Raise if no operation can make progress, because those that have not been started wait for requirements,
+		and those running, if any, are blocked waiting for requirements too, or on channels whose other end can't make
+		progress either. The wait set of every operation is dumped
+		"""
+		for (op, runner) in runningOps.items():
+			if not runner.isWaitingForRequirements() and not self._isBlockedOnChannels(op):
+				return
+		if len(waitingOps) == 0 and len(runningOps) == 0:
+			return
+		waitSets = []
+		for op in waitingOps:
+			for requiredItem in self.__plan[op]['requires']:
+				deliveredBy = delivered.get(requiredItem, set())
+				if not workflowPlan.isRequirementMet(self.__plan[op], requiredItem, deliveredBy):
+					waitSets.append("operation '" + op + "' waits for '" + requiredItem + "' from " \
+						+ str(self.__plan[op]['providedBy'][requiredItem]) + " (" + self.__plan[op]['providerMode'] \
+						+ "), delivered by " + str(sorted(deliveredBy)))
+		for (op, runner) in runningOps.items():
+			if self._isBlockedOnChannels(op):
+				waitSets.append("operation '" + op + "', runner " + runner.getIdName() + ", is blocked on channels, " \
+					+ self._describeChannelWaits(op))
+			else:
+				waitSets.append("operation '" + op + "', runner " + runner.getIdName() + ", is blocked waiting for " \
+					+ str(sorted(runner.getWaitSet())))
+		msg = "Deadlock detected in workflow '" + self.__config.getWorkflowId() + "', no operation can make progress:" \
+			+ "\n\t" + "\n\t".join(waitSets)
+		self.__logger.error(msg)
+		self.__reporter.error(msg)
+		raise WorkflowRunnerException(msg)
+
+	def _runOperationsOnThreads(self, wfSequence, maxConcurrency):
+		""" Operations are only built and submitted to their executors once their requirements have been met, so they
+		never hold a worker while waiting. Ready operations are submitted in critical path order, as long as the node
+		resource budget can afford them, and redundant providers that have not been submitted yet are dropped.
+		Failed operations with retries left are built and submitted again once their backoff expires, while their
+		dependents keep waiting. The engine polls its event queue, so the watchdog can enforce timeouts and detect
+		deadlocks
+		"""
+		priorities = self._computePriorities(wfSequence)
+		# Runners report their provisions and their completion through the event queue, so we just block on it
+		eventQueue = queue.Queue()
+		provisionCallback = lambda op, provisionKey, runner: eventQueue.put(('provided', op, (provisionKey, runner)))
+		delivered = {}
+		redundant = set()
+		# Providers that have failed while others of their keys were still working
+		failed = set()
+		pending = sorted(self._skipCompletedOperations(wfSequence, delivered), key=lambda op: -priorities[op])
+		submittedAt = {}
+		runningOps = {}
+		# Failed operations waiting to be retried, with the time they can be submitted again
+		retryAt = {}
+		attempts = {}
+		# Operations whose result has been restored from the result cache
+		restored = set()
+		# Straggler operations racing against their speculative duplicates
+		racing = {}
+		# Runners that lost the race of their operation, still running but no longer waited for
+		detached = set()
+		nRunning = 0
+		# Resources given back by any engine in the application may let waiting operations in
+		resourcesListener = lambda: eventQueue.put(('released', None, None))
+		resourceBudget.addListener(resourcesListener)
+		# Wake the engine up if it is cancelled while nothing is running
+		self.getCancellationToken().addCallback(lambda: eventQueue.put(('cancelled', None, None)))
+		try:
+			while len(pending) > 0 or nRunning > 0 or len(retryAt) > 0:
+				if self.isCancelled():
+					raise WorkflowCancelledException("Workflow '" + self.__config.getWorkflowId() + "' has been cancelled")
+				for op in [op for (op, retryTime) in retryAt.items() if retryTime <= time.time()]:
+					del retryAt[op]
+					pending.append(op)
+					pending.sort(key=lambda op: -priorities[op])
+				waitingForResources = False
+				# Operations blocked on channels don't count against the concurrency limit, and readers of channels
+				# whose producer has started are not kept waiting by it, they start along with their producer
+				nActive = nRunning - len([op for op in runningOps if self._isBlockedOnChannels(op)])
+				for op in list(pending):
+					if maxConcurrency and nActive >= maxConcurrency and not self._readsStartedChannel(op):
+						continue
+					if self._isRedundant(op, delivered):
+						self.__logger.debug("Dropping operation '" + op + "', other providers have already delivered its keys")
+						pending.remove(op)
+						self.__skipped.add(op)
+						self._detachReader(op)
+					elif self._areRequirementsMet(op, delivered):
+						if not self._acquireResources(op):
+							# Operations that need less may still fit in
+							waitingForResources = True
+							continue
+						pending.remove(op)
+						try:
+							self._computeFingerprint(op, delivered)
+							runner = self._createRunner(op, provisionCallback)
+							if self._restoreCachedResult(op, runner):
+								restored.add(op)
+								resourceBudget.release(self.__plan[op]['resources'])
+								eventQueue.put(('finished', op, runner))
 							else:
-								msg = "Runner '" + runner.getIdName() + "' FAILED: " + runner.getResultMessage()
-								errMsg += msg + "\n"
-								self.__logger.error(msg)
-								self.setError(msg)
-								cancelWorkflow = True
-				runners = runnersKept
-				# Let's wait for a while
-				time.sleep(1)
+								self.__logger.debug("Submitting operation '" + op + "' being run by runner " \
+									+ runner.getIdName())
+								self._submitOperation(op, runner, eventQueue)
+						except Exception:
+							# The operation never started, the resources it took go back to the budget
+							if op not in restored:
+								resourceBudget.release(self.__plan[op]['resources'])
+							raise
+						submittedAt[op] = time.time()
+						runningOps[op] = runner
+						nRunning += 1
+						nActive += 1
+				if nRunning == 0 and len(pending) == 0 and len(retryAt) == 0:
+					break
+				if not waitingForResources and len(retryAt) == 0 \
+					and not any([self._areRequirementsMet(op, delivered) for op in pending]):
+					self._checkDeadlock(pending, runningOps, delivered)
+				pollTimeout = _watchdogInterval
+				if len(retryAt) > 0:
+					pollTimeout = max(0, min([pollTimeout, min(retryAt.values()) - time.time()]))
+				try:
+					(event, op, arg) = eventQueue.get(timeout=pollTimeout)
+				except queue.Empty:
+					event = None
+				self._checkDeadlines(runningOps, submittedAt)
+				for (straggler, elapsed) in self._findStragglers(runningOps, submittedAt, racing):
+					if maxConcurrency and nRunning >= maxConcurrency:
+						break
+					duplicate = self._startDuplicate(straggler, provisionCallback, elapsed)
+					if duplicate:
+						try:
+							self._submitOperation(straggler, duplicate, eventQueue)
+						except Exception:
+							resourceBudget.release(self.__plan[straggler]['resources'])
+							raise
+						racing[straggler] = {'running': [runningOps[straggler], duplicate], 'duplicate': duplicate, \
+							'duplicateStartedAt': time.time()}
+						nRunning += 1
+				if event == 'provided':
+					(provisionKey, provider) = arg
+					if provider in detached:
+						continue
+					self._markDelivered(op, provisionKey, delivered, provider)
+					self._cancelRedundantOperations(delivered, redundant)
+				elif event == 'finished':
+					if arg in detached:
+						# Its resources went back to the budget as it returned
+						self.__logger.debug("Runner " + arg.getIdName() + ", that lost the race for operation '" + op \
+							+ "', has stopped")
+						detached.discard(arg)
+						continue
+					nRunning -= 1
+					nDetached = len(detached)
+					runner = self._settleRace(op, arg, racing, runningOps, submittedAt, detached)
+					# Losers of the race no longer count as running
+					nRunning -= len(detached) - nDetached
+					if runner == None:
+						continue
+					del runningOps[op]
+					self._closeChannels(op, runner)
+					if op not in restored:
+						self._recordOperationDuration(op, runner, time.time() - submittedAt[op])
+					if self._isRedundantFailure(op, runner, redundant):
+						pass
+					elif self._shouldRetry(op, runner, attempts.get(op, 0)):
+						attempts[op] = attempts.get(op, 0) + 1
+						retryAt[op] = time.time() + self._getRetryDelay(op, runner, attempts[op])
+					elif self._isHedgedFailure(op, runner, failed):
+						pass
+					else:
+						self._checkOperationResult(runner, nRunning)
+						if op not in restored:
+							self._storeCachedResult(op, runner)
+						self._recordCompletion(op)
+		except BaseException:
+			# Whatever the failure, no operation outlives the engine
+			self._abortOperations(eventQueue, nRunning, detached)
+			raise
+		finally:
+			resourceBudget.removeListener(resourcesListener)
+			self._releaseReservations()
+
+	def _abortOperations(self, eventQueue, nRunning, detached):
+		""" Cancel every operation and wait for those still running to finish, those ignoring their cancellation are
+		abandoned after a grace period
+		"""
+		self._cancelOperations()
+		self.__logger.debug("Waiting for " + str(nRunning) + " cancelled operations to finish")
+		giveUpAt = time.time() + _cancellationGracePeriod
+		while nRunning > 0:
+			try:
+				(event, op, arg) = eventQueue.get(timeout=max(0, giveUpAt - time.time()))
+			except queue.Empty:
+				self.__logger.error(str(nRunning) + " cancelled operations have not finished after " \
+					+ str(_cancellationGracePeriod) + " seconds, they are abandoned")
+				return
+			if event == 'finished' and arg not in detached:
+				nRunning -= 1
+		self.__logger.debug("All cancelled operations have finished")
+
+	async def _runOperationAsync(self, op, runner, whenReturned=None):
+		""" Run an operation, whose requirements have been met, from the event loop. The given callback, if any, is
+		called once the runner has returned, if this coroutine is cancelled while its runner goes on in a thread or a
+		worker process, it is called from there when the runner returns
+		"""
+		executorName = self._getExecutorNameForOperation(op)
+		future = None
+		try:
+			if runner._skipIfCancelled():
+				pass
+			elif runner.isComposite():
+				# Composite operations block while waiting for their own operations, they get a thread of their own
+				await asyncio.to_thread(runner.execute)
+			elif executors.isProcessExecutor(executorName):
+				self.__logger.debug("Operation '" + op + "' will run in a worker process")
+				future = submitToWorkerProcess(executors.createExecutor(executorName), runner, \
+					self.__plan[op]['factory'], self.__plan[op]['configFileName'])
+				remote = await asyncio.wrap_future(future)
+				replayRemoteResult(runner, remote)
+			elif runner.isAsync():
+				await runner.executeAsync()
+			elif self._usesChannels(op):
+				# Producers and readers of channels wait for each other, they get a thread of their own
+				future = executors.createExecutor('thread').submit(runner.execute)
+				await asyncio.wrap_future(future)
+			else:
+				# Thread based runners are run by the shared thread pool
+				future = executors.createExecutor('pool').submit(runner.execute)
+				await asyncio.wrap_future(future)
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			runner.setError("Unhandled exception while running '" + runner.getIdName() + "', ERROR message: " + str(e))
+		finally:
+			if whenReturned != None:
+				if future != None and not future.done():
+					future.add_done_callback(lambda f: whenReturned())
+				else:
+					whenReturned()
+		return runner
+
+	async def _runOperationsOnEventLoop(self, wfSequence, maxConcurrency):
+		""" The whole operation graph is driven by a single event loop, requirements are tracked with asyncio events
+		and coroutine based runners don't need a thread of their own
+		"""
+		loop = asyncio.get_running_loop()
+		priorities = self._computePriorities(wfSequence)
+		delivered = {}
+		wfSequence = self._skipCompletedOperations(wfSequence, delivered)
+		redundant = set()
+		# Providers that have failed while others of their keys were still working
+		failed = set()
+		ready = {}
+		for op in wfSequence:
+			ready[op] = asyncio.Event()
+			if self._areRequirementsMet(op, delivered):
+				ready[op].set()
+
+		def markProvided(op, provisionKey, runner):
+			if runner in detached:
+				return
+			self._markDelivered(op, provisionKey, delivered, runner)
+			for dependent in self.__dependents[op]:
+				if dependent in ready and self._areRequirementsMet(dependent, delivered):
+					ready[dependent].set()
+			self._cancelRedundantOperations(delivered, redundant)
+			# Redundant operations that have not started yet are dropped
+			for (pendingOp, task) in zip(wfSequence, tasks):
+				if pendingOp not in started and pendingOp not in redundant and self._isRedundant(pendingOp, delivered):
+					self.__logger.debug("Dropping operation '" + pendingOp + "', other providers have already delivered " \
+						+ "its keys")
+					redundant.add(pendingOp)
+					self.__skipped.add(pendingOp)
+					self._detachReader(pendingOp)
+					task.cancel()
+
+		provisionCallback = lambda op, provisionKey, runner: loop.call_soon_threadsafe(markProvided, op, provisionKey, \
+			runner)
+		slots = None
+		if maxConcurrency:
+			slots = _PrioritySlots(maxConcurrency)
+
+		started = set()
+		startedAt = {}
+		runningOps = {}
+		restored = set()
+		# Operations holding a slot of the concurrency limit
+		slotHolders = set()
+		# Operations waiting for the node resource budget are woken up whenever any engine gives resources back
+		resourceWaiters = []
+
+		def wakeResourceWaiters():
+			while len(resourceWaiters) > 0:
+				resourceWaiters.pop().set()
+
+		def resourcesListener():
+			try:
+				loop.call_soon_threadsafe(wakeResourceWaiters)
+			except RuntimeError:
+				# Resources released by another engine right as this event loop finishes
+				pass
+
+		async def acquireResources(op):
+			while not self._acquireResources(op):
+				released = asyncio.Event()
+				resourceWaiters.append(released)
+				await released.wait()
+
+		retrying = set()
+
+		# Runners that lost the race of their operation, still running but no longer waited for, with whether they hold
+		# a slot of the concurrency limit
+		detached = {}
+
+		def releaseRun(op, holdsSlot):
+			""" Give back what a run took, it may be called from the thread its runner has returned on """
+			resourceBudget.release(self.__plan[op]['resources'])
+			if holdsSlot:
+				try:
+					loop.call_soon_threadsafe(slots.release)
+				except RuntimeError:
+					# The event loop has already finished, and slots with it
+					pass
+
+		def originalReturned(op, runner):
+			# The resources and slot of an operation are given back as usual unless its runner has lost the race
+			if runner in detached:
+				releaseRun(op, detached.pop(runner))
+
+		def duplicateReturned(op, duplicate, holdsSlot):
+			detached.pop(duplicate, None)
+			releaseRun(op, holdsSlot)
+
+		async def runSpeculatively(op, runner):
+			""" Run an operation, if it becomes a straggler a speculative duplicate of it is started, the first of them
+			to succeed wins and the other one is cancelled, and left to finish detached. It returns the runner whose
+			result stands, and the time it started
+			"""
+			runStartedAt = time.time()
+			delay = self._getSpeculationDelay(op)
+			if delay == None:
+				await self._runOperationAsync(op, runner)
+				return (runner, runStartedAt)
+			runs = {asyncio.ensure_future(self._runOperationAsync(op, runner, lambda: originalReturned(op, runner))): \
+				(runner, runStartedAt)}
+			speculateAt = runStartedAt + delay
+			try:
+				while True:
+					timeout = None
+					if speculateAt != None:
+						timeout = max(0, speculateAt - time.time())
+					(done, notDone) = await asyncio.wait(list(runs.keys()), timeout=timeout, \
+						return_when=asyncio.FIRST_COMPLETED)
+					for task in done:
+						(finished, finishedStartedAt) = runs.pop(task)
+						if finished.isResultSuccess() or len(runs) == 0:
+							if finished is not runner:
+								self.__reporter.info("The speculative duplicate of operation '" + op + "' finished first")
+							self.__runnersByOperation[op] = finished
+							self.__speculativeRunners.pop(op, None)
+							for (loser, loserStartedAt) in runs.values():
+								self.__logger.debug("Cancelling runner " + loser.getIdName() + ", it lost the race for " \
+									+ "operation '" + op + "', it finishes detached")
+								loser.cancel()
+								# The original runner takes the resources and slot of the operation with it
+								detached[loser] = loser is runner and op in slotHolders
+								if loser is runner:
+									slotHolders.discard(op)
+							return (finished, finishedStartedAt)
+						self.__logger.warning("Runner " + finished.getIdName() + " of operation '" + op + "' FAILED, the " \
+							+ "other one is still running: " + finished.getResultMessage())
+					if len(done) == 0:
+						speculateAt = time.time() + _watchdogInterval
+						holdsDuplicateSlot = slots != None and slots.tryAcquire()
+						if slots == None or holdsDuplicateSlot:
+							duplicate = self._startDuplicate(op, provisionCallback, time.time() - runStartedAt)
+							if duplicate:
+								task = asyncio.ensure_future(self._runOperationAsync(op, duplicate, \
+									lambda duplicate=duplicate, holdsSlot=holdsDuplicateSlot: \
+									duplicateReturned(op, duplicate, holdsSlot)))
+								runs[task] = (duplicate, time.time())
+								speculateAt = None
+							elif holdsDuplicateSlot:
+								slots.release()
+			except asyncio.CancelledError:
+				for task in runs:
+					task.cancel()
+				raise
+
+		async def runWhenReady(op):
+			""" Run an operation once its requirements have been met, again after a backoff every time it fails while
+			it has retries left
+			"""
+			attempt = 0
+			while True:
+				(op, runner) = await runAttempt(op)
+				if runner == None or op in redundant \
+					or not self._shouldRetry(op, runner, attempt):
+					return (op, runner)
+				attempt += 1
+				retrying.add(op)
+				try:
+					await asyncio.sleep(self._getRetryDelay(op, runner, attempt))
+				finally:
+					retrying.discard(op)
+
+		async def runAttempt(op):
+			try:
+				try:
+					await ready[op].wait()
+					# Readers of channels whose producer has started don't wait for a slot, they start along with it
+					if slots and not self._readsStartedChannel(op):
+						await slots.acquire(priorities[op])
+						slotHolders.add(op)
+					await acquireResources(op)
+				except asyncio.CancelledError:
+					if op in redundant:
+						return (op, None)
+					raise
+				original = None
+				try:
+					# From here on, the operation is only stopped by its cancellation token
+					started.add(op)
+					self._computeFingerprint(op, delivered)
+					runner = self._createRunner(op, provisionCallback)
+					original = runner
+					startedAt[op] = time.time()
+					runningOps[op] = runner
+					if self._restoreCachedResult(op, runner):
+						restored.add(op)
+					else:
+						self.__logger.debug("Running operation '" + op + "' by runner " + runner.getIdName())
+						(runner, runStartedAt) = await runSpeculatively(op, runner)
+						self._recordOperationDuration(op, runner, time.time() - runStartedAt)
+				finally:
+					runningOps.pop(op, None)
+					if original not in detached:
+						resourceBudget.release(self.__plan[op]['resources'])
+			finally:
+				if op in slotHolders:
+					slotHolders.discard(op)
+					slots.release()
+			return (op, runner)
+
+		def releaseBlockedSlots():
+			""" Operations blocked on channels give their slot back, they don't count against the concurrency limit """
+			for op in list(slotHolders):
+				if op in runningOps and self._isBlockedOnChannels(op):
+					self.__logger.debug("Operation '" + op + "' is blocked on channels, it gives its slot back")
+					slotHolders.discard(op)
+					slots.release()
+
+		resourceBudget.addListener(resourcesListener)
+		tasks = [asyncio.ensure_future(runWhenReady(op)) for op in wfSequence]
+		remaining = set(tasks)
+		try:
+			while len(remaining) > 0:
+				# The watchdog checks timeouts, the session deadline and deadlocks every time it wakes up
+				(done, remaining) = await asyncio.wait(remaining, timeout=_watchdogInterval, \
+					return_when=asyncio.FIRST_COMPLETED)
+				try:
+					releaseBlockedSlots()
+					for task in done:
+						(op, runner) = task.result()
+						if runner:
+							self._closeChannels(op, runner)
+						if runner and not self._isRedundantFailure(op, runner, redundant) \
+							and not self._isHedgedFailure(op, runner, failed):
+							self._checkOperationResult(runner, len(runningOps))
+							if op not in restored:
+								self._storeCachedResult(op, runner)
+							self._recordCompletion(op)
+					if len(remaining) > 0:
+						self._checkDeadlines(runningOps, startedAt)
+						waitingOps = [op for (op, task) in zip(wfSequence, tasks) if op not in started and not task.done()]
+						if len(retrying) == 0 and not any([ready[op].is_set() for op in waitingOps]):
+							self._checkDeadlock(waitingOps, runningOps, delivered)
+				except BaseException:
+					# Whatever the failure, operations that have not started yet are dropped, the rest of them are
+					# cancelled and awaited, those ignoring their cancellation are abandoned after a grace period
+					self._cancelOperations()
+					for (op, task) in zip(wfSequence, tasks):
+						if op not in started:
+							task.cancel()
+					(done, notDone) = await asyncio.wait(tasks, timeout=_cancellationGracePeriod)
+					if len(notDone) > 0:
+						self.__logger.error(str(len(notDone)) + " cancelled operations have not finished after " \
+							+ str(_cancellationGracePeriod) + " seconds, they are abandoned")
+					else:
+						self.__logger.debug("All cancelled operations have finished")
+					raise
+		finally:
+			resourceBudget.removeListener(resourcesListener)
+			for task in tasks:
+				task.cancel()
+			self._releaseReservations()
+
+	def _execute(self):
+		self.__reporter.info("BEGIN --- workflow ID '" + self.__config.getWorkflowId() + "'")
+		try:
+			# Get the compiled plan of the workflow, it has already been checked for composition errors, and it tells
+			# the provider and consumers of every provision key. Runners are not instantiated until their operations
+			# are about to be run
+			plan = workflowPlan.getWorkflowPlan(self.__configFileName, self)
+			wfSequence = plan['sequence']
+			self.__logger.debug("WORKFLOW SEQUENCE loaded: " + str(wfSequence))
+			self.__plan = plan['operations']
+			self.__dependents = plan['dependents']
+			# Run workflows in parallel, the watchdog of the engine fails it fast on timeouts and deadlocks
+			maxConcurrency = self.__config.getMaxConcurrency()
+			if self.__config.getEngineMode() == "asyncio":
+				self.__logger.debug("Running operations on an event loop, max concurrency " + str(maxConcurrency))
+				asyncio.run(self._runOperationsOnEventLoop(wfSequence, maxConcurrency))
+			else:
+				self.__logger.debug("Running operations with executor '" + self.__config.getExecutorName() \
+					+ "', max concurrency " + str(maxConcurrency))
+				self._runOperationsOnThreads(wfSequence, maxConcurrency)
 			self.__logger.debug("All runners have finished")
 		except Exception as e:
 			# We make sure any exception is captured to finish gently and report the error or success situation
@@ -251,6 +1781,10 @@ class WorkflowEngine(WorkflowRunner):
 			self.__reporter.error(msg)
 			self.setError(msg)
 		finally:
+			try:
+				durationHistory.save()
+			except Exception as e:
+				self.__logger.warning("Could not save the history of operation durations, " + str(e))
 			self.__reporter.info("END   --- workflow ID '" + self.__config.getWorkflowId() + "'")
 # END of Abstract Factory Product ###################################################################################
 
@@ -0,0 +1,555 @@
+# No interpreter information, as it is not meant to be run alone
+
+#####################################################################################################################
+#											Compiled Workflow Plans													#
+#####################################################################################################################
+
+# This module compiles a workflow config file, and all of its nested sub-workflows, into plans the engine can run
+# without parsing the config files of its operations again. For every workflow, the plan keeps its sequence of
+# operations with their factories, config files and provision keys, the providers of every requirement of each
+# operation and the dependents of every operation, as found by the static composition check.
+# Nested workflow operations can be flattened, 'flatten': true in their definition or in the workflow config for all of
+# them, so their operations, and those of the workflows nested in them, are inlined in the plan of the parent workflow
+# with namespaced IDs, '<operation>/<inner operation>', and run by the same engine as soon as their own requirements are
+# met. The flattened operation is left in place as a join, it requires every inlined operation to have finished
+# Compiled plans are cached in memory and in the resources folder, every plan records a hash of the content of every
+# config file involved, so it is only reused while none of them changes
+
+import os
+import re
+import json
+import hashlib
+import threading
+import configManager
+import workflows.executors as executors
+import workflows.streamChannels as streamChannels
+from exceptions import WorkflowRunnerException
+
+# Bump this whenever the layout of compiled plans changes, so cached plans are not reused
+_planFormatVersion = 13
+_cacheFolderName = 'planCache'
+# How requirements with more than one provider are met: by the first provider in the workflow sequence, by the first
+# provider to deliver it, or by all of them
+_providerModes = ['workflowOrder', 'firstToFinish', 'all']
+# Seconds to wait before the first retry of a failed operation that doesn't set its 'backoff'
+_defaultBackoff = 1.0
+# Width of map operations that don't set one, one instance per CPU
+_defaultMapWidth = os.cpu_count() or 1
+# Factories whose runners execute nested workflows
+_compositeFactories = ['workflowEngine']
+# Suffix of the provision keys the last operations of a flattened workflow deliver to its join operation
+_doneKeySuffix = ':done'
+# Executor of the join operations of flattened workflows, they have nothing to run
+_joinExecutor = 'pool'
+# Compiled plans by absolute path of their workflow config file, sessions may use different config folders
+_plans = {}
+_lock = threading.Lock()
+
+def _getConfigFilePath(configFileName):
+	return os.path.abspath(os.path.join(configManager.getManager().getConfigFolder(), configFileName))
+
+def _getCacheFilePath(configFileName):
+	""" Plans of workflows with the same file name in different config folders are cached in different files """
+	cacheFolder = os.path.join(configManager.getManager().getResourcesFolder(), _cacheFolderName)
+	pathHash = hashlib.sha1(_getConfigFilePath(configFileName).encode('utf8')).hexdigest()[:16]
+	return os.path.join(cacheFolder, re.sub(r'[^A-Za-z0-9_.-]', '_', configFileName) + '-' + pathHash + '.plan')
+
+def _hashFile(filePath):
+	with open(filePath, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+def _isUpToDate(plan):
+	""" Tell whether none of the config files a plan was compiled from has changed """
+	try:
+		for (filePath, fileHash) in plan['files'].items():
+			if _hashFile(filePath) != fileHash:
+				return False
+	except OSError:
+		return False
+	return True
+
+def _readConfigFile(configFileName, files, director):
+	""" Read a JSON config file, recording the hash of its content """
+	configFilePath = _getConfigFilePath(configFileName)
+	try:
+		with open(configFilePath, 'rb') as cf:
+			content = cf.read()
+		files[configFilePath] = hashlib.sha1(content).hexdigest()
+		return json.loads(content.decode('utf8'))
+	except Exception as e:
+		msg = "Config file " + configFilePath + " could not be read, because " + str(e)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+
+def _getKey(config, key, configFileName, director):
+	if key in config:
+		return config[key]
+	msg = "Could not find '" + key + "' in config file " + _getConfigFilePath(configFileName)
+	director.getReporter().error(msg)
+	raise WorkflowRunnerException(msg)
+
+def _getProviderMode(config, configFileName, default, director):
+	providerMode = config.get('providerMode', default)
+	if providerMode not in _providerModes:
+		msg = "Unknown providerMode '" + str(providerMode) + "' in config file " + _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	return providerMode
+
+def isRequirementMet(operationPlan, requiredItem, deliveredBy):
+	""" Tell whether a requirement of an operation is met, given the set of operations that have delivered it """
+	providers = operationPlan['providedBy'][requiredItem]
+	if operationPlan['providerMode'] == 'all':
+		return all([provider in deliveredBy for provider in providers])
+	if operationPlan['providerMode'] == 'firstToFinish':
+		return any([provider in deliveredBy for provider in providers])
+	# Legacy behavior, the first provider in the workflow is the one
+	return providers[0] in deliveredBy
+
+def _getMapDefinition(opDefinition, op, configFileName, director):
+	""" Validated map settings of an operation, the input list, or glob, it is run over, how many instances of it can
+	run at the same time and the optional reduce step, 'None' for ordinary operations
+	"""
+	if 'map' not in opDefinition:
+		return None
+	mapDefinition = opDefinition['map']
+	msg = None
+	if not isinstance(mapDefinition, dict) or not isinstance(mapDefinition.get('inputs'), (list, str)):
+		msg = "Map operation " + op + " must have an 'inputs' list or glob"
+	elif not isinstance(mapDefinition.get('width', _defaultMapWidth), int) \
+		or mapDefinition.get('width', _defaultMapWidth) < 1:
+		msg = "Invalid width '" + str(mapDefinition.get('width')) + "' for map operation " + op
+	elif 'reduce' in mapDefinition and (not isinstance(mapDefinition['reduce'], dict) \
+		or 'factory' not in mapDefinition['reduce'] or 'configFileName' not in mapDefinition['reduce']):
+		msg = "The reduce step of map operation " + op + " must have a 'factory' and a 'configFileName'"
+	if msg:
+		msg += " at config file " + _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	return {
+		'inputs': mapDefinition['inputs'],
+		'width': mapDefinition.get('width', _defaultMapWidth),
+		'reduce': mapDefinition.get('reduce')
+	}
+
+def _getResources(opDefinition, op, configFileName, director):
+	""" Validated amounts of node resources an operation consumes while running, e.g. {"cpu": 4, "memMB": 8000} """
+	resources = opDefinition.get('resources', {})
+	valid = isinstance(resources, dict)
+	if valid:
+		for amount in resources.values():
+			if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount < 0:
+				valid = False
+	if not valid:
+		msg = "Invalid resources '" + str(resources) + "' for operation " + op + " at config file " \
+			+ _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	return resources
+
+def _getTimeout(opDefinition, op, configFileName, director):
+	""" Validated number of seconds an operation is allowed to run, 'None' if there is no limit """
+	timeout = opDefinition.get('timeout')
+	if timeout == None:
+		return None
+	if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+		msg = "Invalid timeout '" + str(timeout) + "' for operation " + op + " at config file " \
+			+ _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	return timeout
+
+def _getRetryPolicy(opDefinition, op, configFileName, director):
+	""" Validated number of times a failed operation is run again, and seconds to wait before the first retry """
+	retries = opDefinition.get('retries', 0)
+	backoff = opDefinition.get('backoff', _defaultBackoff)
+	if isinstance(retries, bool) or not isinstance(retries, int) or retries < 0 \
+		or isinstance(backoff, bool) or not isinstance(backoff, (int, float)) or backoff < 0:
+		msg = "Invalid retries '" + str(retries) + "' or backoff '" + str(backoff) + "' for operation " + op \
+			+ " at config file " + _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	return (retries, backoff)
+
+def _getCacheDefinition(opDefinition, op, configFileName, director):
+	""" Validated result caching settings of an operation, with the glob patterns, relative to the session working
+	dir, of its output files, 'None' if it doesn't opt in
+	"""
+	cacheDefinition = opDefinition.get('cache', False)
+	if cacheDefinition == False:
+		return None
+	if 'map' in opDefinition:
+		# The fingerprint of an operation doesn't cover the items a map operation is run over, nor their content
+		msg = "Map operation " + op + " can't cache its result at config file " + _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	if cacheDefinition == True:
+		return {'outputs': []}
+	if isinstance(cacheDefinition, dict) and isinstance(cacheDefinition.get('outputs', []), list):
+		return {'outputs': cacheDefinition.get('outputs', [])}
+	msg = "Invalid cache settings '" + str(cacheDefinition) + "' for operation " + op + " at config file " \
+		+ _getConfigFilePath(configFileName)
+	director.getReporter().error(msg)
+	raise WorkflowRunnerException(msg)
+
+def _getOutputs(opConfig, op, factoryName, operationPlan, configFileName, director):
+	""" Validated streaming outputs an operation declares in its config file, by output name, with the capacity of their
+	reader queues and what happens when they are full
+	"""
+	outputs = opConfig.get('outputs', {})
+	msg = None
+	if not isinstance(outputs, dict):
+		msg = "Invalid outputs '" + str(outputs) + "' for operation " + op
+	elif len(outputs) > 0 and (factoryName in _compositeFactories or operationPlan['map']):
+		msg = "Operation " + op + " can't have outputs, only operations run by a single runner can"
+	elif len(outputs) > 0 and (operationPlan['retries'] > 0 or operationPlan['cache'] != None):
+		msg = "Operation " + op + " can't have outputs, their items are consumed as they are produced, so it can't " \
+			+ "be retried nor its result cached"
+	else:
+		for (outputName, outputDefinition) in outputs.items():
+			if not isinstance(outputDefinition, dict) \
+				or outputDefinition.get('overflow', 'block') not in streamChannels._overflowPolicies \
+				or isinstance(outputDefinition.get('capacity', 1), bool) \
+				or not isinstance(outputDefinition.get('capacity', 1), int) or outputDefinition.get('capacity', 1) < 1:
+				msg = "Invalid output '" + outputName + "' " + str(outputDefinition) + " for operation " + op
+	if msg:
+		msg += " at config file " + _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	validOutputs = {}
+	for (outputName, outputDefinition) in outputs.items():
+		validOutputs[outputName] = {
+			'capacity': outputDefinition.get('capacity', streamChannels._defaultCapacity),
+			'overflow': outputDefinition.get('overflow', 'block')
+		}
+	return validOutputs
+
+def _checkChannelReader(operationPlan, op, requiredItem, configFileName, director):
+	""" Operations reading a channel take its items as they are produced, a second run of them would find the channel
+	already drained, so they can't be retried, duplicated nor have their result cached
+	"""
+	if operationPlan['retries'] > 0 or operationPlan['cache'] != None or operationPlan['idempotent']:
+		msg = "Operation " + op + " reads the channel '" + requiredItem + "', its items are consumed as they are " \
+			+ "produced, so it can't be retried, be idempotent nor have its result cached, at config file " \
+			+ _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+
+def _isIdempotent(opDefinition, op, operationPlan, configFileName, director):
+	""" Tell whether an operation can be run twice at the same time, so the engine may start a speculative duplicate of
+	it when it runs far slower than usual
+	"""
+	idempotent = opDefinition.get('idempotent', False)
+	msg = None
+	if not isinstance(idempotent, bool):
+		msg = "Invalid idempotent '" + str(idempotent) + "' for operation " + op
+	elif idempotent and (operationPlan['factory'] in _compositeFactories or operationPlan['map'] \
+		or len(operationPlan['outputs']) > 0):
+		msg = "Operation " + op + " can't be idempotent, only operations run by a single runner and without outputs " \
+			+ "can be duplicated"
+	if msg:
+		msg += " at config file " + _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	return idempotent
+
+def _checkExecutorName(executorName, op, configFileName, director):
+	if executorName != None and executorName not in executors.getExecutorNames():
+		msg = "Unknown executor '" + str(executorName) + "' for operation " + op + " at config file " \
+			+ _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	return executorName
+
+def _getEstimatedDuration(opDefinition, op, configFileName, director):
+	""" Configured duration, in seconds, of an operation, 'None' if there is none """
+	if 'estimatedDuration' not in opDefinition:
+		return None
+	try:
+		return float(opDefinition['estimatedDuration'])
+	except (ValueError, TypeError):
+		msg = "Invalid estimatedDuration for operation " + op + " at config file " + _getConfigFilePath(configFileName)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+
+def _isFlattened(opDefinition, op, configFileName, default, director):
+	""" Tell whether the given operation, running a nested workflow, is to be inlined in the plan of its workflow """
+	flattenable = opDefinition.get('factory') in _compositeFactories and 'map' not in opDefinition
+	if 'flatten' not in opDefinition:
+		# The workflow wide setting only applies to the nested workflows that can be flattened
+		return default == True and flattenable
+	flatten = opDefinition['flatten']
+	if isinstance(flatten, bool) and (flattenable or not flatten):
+		return flatten
+	msg = "Invalid flatten '" + str(flatten) + "' for operation " + op + ", only nested workflows that are not " \
+		+ "map operations can be flattened, at config file " + _getConfigFilePath(configFileName)
+	director.getReporter().error(msg)
+	raise WorkflowRunnerException(msg)
+
+def _readOperationConfig(factoryName, opConfigFileName, plans, files, director, visiting):
+	""" Config of an operation, nested workflows are compiled and the config files read are added to 'files' """
+	if factoryName in _compositeFactories:
+		_compileWorkflow(opConfigFileName, plans, director, visiting)
+		subPlan = plans[opConfigFileName]
+		files.update(subPlan['files'])
+		return subPlan['config']
+	return _readConfigFile(opConfigFileName, files, director)
+
+def _compileWorkflow(configFileName, plans, director, visiting):
+	""" Compile the given workflow, and its nested sub-workflows, into the given dictionary of plans """
+	if configFileName in visiting:
+		msg = "Workflow config file " + configFileName + " includes itself, through " + str(visiting)
+		director.getReporter().error(msg)
+		raise WorkflowRunnerException(msg)
+	files = {}
+	wfConfig = _readConfigFile(configFileName, files, director)
+	operationDefinitions = _getKey(wfConfig, 'operations', configFileName, director)
+	plan = {
+		'configFileName': configFileName,
+		'config': wfConfig,
+		'sequence': _getKey(wfConfig, 'workflow', configFileName, director),
+		'operations': {},
+		'dependents': {},
+		'files': files
+	}
+	workflowProviderMode = _getProviderMode(wfConfig, configFileName, 'workflowOrder', director)
+	# Nested workflow operations to be inlined
+	flattenOps = []
+	for op in plan['sequence']:
+		if op not in operationDefinitions:
+			msg = "Operation " + op + " of the workflow sequence is not defined at config file " \
+				+ _getConfigFilePath(configFileName)
+			director.getReporter().error(msg)
+			raise WorkflowRunnerException(msg)
+		factoryName = _getKey(operationDefinitions[op], 'factory', configFileName, director)
+		opConfigFileName = _getKey(operationDefinitions[op], 'configFileName', configFileName, director)
+		# Config files read for this operation, they identify, along with its definition, the work it does
+		opFiles = {}
+		opConfig = _readOperationConfig(factoryName, opConfigFileName, plans, opFiles, director, \
+			visiting + [configFileName])
+		plan['operations'][op] = {
+			'factory': factoryName,
+			'configFileName': opConfigFileName,
+			'provides': _getKey(opConfig, 'provides', opConfigFileName, director),
+			'requires': _getKey(opConfig, 'requires', opConfigFileName, director),
+			'providerMode': _getProviderMode(operationDefinitions[op], configFileName, workflowProviderMode, director),
+			'providedBy': {},
+			'map': _getMapDefinition(operationDefinitions[op], op, configFileName, director),
+			'resources': _getResources(operationDefinitions[op], op, configFileName, director),
+			'timeout': _getTimeout(operationDefinitions[op], op, configFileName, director),
+			'cache': _getCacheDefinition(operationDefinitions[op], op, configFileName, director),
+			'executor': _checkExecutorName(operationDefinitions[op].get('executor'), op, configFileName, director),
+			'estimatedDuration': _getEstimatedDuration(operationDefinitions[op], op, configFileName, director),
+			'flattened': None
+		}
+		if _isFlattened(operationDefinitions[op], op, configFileName, wfConfig.get('flatten', False), director):
+			flattenOps.append(op)
+		(plan['operations'][op]['retries'], plan['operations'][op]['backoff']) = \
+			_getRetryPolicy(operationDefinitions[op], op, configFileName, director)
+		# Outputs are provision keys too, consumers require them as any other key
+		plan['operations'][op]['outputs'] = _getOutputs(opConfig, op, factoryName, plan['operations'][op], \
+			opConfigFileName, director)
+		for outputName in plan['operations'][op]['outputs']:
+			if outputName not in plan['operations'][op]['provides']:
+				plan['operations'][op]['provides'] = plan['operations'][op]['provides'] + [outputName]
+		plan['operations'][op]['idempotent'] = _isIdempotent(operationDefinitions[op], op, plan['operations'][op], \
+			configFileName, director)
+		if plan['operations'][op]['map']:
+			# Every instance of a map operation consumes the declared resources
+			plan['operations'][op]['map']['resources'] = plan['operations'][op]['resources']
+			plan['operations'][op]['resources'] = {}
+		elif factoryName in _compositeFactories:
+			# Nested workflows are accounted for by their own operations, a nested engine holding resources while its
+			# operations wait for them could starve the whole node
+			plan['operations'][op]['resources'] = {}
+		reduceDefinition = plan['operations'][op]['map'] and plan['operations'][op]['map']['reduce']
+		if reduceDefinition:
+			# The map operation provides what its reduce step provides, and the reduce step may require, besides what
+			# the mapped instances provide, items from the antecesors of the map operation
+			reduceConfig = _readOperationConfig(reduceDefinition['factory'], reduceDefinition['configFileName'], \
+				plans, opFiles, director, visiting + [configFileName])
+			mapProvides = plan['operations'][op]['provides']
+			plan['operations'][op]['provides'] = _getKey(reduceConfig, 'provides', reduceDefinition['configFileName'], \
+				director)
+			for requiredItem in _getKey(reduceConfig, 'requires', reduceDefinition['configFileName'], director):
+				if requiredItem not in mapProvides and requiredItem not in plan['operations'][op]['requires']:
+					plan['operations'][op]['requires'] = plan['operations'][op]['requires'] + [requiredItem]
+		plan['operations'][op]['configHash'] = hashlib.sha1((json.dumps(operationDefinitions[op], sort_keys=True) \
+			+ json.dumps(sorted(opFiles.values()))).encode('utf8')).hexdigest()
+		files.update(opFiles)
+	# Static composition check, every requirement must be provided by antecesors of the operation in the workflow
+	providers = {}
+	for op in plan['sequence']:
+		plan['dependents'][op] = []
+		for requiredItem in plan['operations'][op]['requires']:
+			if requiredItem in providers:
+				if plan['operations'][op]['providerMode'] == 'workflowOrder':
+					# Even if there could be more providers for a particular item, only the first one in the workflow
+					# is taken into account
+					plan['operations'][op]['providedBy'][requiredItem] = providers[requiredItem][:1]
+				else:
+					plan['operations'][op]['providedBy'][requiredItem] = providers[requiredItem][:]
+				for provider in plan['operations'][op]['providedBy'][requiredItem]:
+					if op not in plan['dependents'][provider]:
+						plan['dependents'][provider].append(op)
+					if requiredItem in plan['operations'][provider]['outputs']:
+						_checkChannelReader(plan['operations'][op], op, requiredItem, configFileName, director)
+			else:
+				msg = "Workflow Processing ERROR - operation " + op + " run by factory '" \
+					+ plan['operations'][op]['factory'] + "' requires '" + requiredItem \
+					+ "' but it is not provided by any of the antecesors of the workflow " + configFileName
+				director.getReporter().error(msg)
+				raise WorkflowRunnerException(msg)
+		for provisionKey in plan['operations'][op]['provides']:
+			if provisionKey not in providers:
+				providers[provisionKey] = []
+			providers[provisionKey].append(op)
+	if len(flattenOps) > 0:
+		(plan['sequence'], plan['operations'], plan['dependents']) = \
+			_flattenOperations(plan, flattenOps, plans, director)
+	plans[configFileName] = plan
+
+def _getInlinedOperations(plan, op, plans, director):
+	""" Sequence and operations, with namespaced IDs, that replace the given nested workflow operation of a plan. The
+	nested workflows of its own operations are inlined too, the first operations of the nested workflow wait for the
+	requirements of the nested workflow operation, and the last ones deliver a key to its join operation
+	"""
+	subPlan = plans[plan['operations'][op]['configFileName']]
+	subFlattenOps = [innerOp for innerOp in subPlan['sequence'] \
+		if subPlan['operations'][innerOp]['factory'] in _compositeFactories \
+		and not subPlan['operations'][innerOp]['map'] and subPlan['operations'][innerOp]['flattened'] == None]
+	(subSequence, subOperations, subDependents) = _flattenOperations(subPlan, subFlattenOps, plans, director)
+	subExecutor = _checkExecutorName(subPlan['config'].get('executor'), op, subPlan['configFileName'], director)
+	sequence = []
+	operations = {}
+	for innerOp in subSequence:
+		inlinedOp = op + "/" + innerOp
+		sequence.append(inlinedOp)
+		operations[inlinedOp] = dict(subOperations[innerOp])
+		operations[inlinedOp]['provides'] = list(subOperations[innerOp]['provides'])
+		operations[inlinedOp]['requires'] = list(subOperations[innerOp]['requires'])
+		operations[inlinedOp]['providedBy'] = {}
+		for (requiredItem, providers) in subOperations[innerOp]['providedBy'].items():
+			operations[inlinedOp]['providedBy'][requiredItem] = [op + "/" + provider for provider in providers]
+		if operations[inlinedOp]['executor'] == None:
+			operations[inlinedOp]['executor'] = subExecutor
+		if operations[inlinedOp]['flattened'] != None:
+			operations[inlinedOp]['flattened'] = [op + "/" + flattenedOp for flattenedOp in operations[inlinedOp]['flattened']]
+		if len(operations[inlinedOp]['requires']) == 0:
+			# Nothing in the nested workflow runs before its own requirements have been met
+			operations[inlinedOp]['requires'] = list(plan['operations'][op]['requires'])
+			operations[inlinedOp]['providedBy'] = dict(plan['operations'][op]['providedBy'])
+			operations[inlinedOp]['providerMode'] = plan['operations'][op]['providerMode']
+	join = dict(plan['operations'][op])
+	join['requires'] = list(join['requires'])
+	join['providedBy'] = dict(join['providedBy'])
+	for innerOp in subSequence:
+		if len(subDependents[innerOp]) == 0:
+			doneKey = op + "/" + innerOp + _doneKeySuffix
+			operations[op + "/" + innerOp]['provides'].append(doneKey)
+			join['requires'].append(doneKey)
+			join['providedBy'][doneKey] = [op + "/" + innerOp]
+	# The work of the nested workflow is accounted for by its inlined operations
+	join.update({'flattened': sequence[:], 'executor': _joinExecutor, 'estimatedDuration': 0.0, 'cache': None, \
+		'timeout': None, 'retries': 0})
+	sequence.append(op)
+	operations[op] = join
+	return (sequence, operations)
+
+def _flattenOperations(plan, flattenOps, plans, director):
+	""" Sequence, operations and dependents of a plan once the given nested workflow operations have been inlined.
+	Consumers of the keys provided by a nested workflow get them from the inlined operations providing them, the first
+	one in the nested workflow unless they take all of their providers, and from its join operation otherwise
+	"""
+	sequence = []
+	operations = {}
+	# Providers of the keys of every flattened operation, by provision key
+	replacements = {}
+	for op in plan['sequence']:
+		if op not in flattenOps:
+			sequence.append(op)
+			operations[op] = dict(plan['operations'][op])
+			continue
+		(inlinedSequence, inlinedOperations) = _getInlinedOperations(plan, op, plans, director)
+		sequence += inlinedSequence
+		operations.update(inlinedOperations)
+		replacements[op] = {}
+		for inlinedOp in inlinedSequence[:-1]:
+			for provisionKey in inlinedOperations[inlinedOp]['provides']:
+				replacements[op].setdefault(provisionKey, []).append(inlinedOp)
+	for op in sequence:
+		providedBy = {}
+		for (requiredItem, providers) in operations[op]['providedBy'].items():
+			providedBy[requiredItem] = []
+			for provider in providers:
+				if provider in replacements and requiredItem in replacements[provider]:
+					if operations[op]['providerMode'] == 'workflowOrder':
+						providedBy[requiredItem] += replacements[provider][requiredItem][:1]
+					else:
+						providedBy[requiredItem] += replacements[provider][requiredItem]
+				else:
+					providedBy[requiredItem].append(provider)
+		operations[op]['providedBy'] = providedBy
+	dependents = {}
+	for op in sequence:
+		dependents[op] = []
+		for requiredItem in operations[op]['requires']:
+			for provider in operations[op]['providedBy'][requiredItem]:
+				if op not in dependents[provider]:
+					dependents[provider].append(op)
+	return (sequence, operations, dependents)
+
+def _loadCachedPlans(configFileName, director):
+	""" Return the plans cached on disk for the given workflow, if they are still up to date """
+	try:
+		with open(_getCacheFilePath(configFileName)) as cf:
+			cached = json.load(cf)
+	except (OSError, ValueError):
+		return None
+	if cached.get('formatVersion') != _planFormatVersion or configFileName not in cached.get('plans', {}) \
+		or not _isUpToDate(cached['plans'][configFileName]):
+		director.getLogger().debug("Cached plan for workflow " + configFileName + " is out of date")
+		return None
+	return cached['plans']
+
+def _saveCachedPlans(configFileName, plans, director):
+	cacheFilePath = _getCacheFilePath(configFileName)
+	tmpFilePath = cacheFilePath + ".tmp" + str(os.getpid()) + "-" + str(threading.get_ident())
+	try:
+		os.makedirs(os.path.dirname(cacheFilePath), exist_ok=True)
+		with open(tmpFilePath, "w") as cf:
+			json.dump({'formatVersion': _planFormatVersion, 'plans': plans}, cf)
+		os.replace(tmpFilePath, cacheFilePath)
+	except Exception as e:
+		director.getLogger().warning("Could not cache the plan for workflow " + configFileName + ", " + str(e))
+
+def getWorkflowPlan(configFileName, director):
+	""" Return the compiled plan for the given workflow config file, it is compiled only if there is no up to date
+	plan for it in memory or in the cache folder
+	"""
+	with _lock:
+		plan = _plans.get(_getConfigFilePath(configFileName))
+	if plan and _isUpToDate(plan):
+		return plan
+	plans = _loadCachedPlans(configFileName, director)
+	if plans:
+		director.getLogger().debug("Using cached plan for workflow " + configFileName)
+	else:
+		director.getLogger().debug("Compiling plan for workflow " + configFileName)
+		plans = {}
+		_compileWorkflow(configFileName, plans, director, [])
+		_saveCachedPlans(configFileName, plans, director)
+	with _lock:
+		for (planConfigFileName, plan) in plans.items():
+			_plans[_getConfigFilePath(planConfigFileName)] = plan
+	return plans[configFileName]
+
+def getCompiledWorkflowConfig(configFileName):
+	""" Return the content of a workflow config file, as found when its plan was compiled, or None if there is no plan
+	for it in memory yet
+	"""
+	with _lock:
+		plan = _plans.get(_getConfigFilePath(configFileName))
+	if plan:
+		return plan['config']
+	return None
@@ -21,10 +21,15 @@
 # Application modules
 import os
 import json
+import time
+import uuid
+import asyncio
 import threading
+import contextvars
 import configManager
 from exceptions import *
 from workflows.observer import *
+import workflows.payloadBuffers as payloadBuffers
 
 
 # Base class for handling configuration
@@ -68,6 +73,51 @@ class WfConfManager():
 		key = "requires"
 		return self._getValueForKey(key)
 
+# Cancellation support for runners
+class CancellationToken():
+	""" Flag shared between a runner and whoever wants to stop it. Cancellation is cooperative, long execution bodies
+	should poll it, wait on it or await it, and finish as soon as possible once it has been cancelled
+	"""
+	def __init__(self):
+		self.__cancelled = threading.Event()
+		self.__callbacks = []
+		self.__lock = threading.Lock()
+
+	def cancel(self):
+		with self.__lock:
+			if self.__cancelled.is_set():
+				return
+			self.__cancelled.set()
+			callbacks = self.__callbacks[:]
+		for callback in callbacks:
+			callback()
+
+	def isCancelled(self):
+		return self.__cancelled.is_set()
+
+	def wait(self, timeout=None):
+		""" Block until the token is cancelled or the timeout expires, it returns whether it has been cancelled """
+		return self.__cancelled.wait(timeout)
+
+	def addCallback(self, callback):
+		""" Register a callable to be called upon cancellation, right away if it has already been cancelled """
+		with self.__lock:
+			if not self.__cancelled.is_set():
+				self.__callbacks.append(callback)
+				return
+		callback()
+
+	async def waitAsync(self):
+		""" Coroutine version of 'wait' for the event loop it is awaited from """
+		loop = asyncio.get_running_loop()
+		cancelled = asyncio.Event()
+		self.addCallback(lambda: loop.call_soon_threadsafe(cancelled.set))
+		await cancelled.wait()
+
+	def raiseIfCancelled(self):
+		if self.isCancelled():
+			raise WorkflowCancelledException("The execution has been cancelled")
+
 # Base class for runners
 class WorkflowRunner(Observable, Observer):
 	"""docstring for WorkflowRunner"""
@@ -78,6 +128,14 @@ class WorkflowRunner(Observable, Observer):
 		self.__waitingForReqs = set()
 		self.__readyToGo = threading.Condition()
 		self.__result = {'msg': 'No message set', 'success': True, 'done': False}
+		self.__cancellationToken = CancellationToken()
+		self.__input = None
+		self.__waitingForRequirements = False
+		# Payloads attached by this runner to its provision keys, and the ones it has received for its requirements
+		self.__providedPayloads = {}
+		self.__receivedProvisions = {}
+		# Channels of the outputs of this runner, by output name
+		self.__outputs = {}
 
 	def provides(self):
 		raise NotImplementedError("WorkflowRunner - method 'provides' must be implemented by subclasses")
@@ -114,6 +172,58 @@ class WorkflowRunner(Observable, Observer):
 		self.__result['msg'] = msg
 		self.__result['success'] = False
 
+	def getInput(self):
+		""" Item of the input list of a map operation this runner has been given, 'None' for ordinary operations """
+		return self.__input
+
+	def setInput(self, inputItem):
+		self.__input = inputItem
+
+	def getProvidedPayload(self, provisionKey):
+		""" Payload this runner attached to the given provision key, 'None' if it didn't attach any """
+		return self.__providedPayloads.get(provisionKey)
+
+	def receiveProvision(self, requiredItem, payload):
+		""" Hand this runner the payload one of its providers attached to the given requirement """
+		self.__receivedProvisions[requiredItem] = payload
+
+	def getReceivedProvisions(self):
+		""" Payloads received for the requirements of this runner, as they were handed over """
+		return dict(self.__receivedProvisions)
+
+	def getProvision(self, requiredItem):
+		""" Payload attached to the given requirement by the runner that provided it, 'None' if there is no payload.
+		In-process providers share it by reference, payloads from worker processes come as read only memory views
+		"""
+		return payloadBuffers.resolve(self.__receivedProvisions.get(requiredItem))
+
+	def attachOutput(self, outputName, channel):
+		""" Hand this runner the channel of one of its outputs, the engine does it before running it """
+		self.__outputs[outputName] = channel
+
+	def getOutput(self, outputName):
+		""" Channel of one of the outputs of this runner, the items put on it reach its consumers while it runs """
+		if outputName not in self.__outputs:
+			msg = "Runner " + self.getIdName() + " has no output '" + str(outputName) + "', its outputs are " \
+				+ str(list(self.__outputs.keys()))
+			self.getReporter().error(msg)
+			raise WorkflowRunnerException(msg)
+		return self.__outputs[outputName]
+
+	def getCancellationToken(self):
+		return self.__cancellationToken
+
+	def isCancelled(self):
+		return self.__cancellationToken.isCancelled()
+
+	def cancel(self):
+		""" Ask this runner to stop, it wakes it up if it is still waiting for its requirements """
+		self.getLogger().debug("Cancelling runner " + self.getIdName())
+		self.__cancellationToken.cancel()
+		self.__readyToGo.acquire()
+		self.__readyToGo.notifyAll()
+		self.__readyToGo.release()
+
 	def observe(self, runner, requiredItem):
 		""" Implements the default behavior for observing observables """
 		self.getLogger().debug("Running default implementation of method 'observe', subscribing runner " \
@@ -131,13 +241,18 @@ class WorkflowRunner(Observable, Observer):
 			+ "runner " + runner.getIdName() + ", provider of " + str(runner.provides()))
 		self.__readyToGo.acquire()
 		if arg:
-			self.getLogger.debug("Runner " + runner.getIdName() + " just provided " + arg)
-			self.__waitingForReqs.remove(arg)
+			self.getLogger().debug("Runner " + runner.getIdName() + " just provided " + arg)
+			self.__waitingForReqs.discard(arg)
+			provisionKeys = [arg]
 		else:
 			self.getLogger().debug("Runner " + runner.getIdName() + " provided all its provision keys")
 			for provisionKey in runner.provides():
 				if provisionKey in self.__waitingForReqs:
 					self.__waitingForReqs.remove(provisionKey)
+			provisionKeys = runner.provides()
+		for provisionKey in provisionKeys:
+			if runner.getProvidedPayload(provisionKey) is not None:
+				self.receiveProvision(provisionKey, runner.getProvidedPayload(provisionKey))
 		# Check if we got all our requirements covered
 		if len(self.__waitingForReqs) == 0:
 			# Notify waiting threads
@@ -145,8 +260,28 @@ class WorkflowRunner(Observable, Observer):
 			self.__readyToGo.notifyAll()
 		self.__readyToGo.release()
 
-	def jobDone(self, provisionKey = None):
-		""" Default behavior for the runner """
+	def provide(self, provisionKey, payload = None):
+		""" Release one of the provision keys of this runner, from its execution body, so the consumers of that key can
+		start before the runner finishes. A payload can be attached to the key for its consumers. Every provision key is
+		delivered anyway once the runner finishes successfully
+		"""
+		if provisionKey not in self.provides() and provisionKey not in self.__outputs:
+			msg = "Runner " + self.getIdName() + " can't provide '" + str(provisionKey) + "', it only provides " \
+				+ str(self.provides())
+			self.getReporter().error(msg)
+			raise WorkflowRunnerException(msg)
+		if payload is not None:
+			self.__providedPayloads[provisionKey] = payload
+		self.getLogger().debug("Runner " + self.getIdName() + " provides '" + provisionKey + "' before finishing")
+		self.setChanged()
+		self.notifyObservers(provisionKey)
+
+	def jobDone(self, provisionKey = None, payload = None):
+		""" Default behavior for the runner, a payload can be attached to the given provision key for its consumers.
+		Runners releasing provision keys while they are still running should use 'provide' instead
+		"""
+		if provisionKey and payload is not None:
+			self.__providedPayloads[provisionKey] = payload
 		if self.getResult()['success']:
 			self.getLogger().debug("Notifying observers that I'M DONE, runner " \
 				+ self.getIdName())
@@ -156,15 +291,45 @@ class WorkflowRunner(Observable, Observer):
 		else:
 			self.getLogger().error("This Workflow finished with error state, so OBSERVERS WILL NOT BE NOTIFIED")
 
+	def isComposite(self):
+		""" Composite runners wait on other runners while they execute """
+		return False
+
+	def isAsync(self):
+		""" Asynchronous runners implement their execution body as a coroutine """
+		return False
+
+	def isWaitingForRequirements(self):
+		""" Tell whether this runner is blocked in 'waitForRequirements' right now """
+		return self.__waitingForRequirements
+
+	def getWaitSet(self):
+		""" Requirements this runner is still waiting for """
+		self.__readyToGo.acquire()
+		try:
+			return set(self.__waitingForReqs)
+		finally:
+			self.__readyToGo.release()
+
 	def waitForRequirements(self):
 		self.getLogger().debug("Running default implementation of waiting for requirements to be met, runner " \
 			+ self.getIdName())
 		self.__readyToGo.acquire()
-		while len(self.__waitingForReqs) > 0:
-			self.getLogger().debug("This thread woke up, but there still are requirements to be met in the queue")
+		while len(self.__waitingForReqs) > 0 and not self.isCancelled():
+			self.__waitingForRequirements = True
 			self.__readyToGo.wait()
+			self.__waitingForRequirements = False
+			self.getLogger().debug("This thread woke up, checking whether there still are requirements to be met")
 		self.__readyToGo.release()
 
+	def _skipIfCancelled(self):
+		""" Set the result of a runner that has been cancelled before running its execution body """
+		if self.isCancelled():
+			self.getLogger().debug("Runner " + self.getIdName() + " has been cancelled, its execution is skipped")
+			self.setError("Runner " + self.getIdName() + " was cancelled before running")
+			return True
+		return False
+
 	def _execute(self):
 		""" This method should be overriden by subclasses to put their main execution workflow """
 		self.getLogger("YOU SHOULD OVERRIDE method _execute with your workflow execution")
@@ -172,5 +337,157 @@ class WorkflowRunner(Observable, Observer):
 	def execute(self):
 		""" A kind of template method for workflow executions """
 		self.waitForRequirements()
+		if self._skipIfCancelled():
+			return
 		self._execute()
 		self.jobDone()
+
+# Base class for runners whose execution body is a coroutine
+class AsyncWorkflowRunner(WorkflowRunner):
+	""" Runners of this kind implement '_execute' as a coroutine. A WorkflowEngine in 'asyncio' mode runs them on its
+	event loop, anywhere else they get an event loop of their own when executed
+	"""
+	def __init__(self):
+		super(AsyncWorkflowRunner, self).__init__()
+
+	def isAsync(self):
+		return True
+
+	async def _execute(self):
+		""" This coroutine should be overriden by subclasses to put their main execution workflow """
+		self.getLogger().warning("YOU SHOULD OVERRIDE coroutine _execute with your workflow execution")
+
+	async def executeAsync(self):
+		""" Template for running from an event loop, by then, requirements must have been met """
+		if self._skipIfCancelled():
+			return
+		await self._execute()
+		self.jobDone()
+
+	def execute(self):
+		""" A kind of template method for workflow executions """
+		self.waitForRequirements()
+		if self._skipIfCancelled():
+			return
+		asyncio.run(self._execute())
+		self.jobDone()
+
+# Support for running runners in worker processes
+class _ProvisionRecorder(Observer):
+	""" It keeps the provision notifications of a runner, so they can be sent back to the parent process """
+	def __init__(self):
+		Observer.__init__(self)
+		self.__provisions = []
+		self.__payloads = {}
+
+	def update(self, runner, arg=None):
+		self.__provisions.append(arg)
+		if arg and runner.getProvidedPayload(arg) is not None:
+			self.__payloads[arg] = payloadBuffers.export(runner.getProvidedPayload(arg))
+
+	def getProvisions(self):
+		return self.__provisions
+
+	def getPayloads(self):
+		return self.__payloads
+
+# Cancellation of runners in worker processes is forwarded through a flag file in the working dir of the session, workers
+# poll it, and runners ignoring their cancellation are abandoned by the worker after a grace period, in seconds
+_cancellationsFolderName = 'cancellations'
+_cancellationPollInterval = 0.2
+_workerCancellationGracePeriod = 10.0
+
+def _raiseCancellationFlag(cancellationFlag):
+	try:
+		os.makedirs(os.path.dirname(cancellationFlag), exist_ok=True)
+		open(cancellationFlag, "w").close()
+	except OSError:
+		pass
+
+def _lowerCancellationFlag(cancellationFlag):
+	try:
+		os.remove(cancellationFlag)
+	except OSError:
+		pass
+
+def submitToWorkerProcess(executor, runner, factoryName, configFileName):
+	""" Hand the execution body of the given runner to an executor that runs it in a worker process, cancelling the
+	runner cancels its instance in the worker too. It returns the future of the task, whose result is replayed on the
+	runner with 'replayRemoteResult'
+	"""
+	cancellationFlag = os.path.join(configManager.getManager().getWorkingDir(), _cancellationsFolderName, \
+		uuid.uuid4().hex)
+	future = executor.submit(executeInWorkerProcess, factoryName, configFileName, runner.getInput(), \
+		runner.getReceivedProvisions(), cancellationFlag)
+	runner.getCancellationToken().addCallback(lambda: future.done() or _raiseCancellationFlag(cancellationFlag))
+	future.add_done_callback(lambda f: _lowerCancellationFlag(cancellationFlag))
+	return future
+
+def _runExecutionBody(runner):
+	if runner.isAsync():
+		asyncio.run(runner._execute())
+	else:
+		runner._execute()
+
+def _runCancellableExecutionBody(runner, cancellationFlag):
+	""" Run the execution body of a runner on a thread of its own, while the flag file is polled for its cancellation.
+	If the runner doesn't finish within the grace period after being cancelled, it is abandoned, so the worker is free
+	to take other tasks and its process is not kept alive by it
+	"""
+	failure = []
+	def runBody():
+		try:
+			_runExecutionBody(runner)
+		except BaseException as e:
+			failure.append(e)
+	body = threading.Thread(target=contextvars.copy_context().run, args=(runBody,), daemon=True)
+	body.start()
+	cancelledAt = None
+	while body.is_alive():
+		body.join(_cancellationPollInterval)
+		if cancelledAt == None and os.path.exists(cancellationFlag):
+			runner.cancel()
+			cancelledAt = time.time()
+		elif cancelledAt != None and body.is_alive() and time.time() - cancelledAt > _workerCancellationGracePeriod:
+			runner.getLogger().error("Runner " + runner.getIdName() + " has not finished " \
+				+ str(_workerCancellationGracePeriod) + " seconds after being cancelled, it is abandoned")
+			runner.setError("Cancelled, the runner was abandoned by its worker process")
+			return
+	if len(failure) > 0:
+		raise failure[0]
+
+def executeInWorkerProcess(factoryName, configFileName, inputItem=None, provisions=None, cancellationFlag=None):
+	""" Task for a worker process, it builds its own instance of the runner, whose requirements have already been met
+	in the parent process, hands it the payloads of its requirements, and it runs its execution body. The result object
+	and the provision notifications of the runner, along with their payloads, are returned, so the parent process can
+	replay them on its own instance of the runner
+	"""
+	factory = configManager.getManager().getWorkflowFactoryInstance(factoryName)
+	runner = factory.createWorkflowRunner(configFileName)
+	runner.setInput(inputItem)
+	for (requiredItem, payload) in (provisions or {}).items():
+		runner.receiveProvision(requiredItem, payload)
+	recorder = _ProvisionRecorder()
+	runner.addObserver(recorder)
+	try:
+		if cancellationFlag:
+			_runCancellableExecutionBody(runner, cancellationFlag)
+		else:
+			_runExecutionBody(runner)
+	finally:
+		# Worker processes outlive the tasks they run, they don't keep the payloads of their requirements mapped
+		payloadBuffers.unmap(configManager.getManager().getWorkingDir())
+	return {'result': dict(runner.getResult()), 'provisions': list(recorder.getProvisions()), \
+		'payloads': dict(recorder.getPayloads())}
+
+def replayRemoteResult(runner, remote):
+	""" Replay on the local runner the result and provision notifications of its run in a worker process """
+	if remote['result']['success']:
+		runner.setSuccess(remote['result']['msg'])
+	else:
+		runner.setError(remote['result']['msg'])
+	payloads = remote.get('payloads', {})
+	for provisionKey in remote['provisions']:
+		if provisionKey and remote['result']['success']:
+			runner.provide(provisionKey, payloads.get(provisionKey))
+	runner.jobDone()